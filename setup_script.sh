@@ -42,7 +42,7 @@ clone_git () {
 
 setup_software () {
 	local GIT_XPADNEO="https://github.com/atar-axis/xpadneo.git"
-	sudo apt install -y zip joystick pigpio python3-pip git dkms raspberrypi-kernel-headers
+	sudo apt install -y zip joystick pigpio python3-pip python3-numpy git dkms raspberrypi-kernel-headers
 	sudo pip3 install evdev	pigpio
 	git clone $GIT_XPADNEO
 	cd xpadneo && sudo ./install.sh && cd ~
@@ -111,16 +111,25 @@ setup_autostart () {
 	local SCRIPT="/home/$USER/$TEAM/main.py"
 	local FILE="/etc/systemd/system/teamprojekt.service"
 	sudo touch $FILE
-	echo '
+	echo "
 [Unit]
-Description="Autostart Teamprojekt"
-After=multi-user.target
+Description=Autostart Teamprojekt
+Wants=pigpiod.service
+After=pigpiod.service bluetooth.target
 [Service]
-Type=idle
+Type=notify
+NotifyAccess=main
 ExecStart=/usr/bin/python3 ${SCRIPT}
+TimeoutStartSec=150
+WatchdogSec=2
+Restart=on-failure
+RestartSec=1
+ExecStopPost=-/usr/bin/pigs s 5 1500 s 6 1500
+LimitRTPRIO=99
+LimitMEMLOCK=infinity
 [Install]
 WantedBy=multi-user.target
-	' | sudo tee $FILE > /dev/null
+	" | sudo tee $FILE > /dev/null
 	sudo chmod 644 $FILE
 	sudo systemctl daemon-reload
 	sudo systemctl enable $FILE
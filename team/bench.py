@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Durchsatz-Benchmark der Regelstrecke Controller -> Zuordnung -> Servos/RC-Regler -> pigpio.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from sim import SimPi, ReplayDevice, trigger_sweep, stick_jitter, button_storm
+from latency import Histogram
+from evdev import InputEvent, ecodes
+import json
+import platform
+import sys
+import time
+
+SCENARIOS = {
+	'trigger_sweep': lambda duration, rate: trigger_sweep(duration=duration, rate=rate),
+	'stick_jitter': lambda duration, rate: stick_jitter(duration=duration, rate=rate),
+	'button_storm': lambda duration, rate: button_storm(duration=duration, rate=rate),
+}
+RATES = (100, 500, 1000, 5000)
+
+class Pipeline():
+	def __init__(self, tick_rate:float=50.):
+		"""Regelstrecke wie in main.py, aber mit SimPi und virtueller Zeit.
+		Args:
+			tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to 50..
+		"""
+		from bus import Bus
+		from dev import Controller
+		from esc import Esc
+		from servo import Servo
+		from ramp import EscRamp
+		from mapping import Mapping
+		self.pi = SimPi()
+		self.bus = Bus(pi=self.pi, auto_flush=False)
+		self.servos = (Servo(12,0,180,90,0,False, bus=self.bus), Servo(13, 0, 180, 90, 0, False, bus=self.bus))
+		self.escs = (Esc(5, bus=self.bus, arm=False), Esc(6, bus=self.bus, arm=False))
+		self.ramp = EscRamp(self.escs)
+		self.ctrl = Controller(dev=ReplayDevice([]))
+		self.mapping = Mapping(self.ctrl, self.servos, self.escs)
+		self.period = 1. / tick_rate
+		self.t_virtual = 0.
+
+	def run(self, events:list):
+		"""Events zu Frames zusammenfassen und takteweise verarbeiten, so schnell wie moeglich.
+		Args:
+			events (list): Events als (Zeit, type, code, value)
+		Returns:
+			dict: Messwerte des Laufs
+		"""
+		for esc in self.escs:
+			esc.esc_write(esc.pw_stop)
+		self.bus.flush()
+		calls_start = len(self.pi.calls)
+		histogram = Histogram()
+		received = self.ctrl.events_received
+		idx = 0
+		# Virtuelle Zeit laeuft ueber alle Laeufe weiter, damit die Rampe konsistent bleibt
+		t_offset = self.t_virtual
+		t_wall = time.perf_counter()
+		t_cpu = time.process_time()
+		while idx < len(events):
+			self.t_virtual += self.period
+			tick_start = time.perf_counter()
+			pending = None
+			while idx < len(events) and t_offset + events[idx][0] < self.t_virtual:
+				t, event_type, code, value = events[idx]
+				idx += 1
+				frame = self.ctrl.frame_feed(InputEvent(0, 0, event_type, code, value))
+				if frame is not None:
+					pending = frame if pending is None else frame._replace(changed=pending.changed | frame.changed)
+			if pending is not None:
+				self.mapping.handle_frame(pending)
+			self.mapping.update(self.t_virtual)
+			self.ramp.step(self.t_virtual)
+			self.bus.flush()
+			histogram.record(int((time.perf_counter() - tick_start) * 1e6))
+		t_wall = time.perf_counter() - t_wall
+		t_cpu = time.process_time() - t_cpu
+		calls = len(self.pi.calls) - calls_start
+		received = self.ctrl.events_received - received
+		return {
+			'events': received,
+			'ticks': histogram.count,
+			'events_per_sec': received / t_wall if t_wall else 0.,
+			'pigpio_calls_per_event': calls / received if received else 0.,
+			'cpu_us_per_event': 1e6 * t_cpu / received if received else 0.,
+			'tick_us_p50': histogram.percentile(50),
+			'tick_us_p99': histogram.percentile(99),
+			'tick_us_max': histogram.max,
+		}
+
+
+def bench(duration:float=2., rates:tuple=RATES, scenarios:tuple=None, tick_rate:float=50.):
+	"""Alle Szenarien mit steigender Eventrate messen.
+	Args:
+		duration (float, optional): Virtuelle Dauer je Lauf in s. Defaults to 2..
+		rates (tuple, optional): Eventraten in Hz. Defaults to RATES.
+		scenarios (tuple, optional): Namen der Szenarien. Defaults to None (alle).
+		tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to 50..
+	Returns:
+		dict: Ergebnisse, {'meta': {...}, 'results': {scenario: {rate: Messwerte}}}
+	"""
+	pipeline = Pipeline(tick_rate)
+	results = {}
+	for name in scenarios or SCENARIOS:
+		results[name] = {}
+		for rate in rates:
+			results[name][str(rate)] = pipeline.run(SCENARIOS[name](duration, rate))
+	return {
+		'meta': {
+			'version': __version__,
+			'python': platform.python_version(),
+			'machine': platform.machine(),
+			'duration': duration,
+			'tick_rate': tick_rate,
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		},
+		'results': results,
+	}
+
+def bench_compare(old:dict, new:dict, threshold:float=0.1):
+	"""Zwei Benchmark-Ergebnisse vergleichen und Verschlechterungen melden.
+	Args:
+		old (dict): Referenzergebnis
+		new (dict): Neues Ergebnis
+		threshold (float, optional): Zulaessige relative Verschlechterung. Defaults to 0.1.
+	Returns:
+		list: Verschlechterungen als (scenario, rate, metric, old, new)
+	"""
+	# Kennzahl -> True, wenn groessere Werte besser sind
+	metrics = {'events_per_sec': True, 'pigpio_calls_per_event': False, 'cpu_us_per_event': False, 'tick_us_p99': False}
+	regressions = []
+	for name, rates in new['results'].items():
+		for rate, values in rates.items():
+			reference = old['results'].get(name, {}).get(rate)
+			if reference is None:
+				continue
+			for metric, higher_is_better in metrics.items():
+				a, b = reference[metric], values[metric]
+				if higher_is_better and b < a * (1 - threshold):
+					regressions.append((name, rate, metric, a, b))
+				elif not higher_is_better and b > a * (1 + threshold) and b - a > 1e-9:
+					regressions.append((name, rate, metric, a, b))
+	return regressions
+
+def bench_report(result:dict):
+	"""Returns:
+		str: Tabelle der Benchmark-Ergebnisse
+	"""
+	lines = ['{:<14} {:>6} {:>8} {:>12} {:>11} {:>10} {:>10}'.format(
+		'scenario', 'rate', 'events', 'events/s', 'calls/event', 'cpu us/ev', 'tick p99')]
+	for name, rates in result['results'].items():
+		for rate, values in rates.items():
+			lines.append('{:<14} {:>6} {:>8} {:>12.0f} {:>11.3f} {:>10.2f} {:>10}'.format(name, rate, values['events'],
+				values['events_per_sec'], values['pigpio_calls_per_event'], values['cpu_us_per_event'], values['tick_us_p99']))
+	return '\n'.join(lines)
+
+def bench_fleet(counts:tuple=(1, 2, 4, 8, 16), duration:float=2., rate:float=200.):
+	"""Latenz je Fahrzeug in Abhaengigkeit der Anzahl Fahrzeuge in einer Eventschleife messen (Echtzeit, SimPi).
+	Jedes Fahrzeug erhaelt einen Trigger-Sweep und Stick-Rauschen mit der angegebenen Eventrate,
+	bis zu vier Fahrzeuge teilen sich einen simulierten pigpio-Host.
+	Args:
+		counts (tuple, optional): Anzahl Fahrzeuge je Lauf. Defaults to (1, 2, 4, 8, 16).
+		duration (float, optional): Dauer je Lauf in s. Defaults to 2..
+		rate (float, optional): Eventrate je Achse und Fahrzeug in Hz. Defaults to 200..
+	Returns:
+		dict: Messwerte je Anzahl Fahrzeuge
+	"""
+	import asyncio
+	from fleet import fleet_build
+	from startup import BootLog
+	results = {}
+	for count in counts:
+		config = {}
+		devs = {}
+		for idx in range(count):
+			name = 'boat{}'.format(idx)
+			slot = 12 + 4 * (idx % 4)
+			config[name] = {'host': 'sim{}'.format(idx // 4), 'servos': (slot, slot + 1), 'escs': (slot + 2, slot + 3)}
+			events = sorted(trigger_sweep(duration=duration, rate=rate) + stick_jitter(duration=duration, rate=rate, seed=idx),
+				key=lambda event: event[0])
+			devs[name] = ReplayDevice(events + [(duration + 0.2, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)], uniq=name)
+		fleet = fleet_build(config, pi_factory=lambda host: SimPi(), devs=devs, boot=BootLog())
+		t_cpu = time.process_time()
+		asyncio.run(fleet.run())
+		t_cpu = time.process_time() - t_cpu
+		p50, p99, late, handler = [], [], [], []
+		for vehicle in fleet.vehicles:
+			stats = vehicle.stats()
+			for channel, stages in stats['latency'].items():
+				if channel.startswith(vehicle.name + '.engine') and stages['event_write']['count']:
+					p50.append(stages['event_write']['p50'])
+					p99.append(stages['event_write']['p99'])
+			late.append(stats['phases']['tick_late']['p99'])
+			handler.append(stats['phases']['handler']['mean'])
+		results[str(count)] = {
+			'vehicles': count,
+			'event_write_p50': sum(p50) / len(p50) if p50 else 0.,
+			'event_write_p99_max': max(p99) if p99 else 0,
+			'tick_late_p99_max': max(late),
+			'handler_us_mean': sum(handler) / len(handler),
+			'cpu_percent': 100. * t_cpu / (duration + 0.2),
+		}
+	return results
+
+def bench_fleet_report(results:dict):
+	"""Returns:
+		str: Tabelle der Fahrzeug-Latenzen in us
+	"""
+	lines = ['{:>8} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('vehicles', 'p50', 'p99 max', 'late p99', 'handler', 'cpu %')]
+	for values in results.values():
+		lines.append('{:>8} {:>10.0f} {:>10} {:>10} {:>10.1f} {:>8.1f}'.format(values['vehicles'], values['event_write_p50'],
+			values['event_write_p99_max'], values['tick_late_p99_max'], values['handler_us_mean'], values['cpu_percent']))
+	return '\n'.join(lines)
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Throughput benchmark of the control pipeline with a simulated pigpio backend.')
+	parser.add_argument('-o', '--output', help='write results as JSON')
+	parser.add_argument('-d', '--duration', type=float, default=2., help='virtual duration per run in s (default: 2)')
+	parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two JSON results and flag regressions')
+	parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative regression (default: 0.1)')
+	parser.add_argument('--fleet', type=int, nargs='*', metavar='N', help='measure per-vehicle latency for N vehicles in one process (default: 1 2 4 8 16)')
+	args = parser.parse_args()
+	if args.fleet is not None:
+		result = bench_fleet(tuple(args.fleet) or (1, 2, 4, 8, 16), args.duration)
+		print(bench_fleet_report(result))
+		if args.output:
+			with open(args.output, 'w') as f:
+				json.dump({'fleet': result}, f, indent=2)
+		sys.exit(0)
+	if args.compare:
+		with open(args.compare[0]) as f:
+			old = json.load(f)
+		with open(args.compare[1]) as f:
+			new = json.load(f)
+		regressions = bench_compare(old, new, args.threshold)
+		for name, rate, metric, a, b in regressions:
+			print('REGRESSION {} @ {} Hz: {} {:.3f} -> {:.3f}'.format(name, rate, metric, a, b))
+		sys.exit(1 if regressions else 0)
+	result = bench(args.duration)
+	print(bench_report(result))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(result, f, indent=2)
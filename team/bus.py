@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Klasse fuer eine gemeinsame pigpio-Verbindung aller Servos und RC-Regler.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from recorder import SOURCE_OUTPUT
+import threading
+import time
+
+# pigpio.OUTPUT, pigpio selbst wird erst fuer eine neue Verbindung importiert
+OUTPUT = 1
+
+class Bus():
+	_shared = None
+
+	def __init__(self, pi=None, auto_flush:bool=True):
+		"""Aktor-Bus: eine pigpio-Verbindung fuer alle angemeldeten Kanaele.
+		Schreibzugriffe werden pro Kanal zwischengespeichert und mit flush() gesammelt ausgegeben.
+		Unveraenderte Pulsweiten werden dabei nicht erneut an pigpiod gesendet.
+		Args:
+			pi (pigpio.pi, optional): Bestehende pigpio-Verbindung. Defaults to None (neue Verbindung).
+			auto_flush (bool, optional): Jeden Schreibzugriff sofort ausgeben. Defaults to True.
+		"""
+		if pi is None:
+			import pigpio
+			pi = pigpio.pi()
+		self.pi = pi
+		self.auto_flush = auto_flush
+		self.lock = threading.RLock()
+		self.io_lock = threading.RLock()
+		self.hpwm_pin = [12,13,18,19]
+		self.channels = {}
+		self.latency = None
+		self.recorder = None
+		self._local = threading.local()
+		self._batch = []
+		self.flushes = 0
+		self.writes = 0
+		self.skipped = 0
+		self.errors = 0
+		self.flush_time_last = 0.
+		self.flush_time_max = 0.
+		self.flush_time_sum = 0.
+
+	@classmethod
+	def shared(cls):
+		"""Gemeinsamer Standard-Bus fuer alle Aktoren ohne eigenen Bus.
+		Returns:
+			Bus: Gemeinsamer Bus mit auto_flush
+		"""
+		if cls._shared is None:
+			cls._shared = cls()
+		return cls._shared
+
+	@property
+	def cause(self):
+		"""Ausloeser der folgenden Schreibzugriffe fuer die Latenzmessung (pro Thread).
+		Tupel aus Event-Zeitstempel und Verarbeitungsbeginn (time.time()) oder None.
+		"""
+		return getattr(self._local, 'cause', None)
+
+	@cause.setter
+	def cause(self, cause:tuple):
+		self._local.cause = cause
+
+	def register(self, gpio:int, pw_freq:int=50):
+		"""Anmelden eines Ausgangskanals.
+		Args:
+			gpio (int): GPIO Pin
+			pw_freq (int, optional): PWM-Frequenz fuer Hardware PWM. Defaults to 50.
+		"""
+		with self.lock:
+			self.pi.set_mode(gpio, OUTPUT)
+			# [Hardware PWM, Frequenz, ausstehende Pulsweite, gesendete Pulsweite, Ausloeser,
+			#  Pulsweite und Ausloeser der laufenden Ausgabe]
+			self.channels[gpio] = [gpio in self.hpwm_pin, pw_freq, None, None, None, None, None]
+
+	def release(self, gpio:int):
+		"""Abmelden eines Ausgangskanals. Ausstehende Werte werden vorher ausgegeben.
+		Nach dem letzten Kanal wird die pigpio-Verbindung geschlossen.
+		Args:
+			gpio (int): GPIO Pin
+		"""
+		if gpio not in self.channels:
+			return
+		self.flush()
+		with self.io_lock:
+			with self.lock:
+				del self.channels[gpio]
+				empty = not self.channels
+			if empty:
+				self.stop()
+
+	def write(self, gpio:int, pw_val:int):
+		"""Pulsweite fuer einen Kanal vormerken.
+		Args:
+			gpio (int): GPIO Pin
+			pw_val (int): Zielpulsweite
+		Returns:
+			bool: False, falls die Ausgabe fehlgeschlagen ist
+		"""
+		with self.lock:
+			channel = self.channels[gpio]
+			channel[2] = pw_val
+			channel[4] = getattr(self._local, 'cause', None)
+		if self.auto_flush:
+			return self.flush()
+		return True
+
+	def flush(self):
+		"""Alle geaenderten Pulsweiten gesammelt an pigpiod ausgeben.
+		Die Kanaele werden nur kurz zum Auslesen gesperrt, die pigpio-Aufrufe selbst
+		laufen ausserhalb davon, damit write() waehrend einer Ausgabe nicht blockiert.
+		Returns:
+			bool: False, falls mindestens eine Ausgabe fehlgeschlagen ist
+		"""
+		ok = True
+		with self.io_lock:
+			t_start = time.perf_counter()
+			# Vorab angelegte Liste, pro Ausgabe werden keine neuen Objekte erzeugt
+			batch = self._batch
+			batch.clear()
+			with self.lock:
+				for gpio, channel in self.channels.items():
+					pw_val = channel[2]
+					if pw_val is None:
+						continue
+					channel[2] = None
+					if pw_val == channel[3]:
+						self.skipped += 1
+						continue
+					channel[5] = pw_val
+					channel[6] = channel[4]
+					batch.append(gpio)
+			for gpio in batch:
+				channel = self.channels.get(gpio)
+				if channel is None:
+					continue
+				hpwm, pw_freq, _, _, _, pw_val, cause = channel
+				try:
+					if hpwm:
+						self.pi.hardware_PWM(gpio, pw_freq, int(pw_val*pw_freq))
+					else:
+						self.pi.set_servo_pulsewidth(gpio, pw_val)
+					channel[3] = pw_val
+					self.writes += 1
+					if cause is not None and self.latency is not None:
+						self.latency.record(gpio, cause[0], cause[1], time.time())
+					if self.recorder is not None:
+						self.recorder.record(SOURCE_OUTPUT, gpio, pw_val)
+				except Exception as e:
+					print(e)
+					self.errors += 1
+					ok = False
+			t_flush = time.perf_counter() - t_start
+			self.flushes += 1
+			self.flush_time_last = t_flush
+			self.flush_time_sum += t_flush
+			if t_flush > self.flush_time_max:
+				self.flush_time_max = t_flush
+		return ok
+
+	def failsafe(self, pw_vals:dict):
+		"""Notausgabe vorgegebener Pulsweiten direkt an pigpiod, ohne auf die Sperren des Busses zu warten.
+		Funktioniert auch, wenn die Hauptschleife innerhalb von write() oder flush() haengt.
+		Args:
+			pw_vals (dict): Pulsweite je GPIO Pin, {gpio: pw_val}
+		Returns:
+			bool: False, falls mindestens eine Ausgabe fehlgeschlagen ist
+		"""
+		ok = True
+		for gpio, pw_val in pw_vals.items():
+			channel = self.channels[gpio]
+			try:
+				if channel[0]:
+					self.pi.hardware_PWM(gpio, channel[1], int(pw_val*channel[1]))
+				else:
+					self.pi.set_servo_pulsewidth(gpio, pw_val)
+				channel[3] = pw_val
+				if self.recorder is not None:
+					self.recorder.record(SOURCE_OUTPUT, gpio, pw_val)
+			except Exception as e:
+				print(e)
+				ok = False
+		return ok
+
+	def stats(self):
+		"""Zaehler und Ausgabedauer des Busses.
+		Returns:
+			dict: flushes, writes, skipped, errors und Flush-Dauer (last, max, mean) in s
+		"""
+		with self.io_lock:
+			return {
+				'flushes': self.flushes,
+				'writes': self.writes,
+				'skipped': self.skipped,
+				'errors': self.errors,
+				'flush_time_last': self.flush_time_last,
+				'flush_time_max': self.flush_time_max,
+				'flush_time_mean': self.flush_time_sum / self.flushes if self.flushes else 0.,
+			}
+
+	def stop(self):
+		"""pigpio-Verbindung schliessen.
+		"""
+		with self.io_lock:
+			if self.pi is not None:
+				self.pi.stop()
+				self.pi = None
+			if Bus._shared is self:
+				Bus._shared = None
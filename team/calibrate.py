@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Klasse und Funktionen zum gleichzeitigen Programmieren und Pruefen mehrerer RC-Regler ohne Eingaben.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from bus import Bus, OUTPUT
+from esc import Esc, PW_PROGRAM_MIN, PW_PROGRAM_MAX
+import heapq
+import json
+import time
+
+# Ablauf: Stromversorgung ausschalten (ohne Relais Hinweis und power_off_wait Vorlauf oder Bestaetigung),
+# Programmierpuls ausgeben, Stromversorgung nach power_on einschalten (Relais an power_gpio oder Hinweis),
+# nach beep_wait Neutralstellung ausgeben, confirm_wait auf die Bestaetigung warten. Zeiten in s.
+DEFAULT_CALIBRATION = {
+	'host': None,
+	'power_gpio': None,
+	'power_off_wait': 5.,
+	'power_on': 1.,
+	'beep_wait': 3.,
+	'confirm_wait': 2.,
+	'arm_time': 2.,
+	'sweep_step': 50,
+	'sweep_hold': 0.3,
+	'reverse_hold': 1.,
+	'channels': {},
+}
+
+# Ein Kanal: GPIO Pin, Grenzen im Fahrbetrieb, maximale Pulsweite beim Programmieren, Bereich des Pruefablaufs
+DEFAULT_CHANNEL = {
+	'gpio': None,
+	'pw_min': 1000,
+	'pw_max': 2000,
+	'pw_stop': 1500,
+	'pw_program': 2000,
+	'pw_low': 1300,
+	'pw_high': 1700,
+}
+
+def program_sequence(channel:dict, config:dict):
+	"""Zeitgesteuerter Programmierablauf eines RC-Reglers (wie Esc.program_esc, ohne Eingaben).
+	Args:
+		channel (dict): Kanal, siehe DEFAULT_CHANNEL
+		config (dict): Kalibrierung, siehe DEFAULT_CALIBRATION
+	Returns:
+		list: Schritte als (Zeit ab Start in s, Pulsweite, Bezeichnung)
+	"""
+	t_beep = config['power_on'] + config['beep_wait']
+	return [
+		(0., channel['pw_program'], 'program_max'),
+		(t_beep, channel['pw_stop'], 'neutral'),
+		(t_beep + config['confirm_wait'], channel['pw_stop'], 'programmed'),
+	]
+
+def sweep_sequence(channel:dict, config:dict, t_start:float=0.):
+	"""Zeitgesteuerter Pruefablauf eines RC-Reglers: Scharfschalten, Vorwaerts bis pw_high und zurueck,
+	Haltezeit bei pw_stop, Rueckwaerts bis pw_low und zurueck.
+	Args:
+		channel (dict): Kanal, siehe DEFAULT_CHANNEL
+		config (dict): Kalibrierung, siehe DEFAULT_CALIBRATION
+		t_start (float, optional): Beginn in s. Defaults to 0..
+	Returns:
+		list: Schritte als (Zeit ab Start in s, Pulsweite, Bezeichnung)
+	"""
+	pw_stop = channel['pw_stop']
+	step = config['sweep_step']
+	hold = config['sweep_hold']
+	steps = [(t_start, pw_stop, 'arm')]
+	t = t_start + config['arm_time']
+	for pw_end, label in ((channel['pw_high'], 'forward'), (channel['pw_low'], 'reverse')):
+		direction = 1 if pw_end > pw_stop else -1
+		pw_vals = list(range(pw_stop + direction * step, pw_end, direction * step)) + [pw_end]
+		for pw_val in pw_vals + pw_vals[-2::-1] + [pw_stop]:
+			steps.append((t, pw_val, label))
+			t += hold
+		t += config['reverse_hold']
+	steps.append((t, pw_stop, 'tested'))
+	return steps
+
+
+class Calibration():
+	def __init__(self, escs:dict, bus, power_gpio:int=None):
+		"""Zeitgesteuerte Pulsfolgen fuer mehrere RC-Regler gleichzeitig. Alle Kanaele laufen auf einer
+		gemeinsamen Zeitachse in einem Thread, faellige Schritte werden gesammelt mit einem flush() ausgegeben.
+		Fuer jeden Schritt werden geplanter und tatsaechlicher Ausgabezeitpunkt festgehalten.
+		Args:
+			escs (dict): RC-Regler je Kanalname (arm=False)
+			bus (Bus): Aktor-Bus der RC-Regler (auto_flush=False)
+			power_gpio (int, optional): GPIO Pin eines Relais fuer die Stromversorgung der RC-Regler. Defaults to None (Hinweis ausgeben).
+		"""
+		self.escs = dict(escs)
+		self.bus = bus
+		self.power_gpio = power_gpio
+		self.results = {}
+		if power_gpio is not None:
+			bus.pi.set_mode(power_gpio, OUTPUT)
+			bus.pi.write(power_gpio, 0)
+
+	def power(self, on:bool):
+		"""Stromversorgung der RC-Regler schalten oder zum Schalten auffordern.
+		Args:
+			on (bool): Einschalten
+		"""
+		if self.power_gpio is not None:
+			self.bus.pi.write(self.power_gpio, int(on))
+		else:
+			print('{} ESC battery now!'.format('Connect' if on else 'Disconnect'))
+
+	def run(self, sequences:dict, power_on:float=None, power_off_wait:float=0., confirm=None):
+		"""Pulsfolgen aller Kanaele gleichzeitig ausgeben. Am Ende (auch bei Fehlern) stehen alle Kanaele auf pw_stop.
+		Mit power_on wird die Stromversorgung vor dem ersten Schritt ausgeschaltet, damit der Programmierpuls anliegt,
+		bevor die RC-Regler starten. Ohne Relais wird dazu aufgefordert und auf confirm bzw. power_off_wait gewartet.
+		Args:
+			sequences (dict): Schritte je Kanalname, siehe program_sequence() und sweep_sequence()
+			power_on (float, optional): Zeitpunkt zum Einschalten der Stromversorgung in s. Defaults to None (bereits eingeschaltet).
+			power_off_wait (float, optional): Vorlauf nach der Aufforderung zum Trennen ohne Relais in s. Defaults to 0..
+			confirm (callable, optional): Wartet auf die Bestaetigung des Trennens ohne Relais, z.B. input. Defaults to None (power_off_wait).
+		Returns:
+			dict: Ergebnis je Kanalname, siehe results
+		"""
+		if power_on is not None:
+			self.power(False)
+			if self.power_gpio is None:
+				if confirm is not None:
+					confirm()
+				else:
+					time.sleep(power_off_wait)
+		queue = [(t, name, idx, pw_val, label) for name, steps in sequences.items()
+			for idx, (t, pw_val, label) in enumerate(steps)]
+		if power_on is not None:
+			queue.append((power_on, None, 0, None, 'power_on'))
+		heapq.heapify(queue)
+		results = {name: {'steps': [], 'writes': 0} for name in sequences}
+		t0 = time.monotonic()
+		try:
+			while queue:
+				t_due = queue[0][0]
+				delay = t0 + t_due - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				due = []
+				while queue and queue[0][0] <= t_due:
+					due.append(heapq.heappop(queue))
+				for t, name, idx, pw_val, label in due:
+					if name is None:
+						self.power(True)
+					else:
+						self.escs[name].esc_pulse(pw_val)
+				self.bus.flush()
+				t_written = time.monotonic() - t0
+				for t, name, idx, pw_val, label in due:
+					if name is not None:
+						results[name]['steps'].append({'label': label, 'pw': pw_val, 't_planned': t, 't_written': t_written,
+							'late': t_written - t})
+		finally:
+			for esc in self.escs.values():
+				esc.esc_pulse(esc.pw_stop)
+			self.bus.flush()
+		for name, result in results.items():
+			steps = result['steps']
+			late = [step['late'] for step in steps]
+			result['writes'] = self.escs[name].writes
+			result['duration'] = steps[-1]['t_written'] if steps else 0.
+			result['late_mean'] = sum(late) / len(late) if late else 0.
+			result['late_max'] = max(late) if late else 0.
+		self.results.update(results)
+		return results
+
+
+def calibration_build(config:dict, pi=None):
+	"""RC-Regler einer Kalibrierkonfiguration anlegen.
+	Args:
+		config (dict): Kalibrierung, siehe DEFAULT_CALIBRATION
+		pi (pigpio.pi, optional): pigpio-Verbindung, z.B. sim.SimPi() fuer einen Trockenlauf. Defaults to None (pigpio.pi(host)).
+	Returns:
+		tuple: Calibration, vollstaendige Konfiguration und Kanaele je Name
+	Raises:
+		ValueError: Doppelter GPIO Pin oder ungueltige Pulsweite zum Programmieren
+	"""
+	calibration = dict(DEFAULT_CALIBRATION)
+	calibration.update(config)
+	channels = {}
+	gpios = {}
+	for name, channel in calibration['channels'].items():
+		channels[name] = dict(DEFAULT_CHANNEL)
+		channels[name].update(channel)
+		gpio = channels[name]['gpio']
+		if gpio in gpios or gpio == calibration['power_gpio']:
+			raise ValueError('GPIO {} used by {} and {}'.format(gpio, gpios.get(gpio, 'power'), name))
+		gpios[gpio] = name
+		if not PW_PROGRAM_MIN <= channels[name]['pw_program'] <= PW_PROGRAM_MAX:
+			raise ValueError('pw_program of {} out of range ({}-{})'.format(name, PW_PROGRAM_MIN, PW_PROGRAM_MAX))
+	if pi is None:
+		import pigpio
+		pi = pigpio.pi(calibration['host']) if calibration['host'] is not None else pigpio.pi()
+	bus = Bus(pi=pi, auto_flush=False)
+	escs = {name: Esc(channel['gpio'], channel['pw_min'], channel['pw_max'], channel['pw_stop'], bus=bus,
+		arm_time=calibration['arm_time'], arm=False) for name, channel in channels.items()}
+	return Calibration(escs, bus, calibration['power_gpio']), calibration, channels
+
+def calibration_run(config:dict, mode:str='all', pi=None, confirm=None):
+	"""Alle Kanaele gleichzeitig programmieren und/oder pruefen.
+	Args:
+		config (dict): Kalibrierung, siehe DEFAULT_CALIBRATION
+		mode (str, optional): 'program', 'sweep' oder 'all' (Programmieren, danach Pruefen). Defaults to 'all'.
+		pi (pigpio.pi, optional): pigpio-Verbindung, z.B. sim.SimPi() fuer einen Trockenlauf. Defaults to None.
+		confirm (callable, optional): Bestaetigung des Trennens der Stromversorgung ohne Relais. Defaults to None (power_off_wait).
+	Returns:
+		dict: Ergebnis je Kanalname mit Schritten (geplant, ausgegeben, Verspaetung in s), Anzahl Ausgaben und Dauer
+	"""
+	calibration, config, channels = calibration_build(config, pi)
+	sequences = {}
+	power_on = None
+	for name, channel in channels.items():
+		steps = []
+		if mode in ('program', 'all'):
+			steps = program_sequence(channel, config)
+			power_on = config['power_on']
+		if mode in ('sweep', 'all'):
+			# Nach dem Programmieren ist der RC-Regler bereits scharfgeschaltet
+			steps += sweep_sequence(channel, config, steps[-1][0] if steps else 0.)
+		sequences[name] = steps
+	return calibration.run(sequences, power_on, config['power_off_wait'], confirm)
+
+def calibration_report(results:dict):
+	"""Returns:
+		str: Tabelle je Kanal mit Schritten, Ausgaben, Dauer und Verspaetung in ms
+	"""
+	lines = ['{:<14} {:>6} {:>7} {:>10} {:>10} {:>10}'.format('channel', 'steps', 'writes', 'duration', 'late_mean', 'late_max')]
+	for name, result in results.items():
+		lines.append('{:<14} {:>6} {:>7} {:>10.1f} {:>10.3f} {:>10.3f}'.format(name, len(result['steps']), result['writes'],
+			1e3 * result['duration'], 1e3 * result['late_mean'], 1e3 * result['late_max']))
+	return '\n'.join(lines)
+
+
+def calibrate_test(channels:int=4):
+	"""Kalibrier-Testfunktion ohne Hardware: Programmier- und Pruefablauf mehrerer Kanaele auf SimPi mit kurzen Zeiten.
+	Prueft die ausgegebenen Pulsfolgen und den Endzustand pw_stop.
+	Args:
+		channels (int, optional): Anzahl Kanaele. Defaults to 4.
+	"""
+	from sim import SimPi
+	pi = SimPi()
+	config = {
+		'power_gpio': 21, 'power_on': 0.1, 'beep_wait': 0.2, 'confirm_wait': 0.1, 'arm_time': 0.2,
+		'sweep_step': 100, 'sweep_hold': 0.02, 'reverse_hold': 0.1,
+		'channels': {'esc{}'.format(idx): {'gpio': gpio, 'pw_program': 2000 + 100 * idx}
+			for idx, gpio in enumerate((5, 6, 16, 20, 22, 23, 24, 25)[:channels])},
+	}
+	results = calibration_run(config, 'all', pi)
+	print(calibration_report(results))
+	for idx, (name, result) in enumerate(results.items()):
+		gpio = config['channels'][name]['gpio']
+		pw_vals = [pw_val for t, pw_val in pi.trace(gpio)]
+		assert pw_vals[1] == 2000 + 100 * idx, '{} not programmed'.format(name)
+		assert max(pw_vals[2:]) == DEFAULT_CHANNEL['pw_high'] and min(pw_vals[2:]) == DEFAULT_CHANNEL['pw_low'], '{} not swept'.format(name)
+		assert pw_vals[-1] == DEFAULT_CHANNEL['pw_stop'], '{} not stopped'.format(name)
+		assert result['late_max'] < 0.05, '{} late by {:.3f} s'.format(name, result['late_max'])
+	# Alle Kanaele gleichzeitig: gleicher Programmierzeitpunkt, Strom erst danach
+	t_program = [result['steps'][0]['t_written'] for result in results.values()]
+	assert max(t_program) - min(t_program) < 1e-3, 'channels not programmed together'
+	assert [level for t, level in pi.trace(21)] == [0, 0, 1], 'power relay not switched'
+	# Ohne Relais: Programmierpuls erst nach dem Vorlauf zum Trennen der Stromversorgung
+	pi = SimPi()
+	config.update({'power_gpio': None, 'power_off_wait': 0.2, 'channels': {'esc0': {'gpio': 5}}})
+	t_start = time.monotonic()
+	calibration_run(config, 'program', pi)
+	t_program = min(t for t, pw_val in pi.trace(5) if pw_val == DEFAULT_CHANNEL['pw_program'])
+	assert t_program - t_start >= config['power_off_wait'], 'program pulse written before the battery was disconnected'
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Program and bench-test several ESCs at once with timed pulse sequences.')
+	parser.add_argument('config', nargs='?', help='JSON file, e.g. {"power_gpio": 21, "channels": {"engineLeft": {"gpio": 5, "pw_program": 2000}}}')
+	parser.add_argument('-m', '--mode', choices=('program', 'sweep', 'all'), default='all', help='sequence to run (default: all)')
+	parser.add_argument('-n', '--dry-run', action='store_true', help='run against the pigpio stand-in (sim.SimPi) instead of pigpiod')
+	parser.add_argument('-o', '--output', help='write per-channel timing results as JSON')
+	args = parser.parse_args()
+	if args.config is None:
+		calibrate_test()
+	else:
+		with open(args.config) as f:
+			config = json.load(f)
+		pi = None
+		if args.dry_run:
+			from sim import SimPi
+			pi = SimPi()
+		print("Make sure the motors and all other components are secured, before you continue!")
+		confirm = None if args.dry_run else lambda: input('Press Enter when the ESC battery is disconnected')
+		results = calibration_run(config, args.mode, pi, confirm)
+		print(calibration_report(results))
+		if args.output:
+			with open(args.output, 'w') as f:
+				json.dump(results, f, indent=2)
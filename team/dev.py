@@ -6,60 +6,147 @@ __email__ = "teamprojekt@tuhh.de"
 __copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
 __version__ = "2023.1.0"
 
-from evdev import list_devices, InputDevice, categorize, ecodes, ff
+from evdev import list_devices, InputDevice, categorize, ecodes
+from hotplug import InputWatcher
+from rumble import Rumble
+from collections import namedtuple
+from types import MappingProxyType
+import glob
+import os
 import sys
+import threading
 import time
 import logging
 import traceback
 
+# Zustand des Controllers nach einem SYN_REPORT: Zeitstempel (s), unveraenderlicher Zustand {(type, code): value}
+# und die im Frame geaenderten (type, code)
+Frame = namedtuple('Frame', ('timestamp', 'state', 'changed'))
+
 class Controller():
-	def __init__(self, setup:bool=False, device_name:str='Xbox Wireless Controller', controller_driver:str='xpadneo'):
+	def __init__(self, setup:bool=False, device_name:str='Xbox Wireless Controller', controller_driver:str='xpadneo', dev=None,
+	device_uniq:str=None):
 		"""Klasse zur Ansteuerung eines Xbox-Controllers mithilfe des Raspberry Pi.
 		Args:
 			setup (bool, optional): Weitere Informationen bei der Einrichtung des Controllers anzeigen. Defaults to False.
 			device_name (str, optional): Bezeichnung des zu verbindenen Controllers. Defaults to 'Xbox Wireless Controller'.
 			controller_driver (str, optional): Installierter Controller-Treibername. Defaults to 'xpadneo'.
+			dev (InputDevice, optional): Bereits geoeffnetes Eingabegeraet, z.B. sim.ReplayDevice. Defaults to None (Geraeteauswahl).
+			device_uniq (str, optional): Eindeutige Kennung des Controllers (Bluetooth MAC), noetig bei mehreren
+									gleichen Controllern. Defaults to None (erster Controller mit passendem Namen).
 		"""
 		self.setup = setup
 		self.device_name = device_name
+		self.device_uniq = device_uniq
 		self.controller_driver = controller_driver
-		self.dev = self.device_select()
+		self.state = {}
+		self.events_received = 0
+		self.frames_received = 0
+		self.frames_dropped = 0
+		self.reconnects = 0
+		self._changes = {}
+		self._dropped = False
+		self._cancel = threading.Event()
+		self.dev = self.device_select() if dev is None else dev
 		self.device_setup()
-		self.rumble(length_ms=200, delay_ms=100, repeat_count=2)
+		self.state.update(self.device_state())
+		self.haptics = Rumble(self.dev)
+		self.rumble('connect')
 
-	def device_select(self):
+	def device_select(self, timeout:float=120., cancel_period:float=0.2):
 		"""Auswahl des Controllers aus den verbundenen Geraeten.
 		Anzeigen aller verbundenen Geraete im Setup Modus.
+		Ohne Setup Modus wird auf neue Geraete unter /dev/input gewartet (inotify) und der
+		Controller unmittelbar nach dem Erscheinen uebernommen. Das Warten kann mit cancel() abgebrochen werden.
 		Errormeldung falls der Controller nicht gefunden werden kann.
+		Args:
+			timeout (float, optional): Maximale Wartezeit auf den Controller in s, None fuer unbegrenzt. Defaults to 120..
+			cancel_period (float, optional): Maximale Zeit bis ein Abbruch erkannt wird in s. Defaults to 0.2.
 		Returns:
-			InputDevice: Ausgewaelter Xbox Controller
+			InputDevice: Ausgewaelter Xbox Controller, None nach cancel()
 		"""
 		device_selected = None
 		if self.setup:
 			print('Available devices:')
 			devices = [InputDevice(path) for path in list_devices()]
 			for idx, device in enumerate(devices):
-				print('{} -  path: {}, name: {}, phys: {}'.format(idx, device.path, device.name, device.phys))
+				print('{} -  path: {}, name: {}, phys: {}, uniq: {}'.format(idx, device.path, device.name, device.phys, device.uniq))
 			device_id = int(input('Select your device [0-{}]: '.format(idx)))
-			if device_id in range(idx + 1):
-				device_selected = InputDevice(list_devices()[device_id])
-				print('Device connected: {}'.format(device_selected))
+			for idx, device in enumerate(devices):
+				if idx == device_id:
+					device_selected = device
+					print('Device connected: {}'.format(device_selected))
+				else:
+					device.close()
+			if device_selected is not None:
 				return device_selected
 		else:
-			timeout = time.time() + 60*2
-			while True:
-				devices = [InputDevice(path) for path in list_devices()]
-				if time.time() > timeout:
-					break
-				for device in devices:
-					if self.device_name == device.name:
-						device_selected = InputDevice(device)
-						print('Device connected: {}'.format(device_selected))
-						return device_selected
-				time.sleep(5)
+			watcher = InputWatcher()
+			try:
+				t_end = None if timeout is None else time.monotonic() + timeout
+				paths = list_devices()
+				while not self._cancel.is_set():
+					for path in paths:
+						device_selected = self.device_open(path)
+						if device_selected is not None:
+							print('Device connected: {}'.format(device_selected))
+							return device_selected
+					remaining = None if t_end is None else t_end - time.monotonic()
+					if remaining is not None and remaining <= 0:
+						break
+					paths = watcher.wait(cancel_period if remaining is None else min(remaining, cancel_period))
+			finally:
+				watcher.close()
+			if self._cancel.is_set():
+				return None
 		if device_selected is None:
 			sys.exit('Error: No valid device selected/connected.')
 
+	def device_open(self, path:str):
+		"""Geraet oeffnen und pruefen, ob es der gesuchte Controller ist (Name und ggf. uniq). Andere Geraete werden wieder geschlossen.
+		Args:
+			path (str): Pfad der Geraetedatei
+		Returns:
+			InputDevice: Controller oder None
+		"""
+		try:
+			device = InputDevice(path)
+		except OSError:
+			# z.B. Zugriffsrechte noch nicht durch udev gesetzt, folgt mit IN_ATTRIB
+			return None
+		if device.name == self.device_name and (self.device_uniq is None or device.uniq == self.device_uniq):
+			return device
+		device.close()
+		return None
+
+	def reconnect(self):
+		"""Verbindung nach einem Verbindungsabbruch wiederherstellen. Blockiert bis der Controller wieder erscheint
+		oder cancel() aufgerufen wird.
+		Returns:
+			InputDevice: Wieder verbundener Xbox Controller, None nach cancel()
+		"""
+		try:
+			self.dev.close()
+		except OSError:
+			pass
+		self.state.clear()
+		self._changes = {}
+		self._dropped = False
+		self.dev = self.device_select(timeout=None)
+		if self.dev is None:
+			return None
+		self.state.update(self.device_state())
+		self.reconnects += 1
+		self.haptics.upload(self.dev)
+		self.rumble('connect')
+		return self.dev
+
+	def cancel(self):
+		"""Warten auf den Controller (device_select, reconnect) abbrechen, z.B. beim Beenden.
+		Kann aus jedem Thread aufgerufen werden.
+		"""
+		self._cancel.set()
+
 	def device_setup(self):
 		"""Zuweisung aller Controller Funktionen abhaengig vom gewaehlten Treibertyp.
 		"""
@@ -97,28 +184,113 @@ class Controller():
 			self.ABS_RTLT = 40	# Kombinierter Linker+Rechter Trigger
 		else:
 			sys.exit('Error: Please select/define your own controller driver.')
-	'''
-	def rumble(self, length_ms:int=1000, delay_ms:int=0, repeat_count:int=1):
-		"""Aktivierung der Vibrationsfunktion am Controller.
+
+	def frame_feed(self, event):
+		"""Event in den aktuellen Frame uebernehmen. Ein SYN_REPORT schliesst den Frame ab.
+		Nach SYN_DROPPED werden alle Events bis zum naechsten SYN_REPORT verworfen und
+		der Zustand danach direkt vom Geraet gelesen (frame_resync).
 		Args:
-			length_ms (int, optional): Vibrationsdauer. Defaults to 1000.
-			delay_ms (int, optional): Zeit zwischen Vibrationen. Defaults to 0.
-			repeat_count (int, optional): Anzahl der Wiederholungen. Defaults to 1.
+			event (InputEvent): Controller-Event
+		Returns:
+			Frame: Abgeschlossener Frame mit Aenderungen oder None
+		"""
+		if event.type == ecodes.EV_SYN:
+			if event.code == ecodes.SYN_REPORT:
+				if self._dropped:
+					self._dropped = False
+					return self.frame_resync(event.timestamp())
+				if not self._changes:
+					return None
+				changes, self._changes = self._changes, {}
+				self.state.update(changes)
+				self.frames_received += 1
+				return Frame(event.timestamp(), MappingProxyType(dict(self.state)), frozenset(changes))
+			if event.code == ecodes.SYN_DROPPED:
+				self._dropped = True
+				self._changes = {}
+				self.frames_dropped += 1
+			return None
+		if not self._dropped and (event.type == ecodes.EV_KEY or event.type == ecodes.EV_ABS):
+			self.events_received += 1
+			self._changes[(event.type, event.code)] = event.value
+		return None
+
+	def device_state(self):
+		"""Absoluten Zustand aller Tasten und Achsen direkt vom Geraet lesen (ioctl, ohne Events).
+		Returns:
+			dict: Wert je (type, code)
+		"""
+		capabilities = self.dev.capabilities(absinfo=True)
+		current = {}
+		for code, absinfo in capabilities.get(ecodes.EV_ABS, []):
+			current[(ecodes.EV_ABS, code)] = absinfo.value
+		keys = set(self.dev.active_keys())
+		for code in capabilities.get(ecodes.EV_KEY, []):
+			current[(ecodes.EV_KEY, code)] = 1 if code in keys else 0
+		return current
+
+	def frame_resync(self, timestamp:float=None):
+		"""Zustand nach verlorenen Events aus den absoluten Werten des Geraets wiederherstellen.
+		Der Zustand wird beim Verbinden vom Geraet gelesen, unbekannte Eingaenge gelten als 0 (losgelassen).
+		Args:
+			timestamp (float, optional): Zeitstempel des Frames. Defaults to None (time.time()).
+		Returns:
+			Frame: Frame mit allen tatsaechlich geaenderten Werten oder None
+		"""
+		current = self.device_state()
+		changed = frozenset(key for key, value in current.items() if self.state.get(key, 0) != value)
+		if not changed:
+			return None
+		self.state.update(current)
+		self.frames_received += 1
+		return Frame(time.time() if timestamp is None else timestamp, MappingProxyType(dict(self.state)), changed)
+
+	async def frames(self):
+		"""Asynchroner Strom abgeschlossener Frames des Controllers.
+		Yields:
+			Frame: Zustand nach jedem SYN_REPORT mit mindestens einer Aenderung
+		"""
+		async for event in self.dev.async_read_loop():
+			frame = self.frame_feed(event)
+			if frame is not None:
+				yield frame
+
+	def link_alive(self):
+		"""Pruefen, ob der Controller noch verbunden ist, ohne auf Events zu warten (ioctl EVIOCGKEY).
+		Ein ruhig gehaltener Eingang sendet keine Events, die Verbindung besteht trotzdem. Entfernt der Kernel
+		das Geraet (z.B. nach einem Bluetooth-Verbindungsabbruch), schlaegt die Abfrage mit ENODEV fehl.
+		Returns:
+			bool: True, solange das Geraet antwortet
+		"""
+		try:
+			self.dev.active_keys()
+		except OSError:
+			return False
+		return True
+
+	def battery(self):
+		"""Ladezustand des Controllers aus sysfs (power_supply des HID-Geraets, z.B. von xpadneo).
+		Returns:
+			int: Ladezustand in %, None falls nicht verfuegbar
+		"""
+		pattern = '/sys/class/input/{}/device/device/power_supply/*/capacity'.format(os.path.basename(self.dev.path))
+		for path in glob.glob(pattern):
+			try:
+				with open(path) as f:
+					return int(f.read())
+			except (OSError, ValueError):
+				pass
+		return None
+
+	def rumble(self, effect:str='connect'):
+		"""Aktivierung der Vibrationsfunktion am Controller. Kehrt sofort zurueck, der Effekt ist bereits hochgeladen
+		und wird im Hintergrund abgespielt. Wiederholte Anfragen waehrend der Effekt laeuft werden zusammengefasst.
+		Args:
+			effect (str, optional): Name des Effekts, siehe rumble.EFFECTS. Defaults to 'connect'.
+		Returns:
+			bool: True, wenn der Effekt eingereiht wurde
 		"""
-		rumble = ff.Rumble(0x0000, 0xffff)
-		effect_type = ff.EffectType(ff_rumble_effect=rumble)
-		effect = ff.Effect(
-				ecodes.FF_RUMBLE, -1, 0,
-				ff.Trigger(0, 0),
-				ff.Replay(length_ms, delay_ms),
-				effect_type
-			)
-		effect_id = self.dev.upload_effect(effect)
-		self.dev.write(ecodes.EV_FF, effect_id, repeat_count)
-	'''
-
-	def rumble(self, length_ms:int=1000, delay_ms:int=0, repeat_count:int=1):
-		pass
+		return self.haptics.play(effect)
 
 
 def controller_test(setup=False):
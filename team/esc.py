@@ -6,13 +6,19 @@ __email__ = "teamprojekt@tuhh.de"
 __copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
 __version__ = "2023.1.2"
 
-import pigpio
+from bus import Bus
 import logging
 import traceback
 import time
+import math
+
+# Gueltige maximale Pulsweite beim Programmieren des RC-Reglers
+PW_PROGRAM_MIN = 1600
+PW_PROGRAM_MAX = 2500
 
 class Esc:
-	def __init__(self, gpio:int=13, pw_min:int=1000, pw_max:int=2000, pw_stop:int=1500, pw_freq:int=50):
+	def __init__(self, gpio:int=13, pw_min:int=1000, pw_max:int=2000, pw_stop:int=1500, pw_freq:int=50,
+	pw_slew:float=1000., reverse_hold:float=1., bus=None, arm_time:float=2., arm:bool=True):
 		"""Klasse zur Ansteuerung eines RC-Reglers und Motors mithilfe des Raspberry Pi.
 		Args:
 			gpio (int, optional): 	Hardware PWM Kanal 1: GPIO 12 oder 18.
@@ -23,79 +29,162 @@ class Esc:
 			pw_max (int, optional): Maximale Steuerpulsweite (max:2500, safe: 2000). Defaults to 2000.
 									Bei Änderung von pw_min, pw_max muss der esc neu programmiert werden.
 			pw_stop (int, optional): Steuerpulsweite fuer Motorstillstand. Defaults to 1500.
+			pw_slew (float, optional): Anstiegsrate beim sicheren Anfahren in us/s. Defaults to 1000..
+			reverse_hold (float, optional): Haltezeit bei pw_stop vor einem Richtungswechsel in s. Defaults to 1..
+			bus (Bus, optional): Aktor-Bus mit gemeinsamer pigpio-Verbindung. Defaults to None (Bus.shared()).
+			arm_time (float, optional): Dauer des Stoppsignals zum Scharfschalten des RC-Reglers in s. Defaults to 2..
+			arm (bool, optional): Im Konstruktor bis zum Ende der Scharfschaltung warten. Defaults to True.
+									Mit False wird nur das Stoppsignal gesendet, gewartet wird mit esc_arm_wait().
 		"""
-		hpwm_pin=[12,13,18,19]
-		if gpio in hpwm_pin:
-			self.hpwm=True
-		else:
-			self.hpwm=False
 		self.gpio = gpio
 		self.pw_min = pw_min
 		self.pw_max = pw_max
 		self.pw_freq = pw_freq
+		self.writes = 0
 		self.pw_stop = pw_stop
+		self.pw_slew = pw_slew
+		self.reverse_hold = reverse_hold
 		self.pw_val = None
-		self.esc = pigpio.pi()
-		self.esc.set_mode(self.gpio, pigpio.OUTPUT)
+		self.pw_target = None
+		self.ramp = None
+		self._pw_ramp = None
+		self._t_ramp = None
+		self._t_hold = 0.
+		self._cause = None
+		self.arm_time = arm_time
+		self.bus = Bus.shared() if bus is None else bus
+		self.bus.register(self.gpio, self.pw_freq)
 		self.esc_write(self.pw_stop)
-		time.sleep(2)
+		self.bus.flush()
+		self.t_armed = time.monotonic() + self.arm_time
+		if arm:
+			self.esc_arm_wait()
+
+	def esc_arm_wait(self):
+		"""Warten bis der RC-Regler nach dem ersten Stoppsignal scharfgeschaltet ist.
+		Kehrt sofort zurueck, wenn arm_time bereits verstrichen ist.
+		"""
+		delay = self.t_armed - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
 
 	def __del__(self):
 		"""Destruktor zum Loeschen der RC-Regler-Objektreferenzen, z.B. beim Beenden des Programms.
 		Sicheres Stoppen des Motors.
 		"""
-		self.esc_write(self.gpio, self.pw_stop)
-		self.esc.stop()
+		self.esc_write(self.pw_stop)
+		self.bus.release(self.gpio)
 
 	def esc_write(self, pw_val:int, safety:bool=False):
 		"""Einstellen einer vorgegebenen Pulsweite am RC-Regler.
 		Args:
 			pw_val (int): Zielpulsweite
 			safety (bool, optional): Langsames Anfahren und Bremsen um Spannungsspitzen zu vermeiden. Defaults to False.
+									Die Rampe laeuft im Hintergrund (EscRamp), der Aufruf blockiert nicht.
 		"""
-		if self.pw_val == pw_val:
-			return
 		if (self.pw_min <= pw_val <= self.pw_max) and pw_val != self.pw_stop:
 			if safety:
-				if (pw_val < self.pw_stop and self.pw_val > self.pw_stop) or (pw_val > self.pw_stop and self.pw_val < self.pw_stop):
-					self.__write(self.pw_stop)
-					self.pw_val = self.pw_stop
-					time.sleep(1)
 				self.esc_safe_acceleration(pw_val)
-			else:
-				self.__write(pw_val)
-			self.pw_val = pw_val
+				return
+		else:
+			pw_val = self.pw_stop
+		if self.ramp is not None:
+			with self.ramp.lock:
+				self.pw_target = None
+				self.__set(pw_val)
 		else:
-			self.__write(self.pw_stop)
-			self.pw_val = self.pw_stop
+			self.__set(pw_val)
+
+	def esc_pulse(self, pw_val:int):
+		"""Pulsweite ohne Begrenzung auf pw_min..pw_max und ohne Rampe vormerken.
+		Nur zum Programmieren und fuer Pruefstandsablaeufe, nicht im Fahrbetrieb verwenden!
+		Args:
+			pw_val (int): Pulsweite (500-2500)
+		Raises:
+			ValueError: Pulsweite ausserhalb des Bereichs von pigpio
+		"""
+		if not 500 <= pw_val <= 2500:
+			raise ValueError('Pulsewidth {} out of range (500-2500)'.format(pw_val))
+		if self.ramp is not None:
+			with self.ramp.lock:
+				self.pw_target = None
+				self.__set(pw_val)
+		else:
+			self.__set(pw_val)
 
 	def esc_safe_acceleration(self, pw_val:int):
 		"""Langsames Anfahren und Bremsen um Spannungsspitzen zu vermeiden.
+		Setzt nur das Ziel der Rampe, eine laufende Rampe wird sofort auf das neue Ziel umgelenkt.
+		Ohne zugeordnete Rampe wird eine eigene EscRamp gestartet.
 		Args:
 			pw_val (int): Zielpulsweite
 		"""
-		if pw_val > self.pw_val:
-			pw_range = range(self.pw_val, pw_val+1, 10)
+		if self.ramp is None:
+			from ramp import EscRamp
+			EscRamp([self]).start()
+		with self.ramp.lock:
+			if self.pw_val is None:
+				self.__set(self.pw_stop)
+			if self.pw_target is None:
+				if self.pw_val == pw_val:
+					return
+				self._t_ramp = None
+			self.pw_target = pw_val
+			self._cause = self.bus.cause
+
+	def esc_ramp_step(self, now:float):
+		"""Einen Rampenschritt Richtung Zielpulsweite ausfuehren. Wird von EscRamp aufgerufen.
+		Bei einem Richtungswechsel wird zuerst bis pw_stop gebremst und dort reverse_hold gewartet.
+		Args:
+			now (float): Zeitpunkt (time.monotonic)
+		"""
+		if self.pw_target is None:
+			return
+		dt = 0. if self._t_ramp is None else now - self._t_ramp
+		self._t_ramp = now
+		if now < self._t_hold:
+			return
+		pw_target = self.pw_target
+		if (pw_target - self.pw_stop) * (self._pw_ramp - self.pw_stop) < 0:
+			pw_goal = self.pw_stop
 		else:
-			pw_range = range(self.pw_val, pw_val-1, -10)
-		for pw in pw_range:
-			self.__write(pw)
-			time.sleep(0.01)
+			pw_goal = pw_target
+		pw_step = self.pw_slew * dt
+		if abs(pw_goal - self._pw_ramp) <= pw_step:
+			pw_ramp = pw_goal
+		else:
+			pw_ramp = self._pw_ramp + math.copysign(pw_step, pw_goal - self._pw_ramp)
+		pw_val = int(round(pw_ramp))
+		if pw_val != self.pw_val:
+			# Latenzmessung: der erste Rampenschritt gehoert zum ausloesenden Event
+			self.bus.cause = self._cause
+			self.__write(pw_val)
+			self.bus.cause = self._cause = None
+			self.pw_val = pw_val
+		self._pw_ramp = pw_ramp
+		if pw_ramp == pw_target:
+			self.pw_target = None
+		elif pw_ramp == pw_goal:
+			self._t_hold = now + self.reverse_hold
+
+	def __set(self, pw_val:int):
+		"""[Private] Sofortiges Setzen der Pulsweite ohne Rampe.
+		Args:
+			pw_val (int): Zielpulsweite
+		"""
+		self._pw_ramp = pw_val
+		if self.pw_val == pw_val:
+			return
+		self.__write(pw_val)
+		self.pw_val = pw_val
+
 	def __write(self, pw_val:int):
 		"""[Private] Passt Output an verwendeten Pin an. Nicht Standalone verwenden!
 		Args:
 			pw_val (int): Zielpulsweite
 		"""
-		try:
-			if self.hpwm:
-				conv=pw_val*self.pw_freq
-				self.esc.hardware_PWM(self.gpio, self.pw_freq, conv)
-			else:
-				self.esc.set_servo_pulsewidth(self.gpio, pw_val)
-			return True
-		except Exception as e:
-			print(e)
-			return False
+		self.writes += 1
+		return self.bus.write(self.gpio, pw_val)
 
 	def program_esc(self):
 		"""ESC Programmieren
@@ -103,9 +192,9 @@ class Esc:
 		print("ESC Programmieren")
 		print("Make sure the motor and all other components are secured, before you continue!")
 		input("Disconnect battery from ESC! (press Enter to continue)")
-		pw=int(input("Enter max pulsewidth (min 1600, max 2500): "))
-		while 1600<pw or pw>2500:
-			pw=int(input("Out of Range! Enter max pulsewidth (min 1600, max 2500): "))
+		pw=int(input("Enter max pulsewidth (min {}, max {}): ".format(PW_PROGRAM_MIN, PW_PROGRAM_MAX)))
+		while pw<PW_PROGRAM_MIN or pw>PW_PROGRAM_MAX:
+			pw=int(input("Out of Range! Enter max pulsewidth (min {}, max {}): ".format(PW_PROGRAM_MIN, PW_PROGRAM_MAX)))
 		self.__write(pw)
 		input("Connect battery to ESC! (press Enter to continue)")
 		input("Wait for beep (press Enter when the motor beeped)")
@@ -132,5 +221,6 @@ if __name__ == "__main__":
 	"""zum ESC programmieren esc_test() mit
 	esc=Esc(gpio=)
 	esc.program_esc() ersetzen
+	mehrere RC-Regler gleichzeitig ohne Eingaben: calibrate.py
 	"""
 	esc_test()
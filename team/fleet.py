@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Klasse und Funktionen zur Steuerung mehrerer Boote mit mehreren Controllern aus einem Prozess.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from bus import Bus
+from dev import Controller
+from esc import Esc
+from servo import Servo
+from ramp import EscRamp
+from mapping import Mapping
+from watchdog import Watchdog
+from runtime import Runtime
+from latency import LatencyMonitor
+from startup import BootLog, esc_arm_all, startup_parallel
+import asyncio
+import json
+import os
+import signal
+import tempfile
+import time
+
+# Ein Fahrzeug: pigpio-Host (None: lokal), GPIO Pins der Servos und RC-Regler (je links, rechts),
+# Kennung des Controllers und optionale Abweichungen von mapping.DEFAULT_CONFIG
+DEFAULT_VEHICLE = {
+	'host': None,
+	'servos': (12, 13),
+	'escs': (5, 6),
+	'device_uniq': None,
+	'mapping': {},
+	'failsafe_deadline': 1.,
+}
+
+class Vehicle():
+	def __init__(self, name:str, ctrl, bus, servos:tuple, escs:tuple, config:dict=None, tick_rate:float=None):
+		"""Ein Fahrzeug mit eigenem Controller, eigener Zuordnung mit Trimmung, eigener Rampe und eigenem Failsafe.
+		Args:
+			name (str): Name des Fahrzeugs
+			ctrl (Controller): Xbox Controller des Fahrzeugs
+			bus (Bus): Aktor-Bus des Fahrzeugs (auto_flush=False), mehrere Fahrzeuge duerfen sich einen Bus teilen
+			servos (tuple): Servos (links, rechts)
+			escs (tuple): RC-Regler (links, rechts)
+			config (dict, optional): Fahrzeugkonfiguration, siehe DEFAULT_VEHICLE. Defaults to None.
+			tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to None (PWM-Frequenz der RC-Regler).
+		"""
+		self.name = name
+		self.config = dict(DEFAULT_VEHICLE)
+		self.config.update(config or {})
+		self.ctrl = ctrl
+		self.bus = bus
+		self.servos = tuple(servos)
+		self.escs = tuple(escs)
+		self.ramp = EscRamp(self.escs)
+		self.watchdog = Watchdog(bus, list(self.escs), list(self.servos), self.config['failsafe_deadline'])
+		self.mapping = Mapping(ctrl, self.servos, self.escs, self.config['mapping'], self.watchdog)
+		self.runtime = Runtime(ctrl, bus, list(self.escs), list(self.servos), self.ramp, tick_rate or self.escs[0].pw_freq,
+			watchdog=self.watchdog, signals=False)
+
+	def stats(self):
+		"""Returns:
+			dict: Kennzahlen der Laufzeitumgebung des Fahrzeugs
+		"""
+		return self.runtime.stats()
+
+
+class Fleet():
+	def __init__(self, vehicles:list, realtime=None, dump_dir:str=None):
+		"""Mehrere Fahrzeuge in einer asyncio-Eventschleife. Alle Controller werden ueber denselben Selector
+		gelesen, jedes Fahrzeug hat eigene Tasks fuer Eingabe, Regeltakt und Rampe sowie einen eigenen Watchdog.
+		Endet ein Fahrzeug (Fehler, Ende der Wiedergabe), laufen die anderen weiter.
+		SIGINT/SIGTERM beenden alle Fahrzeuge, SIGUSR1 schaltet den Profiler (alle Threads), SIGUSR2 schreibt
+		die Kennzahlen aller Fahrzeuge.
+		Args:
+			vehicles (list): Fahrzeuge
+			realtime (Realtime, optional): Echtzeitbetrieb fuer den gesamten Prozess. Defaults to None.
+			dump_dir (str, optional): Verzeichnis fuer Profile und Kennzahlen. Defaults to None (tempfile.gettempdir()).
+		"""
+		names = [vehicle.name for vehicle in vehicles]
+		if len(set(names)) != len(names):
+			raise ValueError('Vehicle names must be unique: {}'.format(names))
+		self.vehicles = list(vehicles)
+		self.realtime = realtime
+		self.dump_dir = tempfile.gettempdir() if dump_dir is None else dump_dir
+		self.loop = None
+
+	def stop(self):
+		"""Alle Fahrzeuge geordnet beenden.
+		"""
+		for vehicle in self.vehicles:
+			vehicle.runtime.stop()
+
+	async def run(self, on_ready=None):
+		"""Alle Fahrzeuge starten und laufen lassen, bis alle beendet sind.
+		Args:
+			on_ready (callable, optional): Wird aufgerufen, sobald alle Fahrzeuge laufen. Defaults to None.
+		Raises:
+			Exception: Erster Fehler eines Fahrzeugs, nachdem alle Fahrzeuge beendet sind
+		"""
+		self.loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			self.loop.add_signal_handler(sig, self.stop)
+		# Der Profiler tastet alle Threads des Prozesses ab, einer genuegt fuer alle Fahrzeuge
+		self.loop.add_signal_handler(signal.SIGUSR1, self.vehicles[0].runtime.profile_toggle)
+		self.loop.add_signal_handler(signal.SIGUSR2, self.stats_dump)
+		if self.realtime is not None:
+			self.realtime.enable()
+		runs = [asyncio.create_task(vehicle.runtime.run(vehicle.mapping.handle_frame, vehicle.mapping.update), name=vehicle.name)
+			for vehicle in self.vehicles]
+		if on_ready is not None:
+			self.loop.call_soon(on_ready)
+		try:
+			results = await asyncio.gather(*runs, return_exceptions=True)
+		finally:
+			if self.realtime is not None:
+				self.realtime.disable()
+			for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2):
+				self.loop.remove_signal_handler(sig)
+		for vehicle, result in zip(self.vehicles, results):
+			if isinstance(result, BaseException):
+				print('Vehicle {} stopped with {!r}'.format(vehicle.name, result))
+		for result in results:
+			if isinstance(result, BaseException):
+				raise result
+
+	def stats(self):
+		"""Returns:
+			dict: Kennzahlen je Fahrzeugname
+		"""
+		return {vehicle.name: vehicle.stats() for vehicle in self.vehicles}
+
+	def stats_dump(self, path:str=None):
+		"""Kennzahlen aller Fahrzeuge als JSON schreiben (SIGUSR2). Zusammenstellen und Schreiben laufen in einem Hilfsthread.
+		Args:
+			path (str, optional): Ausgabedatei. Defaults to None (dump_dir/teamprojekt-fleet-<Zeit>.json).
+		"""
+		if path is None:
+			path = os.path.join(self.dump_dir, 'teamprojekt-fleet-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+		def write():
+			stats = self.stats()
+			with open(path, 'w') as f:
+				json.dump(stats, f, indent=2)
+			print('Stats written to {}'.format(path))
+		self.loop.run_in_executor(None, write)
+
+
+def fleet_build(config:dict, pi_factory=None, devs:dict=None, tick_rate:float=None, boot:BootLog=None):
+	"""Alle Fahrzeuge einer Konfiguration gleichzeitig aufbauen: ein Bus je pigpio-Host, RC-Regler werden
+	gemeinsam scharfgeschaltet, die Controller werden parallel gesucht.
+	Args:
+		config (dict): Fahrzeugkonfiguration je Name, {name: {...}}, siehe DEFAULT_VEHICLE
+		pi_factory (callable, optional): Erzeugt die pigpio-Verbindung zu einem Host, z.B. lambda host: SimPi(). Defaults to None (pigpio.pi(host)).
+		devs (dict, optional): Bereits geoeffnete Eingabegeraete je Name, z.B. sim.ReplayDevice. Defaults to None.
+		tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to None.
+		boot (BootLog, optional): Bootprotokoll. Defaults to None.
+	Returns:
+		Fleet: Fahrzeuge in einer gemeinsamen Eventschleife
+	Raises:
+		ValueError: Ein GPIO Pin ist auf demselben Host mehrfach belegt
+	"""
+	boot = BootLog() if boot is None else boot
+	devs = devs or {}
+	configs = {}
+	for name, vehicle in config.items():
+		configs[name] = dict(DEFAULT_VEHICLE)
+		configs[name].update(vehicle)
+	buses = {}
+	with boot.phase('buses'):
+		pins = {}
+		for name, vehicle in configs.items():
+			host = vehicle['host']
+			for gpio in tuple(vehicle['servos']) + tuple(vehicle['escs']):
+				if (host, gpio) in pins:
+					raise ValueError('GPIO {} on host {} used by {} and {}'.format(gpio, host or 'localhost', pins[(host, gpio)], name))
+				pins[(host, gpio)] = name
+			if host not in buses:
+				if pi_factory is not None:
+					pi = pi_factory(host)
+				elif host is not None:
+					import pigpio
+					pi = pigpio.pi(host)
+				else:
+					pi = None
+				buses[host] = Bus(pi=pi, auto_flush=False)
+				buses[host].latency = LatencyMonitor({})
+			latency = buses[host].latency
+			for gpio, channel in zip(tuple(vehicle['servos']) + tuple(vehicle['escs']), ('servoLeft', 'servoRight', 'engineLeft', 'engineRight')):
+				latency.add(gpio, '{}.{}'.format(name, channel))
+
+	def actuators():
+		built = {}
+		for name, vehicle in configs.items():
+			bus = buses[vehicle['host']]
+			servos = tuple(Servo(gpio, 0, 180, 90, 0, False, bus=bus) for gpio in vehicle['servos'])
+			escs = tuple(Esc(gpio, bus=bus, arm=False) for gpio in vehicle['escs'])
+			built[name] = (servos, escs)
+		esc_arm_all([esc for servos, escs in built.values() for esc in escs])
+		return built
+
+	def controllers():
+		tasks = {name: (lambda name=name: Controller(dev=devs.get(name), device_uniq=configs[name]['device_uniq']))
+			for name in configs}
+		return startup_parallel(boot, tasks)
+
+	started = startup_parallel(boot, {'actuators': actuators, 'controllers': controllers})
+	with boot.phase('vehicles'):
+		vehicles = []
+		for name, vehicle in configs.items():
+			servos, escs = started['actuators'][name]
+			vehicles.append(Vehicle(name, started['controllers'][name], buses[vehicle['host']], servos, escs, vehicle, tick_rate))
+	return Fleet(vehicles)
+
+def fleet_main(config:dict, pi_factory=None, devs:dict=None, tick_rate:float=None):
+	"""Mehrere Fahrzeuge aufbauen und bis zum Beenden steuern.
+	Args:
+		config (dict): Fahrzeugkonfiguration je Name, siehe fleet_build()
+		pi_factory (callable, optional): Erzeugt die pigpio-Verbindung zu einem Host. Defaults to None.
+		devs (dict, optional): Bereits geoeffnete Eingabegeraete je Name. Defaults to None.
+		tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to None.
+	Returns:
+		Fleet: Beendete Fahrzeuge mit ihren Kennzahlen
+	"""
+	boot = BootLog()
+	fleet = fleet_build(config, pi_factory, devs, tick_rate, boot)
+	def ready():
+		boot.ready()
+		print(boot.report())
+	try:
+		asyncio.run(fleet.run(ready))
+	finally:
+		for bus in {id(vehicle.bus): vehicle.bus for vehicle in fleet.vehicles}.values():
+			print(bus.latency.report())
+	return fleet
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Control several RC boats with several Xbox controllers from one process.')
+	parser.add_argument('config', help='JSON file with one entry per vehicle, e.g. {"boat1": {"servos": [12, 13], "escs": [5, 6], "device_uniq": "..."}}')
+	args = parser.parse_args()
+	with open(args.config) as f:
+		fleet_main(json.load(f))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Klasse zur ereignisgesteuerten Erkennung neuer Eingabegeraete unter /dev/input (inotify).
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct('iIII')
+
+class InputWatcher():
+	def __init__(self, path:str='/dev/input', poll_interval:float=0.5):
+		"""Wartet auf neue oder geaenderte Geraetedateien (eventN) unter /dev/input.
+		Nutzt inotify ueber die libc. Ohne inotify wird das Verzeichnis alle poll_interval Sekunden verglichen.
+		Args:
+			path (str, optional): Ueberwachtes Verzeichnis. Defaults to '/dev/input'.
+			poll_interval (float, optional): Abfrageintervall ohne inotify in s. Defaults to 0.5.
+		"""
+		self.path = path
+		self.poll_interval = poll_interval
+		self.fd = None
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+			fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+			if fd < 0:
+				raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+			# IN_CREATE: Geraetedatei angelegt, IN_ATTRIB: Zugriffsrechte durch udev gesetzt
+			if libc.inotify_add_watch(fd, os.fsencode(path), IN_CREATE | IN_ATTRIB) < 0:
+				os.close(fd)
+				raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+			self.fd = fd
+		except (OSError, AttributeError):
+			self.known = self._list()
+
+	def _list(self):
+		"""[Private] Geraetedateien im Verzeichnis.
+		"""
+		try:
+			return {name for name in os.listdir(self.path) if name.startswith('event')}
+		except OSError:
+			return set()
+
+	def wait(self, timeout:float=None):
+		"""Auf neue oder geaenderte Geraetedateien warten.
+		Args:
+			timeout (float, optional): Maximale Wartezeit in s. Defaults to None (unbegrenzt).
+		Returns:
+			list: Pfade der neuen Geraetedateien, leer bei Zeitueberschreitung
+		"""
+		if self.fd is None:
+			return self._wait_poll(timeout)
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return []
+		try:
+			data = os.read(self.fd, 4096)
+		except BlockingIOError:
+			return []
+		paths = []
+		offset = 0
+		while offset + INOTIFY_EVENT.size <= len(data):
+			wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+			offset += INOTIFY_EVENT.size
+			name = data[offset:offset + length].rstrip(b'\0').decode()
+			offset += length
+			path = os.path.join(self.path, name)
+			if name.startswith('event') and path not in paths:
+				paths.append(path)
+		return paths
+
+	def _wait_poll(self, timeout:float=None):
+		"""[Private] Ersatz ohne inotify: Verzeichnis regelmaessig vergleichen.
+		"""
+		t_end = None if timeout is None else time.monotonic() + timeout
+		while True:
+			current = self._list()
+			new = current - self.known
+			self.known = current
+			if new:
+				return [os.path.join(self.path, name) for name in sorted(new)]
+			if t_end is not None and time.monotonic() >= t_end:
+				return []
+			delay = self.poll_interval if t_end is None else min(self.poll_interval, max(0., t_end - time.monotonic()))
+			time.sleep(delay)
+
+	def close(self):
+		"""inotify-Deskriptor schliessen.
+		"""
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
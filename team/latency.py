@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Klassen zur Messung der Latenz vom Controller-Event bis zur pigpio-Ausgabe.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from array import array
+
+class Histogram():
+	def __init__(self, sub_bits:int=3, max_bits:int=27):
+		"""Histogramm fester Groesse mit logarithmischen Klassen fuer Latenzen in us.
+		Pro Zweierpotenz gibt es 2**sub_bits Klassen (relativer Fehler < 2**-sub_bits).
+		Beim Eintragen wird kein Speicher angelegt.
+		Args:
+			sub_bits (int, optional): Unterteilung je Zweierpotenz. Defaults to 3.
+			max_bits (int, optional): Groesster erfassbarer Wert 2**max_bits us. Defaults to 27.
+		"""
+		self.sub_bits = sub_bits
+		self.sub_count = 1 << sub_bits
+		self.max_value = (1 << max_bits) - 1
+		self.counts = array('Q', bytes(8 * self.index(self.max_value) + 8))
+		self.count = 0
+		self.total = 0
+		self.max = 0
+
+	def index(self, value:int):
+		"""Klassenindex eines Wertes.
+		Args:
+			value (int): Wert in us
+		Returns:
+			int: Klassenindex
+		"""
+		if value < self.sub_count:
+			return value
+		shift = value.bit_length() - self.sub_bits - 1
+		return ((shift + 1) << self.sub_bits) + (value >> shift) - self.sub_count
+
+	def bounds(self, index:int):
+		"""Wertebereich einer Klasse.
+		Args:
+			index (int): Klassenindex
+		Returns:
+			tuple: Untere und obere Grenze in us
+		"""
+		if index < self.sub_count:
+			return index, index
+		shift = (index >> self.sub_bits) - 1
+		top = self.sub_count + (index & (self.sub_count - 1))
+		return top << shift, ((top + 1) << shift) - 1
+
+	def record(self, value:int):
+		"""Wert eintragen, zu grosse Werte landen in der obersten Klasse.
+		Args:
+			value (int): Wert in us
+		"""
+		if value < 0:
+			value = 0
+		elif value > self.max_value:
+			value = self.max_value
+		self.counts[self.index(value)] += 1
+		self.count += 1
+		self.total += value
+		if value > self.max:
+			self.max = value
+
+	def percentile(self, p:float):
+		"""Perzentil aus dem Histogramm (obere Klassengrenze).
+		Args:
+			p (float): Perzentil in %
+		Returns:
+			int: Wert in us
+		"""
+		if self.count == 0:
+			return 0
+		rank = p / 100. * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if count and seen >= rank:
+				return min(self.bounds(index)[1], self.max)
+		return self.max
+
+	def summary(self):
+		"""Returns:
+			dict: Anzahl, Mittelwert, p50, p90, p99, p99.9 und Maximum in us
+		"""
+		return {
+			'count': self.count,
+			'mean': self.total / self.count if self.count else 0.,
+			'p50': self.percentile(50),
+			'p90': self.percentile(90),
+			'p99': self.percentile(99),
+			'p99.9': self.percentile(99.9),
+			'max': self.max,
+		}
+
+	def reset(self):
+		"""Alle Eintraege loeschen.
+		"""
+		for index in range(len(self.counts)):
+			self.counts[index] = 0
+		self.count = 0
+		self.total = 0
+		self.max = 0
+
+
+class LatencyMonitor():
+	stages = ('event_dispatch', 'dispatch_write', 'event_write')
+
+	def __init__(self, names:dict):
+		"""Latenzhistogramme pro Ausgabekanal fuer Event->Verarbeitung->Ausgabe.
+		Args:
+			names (dict): Kanalname je GPIO Pin, {gpio: name}
+		"""
+		self.names = names
+		self.histograms = {gpio: {stage: Histogram() for stage in self.stages} for gpio in names}
+
+	def add(self, gpio:int, name:str):
+		"""Ausgabekanal nachtraeglich anmelden.
+		Args:
+			gpio (int): GPIO Pin
+			name (str): Kanalname
+		"""
+		self.names[gpio] = name
+		self.histograms[gpio] = {stage: Histogram() for stage in self.stages}
+
+	def record(self, gpio:int, t_event:float, t_dispatch:float, t_write:float):
+		"""Latenzen eines Ausgabewertes eintragen (Zeitpunkte in s, time.time()).
+		Args:
+			gpio (int): GPIO Pin
+			t_event (float): Kernel-Zeitstempel des Events (event.timestamp())
+			t_dispatch (float): Beginn der Verarbeitung im Regeltakt
+			t_write (float): Ende der pigpio-Ausgabe
+		"""
+		histograms = self.histograms.get(gpio)
+		if histograms is None:
+			return
+		histograms['event_dispatch'].record(int((t_dispatch - t_event) * 1e6))
+		histograms['dispatch_write'].record(int((t_write - t_dispatch) * 1e6))
+		histograms['event_write'].record(int((t_write - t_event) * 1e6))
+
+	def summary(self):
+		"""Returns:
+			dict: Zusammenfassung je Kanalname und Abschnitt, {name: {stage: summary}}
+		"""
+		return {self.names[gpio]: {stage: histogram.summary() for stage, histogram in histograms.items()}
+			for gpio, histograms in self.histograms.items()}
+
+	def report(self):
+		"""Returns:
+			str: Tabelle der Latenzen in us
+		"""
+		lines = ['{:<12} {:<15} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('channel', 'stage', 'count', 'p50', 'p99', 'p99.9', 'max')]
+		for name, stages in self.summary().items():
+			for stage, summary in stages.items():
+				lines.append('{:<12} {:<15} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+					name, stage, summary['count'], summary['p50'], summary['p99'], summary['p99.9'], summary['max']))
+		return '\n'.join(lines)
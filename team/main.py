@@ -5,186 +5,136 @@ __email__ = "teamprojekt@tuhh.de"
 __copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
 __version__ = "2023.1.0"
 
+import time
+T_START = time.monotonic()
+
+from startup import BootLog, esc_arm_all, startup_parallel
 from esc import Esc
 from servo import Servo
 from dev import Controller
-import time
-import pigpio
-
-def main():
+from bus import Bus
+from ramp import EscRamp
+from runtime import Runtime
+from watchdog import Watchdog
+from mapping import Mapping
+from latency import LatencyMonitor
+from recorder import Recorder
+from notify import Notifier
+import asyncio
+import os
+
+def main(tick_rate:float=None, failsafe_deadline:float=1., record_path:str=None, pi=None, dev=None, mixer:bool=False,
+         realtime:bool=False, setpoint_path:str=None, telemetry:str=None, telemetry_rate:float=10.):
     print("Software up and running")
-    
-    #Erstellung zweier Servos auf Pin 12 und 13
-    servoLeft = Servo(12,0,180,90,0,False)
-    servoRight = Servo(13, 0, 180, 90, 0, False)
-    
-    #led = pigpio.pi()
-    
-
-    #Erstellung zweier Motoren
-    engineLeft = Esc(5)
-    engineRight = Esc(6)
-    
-    
-
-    #Erstellung X-Box Controller
-    ctrl = Controller()
-
-    trimServoRight = 0
-    trimServoLeft = -2
-    trimSpeedLeft = -0.1
-    trimSpeedRight = 0.1
-    reset = False
-
-    for event in ctrl.dev.read_loop(): 
-            #print(f"{event.code} code")
-
-        if(event.code == ctrl.BTN_A):
-            if(event.value == 1):
-                if(reset == False):
-                    engineLeft.esc_write(1500)
-                    engineRight.esc_write(1500)
-                    servoLeft.servo_write(88)
-                    servoRight.servo_write(90)
-                    trimServoLeft = 88
-                    trimServoRight = 90
-                    reset = True
-        
-        elif(event.code == ctrl.BTN_LB):
-            if(event.value == 1):
-                #verwendung von reverse Thrust, wegen Drehbarkeit um maximal 180°
-                #servoLeft.servo_write(90)
-                #servoRight.servo_write(90)
-
-                #Schub des positiven Propellers auf 64% begrenzt, da der Vorschub in negative Richtung 64% des Vorschubes in positive Richtung beträgt
-
-                #propSpeedLeft = 1500 - 500 * (ctrl.ABS_LT / 1023)
-                #propSpeedRight = 1500 + 500 * (ctrl.ABS_LT / 1023)
-                
-                if(reset):
-                    engineLeft.esc_write(1300)
-                    engineRight.esc_write(1260)
-                    #Abweichung 20%
-               
-                    
-            else:
-                engineLeft.esc_write(1500)
-                engineRight.esc_write(1500)
-                
-
-        elif(event.code == ctrl.BTN_RB):
-            if(event.value == 1):
-                #verwendung von reverse Thrust, wegen Drehbarkeit um maximal 180°
-                #servoLeft.servo_write(90)
-                #servoRight.servo_write(90)
-                if(reset):
-                    engineLeft.esc_write(1740)
-                    engineRight.esc_write(1700)
-                    #Abweichung 20%
-            else:
-                engineLeft.esc_write(1500)
-                engineRight.esc_write(1500)
-        #Schub geben
-
-        elif(event.code == ctrl.ABS_RT):
-            #Umwandlung LT zu PWM Speed
-            propSpeed = 500 * (event.value / 1023)
-
-            if(propSpeed > 50):
-                speedLeft = 1500 - propSpeed * (1 + trimSpeedLeft)
-                speedRight = 1500 + propSpeed * (1 + trimSpeedRight) + 5
-            else:
-                speedLeft = 1500
-                speedRight = 1500
-            if(speedLeft > 2000):
-                speedLeft = 2000
-            elif(speedLeft < 1000):
-                speedLeft = 1000
-
-            if(speedRight > 2000):
-                speedRight = 2000
-            elif(speedRight < 1000):
-                speedRight = 1000 
-
-            engineLeft.esc_write(speedLeft)
-            engineRight.esc_write(speedRight)
-
-            #print(speedLeft)
-            #print(speedRight)
-
-            reset = False
-
-        elif(event.code == ctrl.ABS_LT):
-            #Umwandlung LT zu PWM Speed
-            propSpeed = 500 * (event.value / 1023)
-            if(propSpeed > 50):
-                speedLeft = 1500 + propSpeed * (1 + trimSpeedRight) 
-                speedRight = 1500 - propSpeed * (1 + trimSpeedLeft) - 5
-
-            else:
-                speedLeft = 1500
-                speedRight = 1500
-
-            if(speedLeft > 2000):
-                speedLeft = 2000
-            elif(speedLeft < 1000):
-                speedLeft = 1000
-
-            if(speedRight > 2000):
-                speedRight = 2000
-            elif(speedRight < 1000):
-                speedRight = 1000 
-            
-
-            engineLeft.esc_write(speedLeft)
-            engineRight.esc_write(speedRight)
-
-            #print(speedLeft)
-            #print(speedRight)
-
-            reset = False
-        #Trimmung:
-        elif(event.code == ctrl.ABS_DX):
-            trimSpeedLeft = trimSpeedLeft + 0.1 * event.value
-            trimSpeedRight = trimSpeedRight + 0.1 * event.value
-
-        #UP&Down
-
-        elif(event.code == ctrl.ABS_LSY):
-
-            moduledInputLeft = event.value - 32737
-
-            trimServoLeft = trimServoLeft + 5 * (moduledInputLeft/ 33000)
-
-            moduledInputRight = event.value - 32737
-
-            trimServoRight = trimServoRight - 5 * (moduledInputRight/ 33000)
-
-            #max: 65534
-
-            if(trimServoLeft > 180):
-                trimServoLeft = 180
-            elif(trimServoLeft < 0):
-                trimServoLeft = 0
-
-            if(trimServoRight > 180):
-                trimServoRight = 180
-            elif(trimServoRight < 0):
-                trimServoRight = 0
 
-            servoLeft.servo_write(trimServoLeft)
-            servoRight.servo_write(trimServoRight)
+    #Bootprotokoll ab Programmstart, Importe sind die erste Phase
+    boot = BootLog(T_START)
+    boot.add('imports', T_START)
 
-            #print(trimServoLeft)
-            #print(event.value)
+    #Gemeinsame pigpio-Verbindung, Ausgabe gesammelt einmal pro Regeltakt
+    with boot.phase('bus'):
+        bus = Bus(pi=pi, auto_flush=False)
+        bus.latency = LatencyMonitor({12: 'servoLeft', 13: 'servoRight', 5: 'engineLeft', 6: 'engineRight'})
+
+        #Flugschreiber fuer alle Eingaben und Ausgaben, auswerten mit: python3 recorder.py flight.rec -o flight.csv
+        #Die Aufzeichnung des vorherigen Starts (z.B. vor einem Absturz) liegt in flight.rec.1
+        recorder = Recorder(record_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flight.rec'), [12, 13, 5, 6])
+        bus.recorder = recorder
+
+    #Erstellung zweier Motoren, beide werden gleichzeitig scharfgeschaltet
+    def escs_arm():
+        escs = (Esc(5, bus=bus, arm=False), Esc(6, bus=bus, arm=False))
+        esc_arm_all(escs)
+        return escs
+
+    #Erstellung zweier Servos auf Pin 12 und 13
+    def servos_init():
+        return Servo(12,0,180,90,0,False, bus=bus), Servo(13, 0, 180, 90, 0, False, bus=bus)
+
+    #led = pigpio.pi()
 
-            #print(event.code)
+    #Scharfschalten, Servos und Suche nach dem X-Box Controller laufen parallel
+    started = startup_parallel(boot, {'escs': escs_arm, 'servos': servos_init, 'controller': lambda: Controller(dev=dev)})
+    engineLeft, engineRight = started['escs']
+    servoLeft, servoRight = started['servos']
+    ctrl = started['controller']
+
+    #systemd (Type=notify): READY=1 erst nach Scharfschalten und Controller, WATCHDOG=1 nur aus dem Regeltakt
+    notifier = Notifier()
+
+    #Bootprotokoll ausgeben und Bereitschaft melden, sobald die Laufzeitumgebung laeuft
+    def ready():
+        boot.ready()
+        print(boot.report())
+        notifier.ready('Ready after {:.0f} ms'.format(1e3 * boot.summary()['boot_to_ready']))
+
+    with boot.phase('runtime'):
+        #Gemeinsame Hintergrund-Rampe fuer beide Motoren
+        ramp = EscRamp([engineLeft, engineRight])
+
+        #Failsafe: Motoren stoppen, wenn der Controller laenger als failsafe_deadline keine Events sendet
+        watchdog = Watchdog(bus, [engineLeft, engineRight], [servoLeft, servoRight], failsafe_deadline)
+
+        #Zuordnung der Controller-Eingaben zu Servos und Motoren, wahlweise ueber den Mischer (benoetigt NumPy)
+        if mixer:
+            from mixer import Mixer
+            mapping = Mixer(ctrl, (servoLeft, servoRight), (engineLeft, engineRight))
+            update = None
+        else:
+            mapping = Mapping(ctrl, (servoLeft, servoRight), (engineLeft, engineRight), watchdog=watchdog)
+            #Zeitbasierte Servo-Trimmung ueber den Stick in jedem Regeltakt, ruht waehrend des Failsafes
+            update = mapping.update
+
+        #asyncio-Laufzeitumgebung mit festem Regeltakt, standardmaessig mit der PWM-Frequenz der Motoren
+        runtime = Runtime(ctrl, bus, [engineLeft, engineRight], [servoLeft, servoRight], ramp, tick_rate or engineLeft.pw_freq,
+                          watchdog=watchdog, recorder=recorder, on_ready=ready, notifier=notifier)
+
+        #Optionaler Echtzeitbetrieb gegen Ruckeln bei hoher Systemlast (SCHED_FIFO, mlockall, eingefrorene Garbage Collection)
+        if realtime:
+            from realtime import Realtime
+            runtime.realtime = Realtime()
+
+        #Optionale Sollwert-Schnittstelle fuer Autonomie-Skripte, der Controller hat immer Vorrang
+        if setpoint_path is not None:
+            from setpoint import SetpointServer
+            runtime.setpoints = SetpointServer([servoLeft, servoRight], [engineLeft, engineRight], setpoint_path,
+                                               manual_active=None if mixer else mapping.manual_active)
+
+        #Optionale Telemetrie per UDP an eine Bodenstation (HOST[:PORT]), anzeigen mit: python3 telemetry.py
+        if telemetry is not None:
+            from telemetry import TelemetryPublisher, TELEMETRY_PORT
+            host, _, port = telemetry.partition(':')
+            runtime.telemetry = TelemetryPublisher(host or '127.0.0.1', int(port or TELEMETRY_PORT), telemetry_rate, mapping)
+
+    try:
+        asyncio.run(runtime.run(mapping.handle_frame, update))
+    finally:
+        stats = bus.stats()
+        print("Events received: {}, writes issued: {}, flush time mean/max: {:.3f}/{:.3f} ms".format(
+            ctrl.events_received, stats['writes'], 1e3 * stats['flush_time_mean'], 1e3 * stats['flush_time_max']))
+        print(bus.latency.report())
+        recorder.close()
+        notifier.close()
+        if runtime.telemetry is not None:
+            runtime.telemetry.close()
+    return runtime.stats()
 
-            reset = False
-    
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description='Control an RC model with an Xbox controller.')
+    parser.add_argument('--mixer', action='store_true', help='use the stateless NumPy mixer instead of the table-driven mapping (same throttle, no reset gating or trims, LSX steers the servos)')
+    parser.add_argument('--realtime', action='store_true', help='run the control loop with SCHED_FIFO, mlockall and frozen GC')
+    parser.add_argument('--setpoints', nargs='?', const='', metavar='PATH', help='accept setpoints on a Unix datagram socket')
+    parser.add_argument('--telemetry', metavar='HOST[:PORT]', help='send UDP telemetry to a ground station')
+    parser.add_argument('--telemetry-rate', type=float, default=10., help='telemetry packets per second (default: 10)')
+    args = parser.parse_args()
+    setpoint_path = args.setpoints
+    if setpoint_path == '':
+        from setpoint import SETPOINT_PATH
+        setpoint_path = SETPOINT_PATH
+    main(mixer=args.mixer, realtime=args.realtime, setpoint_path=setpoint_path, telemetry=args.telemetry,
+         telemetry_rate=args.telemetry_rate)
 
 
 
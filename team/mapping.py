@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Klasse zur tabellengesteuerten Zuordnung von Controller-Eingaben zu Servos und RC-Reglern.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from evdev import ecodes
+import math
+import time
+
+# Zuordnung Controller-Eingang -> Aktion und Parameter der Aktionen
+DEFAULT_CONFIG = {
+	'bindings': {
+		'BTN_A': 'reset',
+		'BTN_LB': 'reverse',
+		'BTN_RB': 'forward',
+		'ABS_RT': 'throttle_forward',
+		'ABS_LT': 'throttle_reverse',
+		'ABS_DX': 'trim_speed',
+		'ABS_LSY': 'trim_servo',
+	},
+	# Trimmung zu Beginn
+	'trim_servo_left': -2.,
+	'trim_servo_right': 0.,
+	'trim_speed_left': -0.1,
+	'trim_speed_right': 0.1,
+	'trim_speed_step': 0.1,
+	# Servowinkel nach Reset
+	'reset_deg_left': 88.,
+	'reset_deg_right': 90.,
+	# Feste Pulsweiten der Bumper (links, rechts), Abweichung 20%
+	'reverse_pw': (1300, 1260),
+	'forward_pw': (1740, 1700),
+	# Trigger: Pulsweitenhub, Totzone und Versatz des rechten Motors
+	'throttle_range': 500.,
+	'throttle_deadband': 50.,
+	'throttle_offset': 5,
+	# Trigger und Bumper ueber die Rampe der RC-Regler (pw_slew, reverse_hold) statt direkt ausgeben
+	'throttle_safety': False,
+	# Stick: Mitte und Skalierung auf -1..1, Totzone, Zeitkonstante des Tiefpasses in s,
+	# Winkelgeschwindigkeit der Servos bei Vollausschlag in Grad/s und groesster Zeitschritt in s
+	'stick_center': 32737,
+	'stick_scale': 33000.,
+	'stick_deadzone': 0.05,
+	'stick_tau': 0.05,
+	'stick_rate': 90.,
+	'stick_dt_max': 0.1,
+}
+
+class Mapping():
+	def __init__(self, ctrl, servos:tuple, escs:tuple, config:dict=None, watchdog=None):
+		"""Tabellengesteuerte Zuordnung der Controller-Eingaben.
+		Die Zuordnung (type, code) -> Aktion wird beim Start aus der Konfiguration erzeugt.
+		Trigger werden ueber vorberechnete Tabellen direkt in begrenzte Pulsweiten umgesetzt,
+		die Tabellen werden nur bei einer Aenderung der Trimmung (ABS_DX) neu berechnet.
+		Der Stick gibt eine Winkelgeschwindigkeit der Servos vor, die in update() im festen
+		Regeltakt ueber die vergangene Zeit integriert wird (unabhaengig von der Eventrate).
+		Args:
+			ctrl (Controller): Xbox Controller
+			servos (tuple): Servos (links, rechts)
+			escs (tuple): RC-Regler (links, rechts)
+			config (dict, optional): Konfiguration, siehe DEFAULT_CONFIG. Defaults to None.
+			watchdog (Watchdog, optional): Failsafe-Watchdog, solange er ausgeloest ist, bleiben die Servos stehen. Defaults to None.
+		"""
+		self.ctrl = ctrl
+		self.watchdog = watchdog
+		self.servoLeft, self.servoRight = servos
+		self.engineLeft, self.engineRight = escs
+		self.config = dict(DEFAULT_CONFIG)
+		self.config.update(config or {})
+		self.trimServoLeft = self.config['trim_servo_left']
+		self.trimServoRight = self.config['trim_servo_right']
+		self.trimSpeedLeft = self.config['trim_speed_left']
+		self.trimSpeedRight = self.config['trim_speed_right']
+		self.is_reset = False
+		self.dispatch = {}
+		for name, action in self.config['bindings'].items():
+			event_type = ecodes.EV_KEY if name.startswith('BTN') else ecodes.EV_ABS
+			self.dispatch[(event_type, getattr(ctrl, name))] = getattr(self, action)
+		self.stick_value = 0.
+		self.stick_filtered = 0.
+		self.t_update = None
+		self.t_stick = None
+		self.at_limit = False
+		self.reconnects = ctrl.reconnects
+		self.trips = 0
+		self.build_trigger_tables()
+
+	def handle_frame(self, frame):
+		"""Alle Aenderungen eines Frames mit dem vollstaendigen Zustand nach dem SYN_REPORT verarbeiten.
+		Nach dem Wiederverbinden des Controllers beginnt der Stick neutral.
+		Args:
+			frame (Frame): Controller-Frame
+		"""
+		if self.reconnects != self.ctrl.reconnects:
+			# Erster Frame nach dem Wiederverbinden: keine Auslenkung aus der alten Verbindung uebernehmen
+			self.reconnects = self.ctrl.reconnects
+			self._stick_reset()
+		for key in frame.changed:
+			action = self.dispatch.get(key)
+			if action is not None:
+				if action == self.trim_servo:
+					# Ausloeser fuer die Latenzmessung der Servos, die erst in update() ausgegeben werden
+					self.t_stick = frame.timestamp
+				action(frame.state[key])
+
+	def manual_active(self):
+		"""Pruefen, ob der Pilot gerade eine Eingabe haelt: Trigger ausserhalb der Totzone, Bumper gedrueckt oder
+		Stick ausgelenkt. Ein ruhig gehaltener Eingang sendet keine Events, behaelt damit aber den Vorrang vor Sollwerten.
+		Returns:
+			bool: True, solange ein Eingang nicht in Ruhestellung ist
+		"""
+		if self.stick_value != 0.:
+			return True
+		pw_stop = (self.engineLeft.pw_stop, self.engineRight.pw_stop)
+		state = self.ctrl.state
+		for key, action in self.dispatch.items():
+			value = state.get(key, 0)
+			if value <= 0:
+				continue
+			if action == self.forward or action == self.reverse:
+				return True
+			if action == self.throttle_forward and self.forward_table[value] != pw_stop:
+				return True
+			if action == self.throttle_reverse and self.reverse_table[value] != pw_stop:
+				return True
+		return False
+
+	def build_trigger_tables(self):
+		"""Pulsweiten (links, rechts) fuer alle Triggerwerte mit der aktuellen Trimmung vorberechnen.
+		"""
+		config = self.config
+		pw_stop = self.engineLeft.pw_stop
+		trigger_max = self.ctrl.max_value_trigger
+		self.forward_table = []
+		self.reverse_table = []
+		for value in range(self.ctrl.min_value_trigger, trigger_max + 1):
+			propSpeed = config['throttle_range'] * (value / trigger_max)
+			if propSpeed > config['throttle_deadband']:
+				forward = (pw_stop - propSpeed * (1 + self.trimSpeedLeft),
+					pw_stop + propSpeed * (1 + self.trimSpeedRight) + config['throttle_offset'])
+				reverse = (pw_stop + propSpeed * (1 + self.trimSpeedRight),
+					pw_stop - propSpeed * (1 + self.trimSpeedLeft) - config['throttle_offset'])
+			else:
+				forward = reverse = (pw_stop, pw_stop)
+			self.forward_table.append(self._clamp_pw(forward))
+			self.reverse_table.append(self._clamp_pw(reverse))
+
+	def _clamp_pw(self, pw_vals:tuple):
+		"""[Private] Pulsweiten (links, rechts) runden und auf den Bereich der RC-Regler begrenzen.
+		"""
+		return tuple(min(max(int(round(pw_val)), esc.pw_min), esc.pw_max)
+			for pw_val, esc in zip(pw_vals, (self.engineLeft, self.engineRight)))
+
+	def _engines(self, pw_vals:tuple):
+		"""[Private] Pulsweiten (links, rechts) an beide RC-Regler ausgeben, mit throttle_safety ueber die Rampe.
+		"""
+		safety = self.config['throttle_safety']
+		self.engineLeft.esc_write(pw_vals[0], safety=safety)
+		self.engineRight.esc_write(pw_vals[1], safety=safety)
+
+	def _stop(self):
+		"""[Private] Beide Motoren sofort stoppen.
+		"""
+		self.engineLeft.esc_write(self.engineLeft.pw_stop)
+		self.engineRight.esc_write(self.engineRight.pw_stop)
+
+	def reset(self, value:int):
+		"""Motoren stoppen und Servos in Reset-Position fahren.
+		"""
+		if value == 1 and not self.is_reset:
+			self._stop()
+			self.trimServoLeft = self.config['reset_deg_left']
+			self.trimServoRight = self.config['reset_deg_right']
+			self.servoLeft.servo_write(self.trimServoLeft)
+			self.servoRight.servo_write(self.trimServoRight)
+			self.is_reset = True
+			self.ctrl.rumble('reset')
+
+	def reverse(self, value:int):
+		"""Feste Rueckwaertsfahrt solange der linke Bumper gedrueckt ist (nur nach Reset).
+		"""
+		if value == 1:
+			if self.is_reset:
+				self._engines(self.config['reverse_pw'])
+		else:
+			self._stop()
+
+	def forward(self, value:int):
+		"""Feste Vorwaertsfahrt solange der rechte Bumper gedrueckt ist (nur nach Reset).
+		"""
+		if value == 1:
+			if self.is_reset:
+				self._engines(self.config['forward_pw'])
+		else:
+			self._stop()
+
+	def throttle_forward(self, value:int):
+		"""Schub ueber den rechten Trigger.
+		"""
+		self._engines(self.forward_table[value])
+		self.is_reset = False
+
+	def throttle_reverse(self, value:int):
+		"""Umgekehrter Schub ueber den linken Trigger.
+		"""
+		self._engines(self.reverse_table[value])
+		self.is_reset = False
+
+	def trim_speed(self, value:int):
+		"""Trimmung der Motoren ueber das D-Pad, Trigger-Tabellen neu berechnen.
+		"""
+		if value == 0:
+			return
+		self.trimSpeedLeft += self.config['trim_speed_step'] * value
+		self.trimSpeedRight += self.config['trim_speed_step'] * value
+		self.build_trigger_tables()
+
+	def trim_servo(self, value:int):
+		"""Winkelgeschwindigkeit der Servos ueber den linken Stick (Y-Achse) vorgeben, normiert auf -1..1 mit Totzone.
+		Die Servos werden erst in update() bewegt.
+		"""
+		config = self.config
+		value = min(max((value - config['stick_center']) / config['stick_scale'], -1.), 1.)
+		deadzone = config['stick_deadzone']
+		if abs(value) <= deadzone:
+			self.stick_value = 0.
+		else:
+			self.stick_value = math.copysign((abs(value) - deadzone) / (1. - deadzone), value)
+
+	def _resume(self):
+		"""[Private] Gehaltene Trigger, Bumper und Stick aus dem vollstaendigen Controller-Zustand erneut ausgeben.
+		Losgelassene Eingaben werden uebergangen, damit sie gehaltene nicht stoppen, Reset und Trimmung nicht wiederholt.
+		"""
+		state = self.ctrl.state
+		for key, action in self.dispatch.items():
+			if key not in state:
+				continue
+			if action == self.trim_servo or (state[key] > 0 and action in (self.throttle_forward, self.throttle_reverse,
+				self.forward, self.reverse)):
+				action(state[key])
+
+	def _stick_reset(self):
+		"""[Private] Stick auf neutral setzen und die Integration neu beginnen.
+		"""
+		self.stick_value = 0.
+		self.stick_filtered = 0.
+		self.t_update = None
+		self.t_stick = None
+
+	def update(self, now:float):
+		"""Zeitbasierte Nachfuehrung im festen Regeltakt: Stick tiefpassfiltern und als Winkelgeschwindigkeit integrieren.
+		Solange der Watchdog ausgeloest ist, bleibt der Stick neutral und die Servos werden nicht geschrieben,
+		damit sie nicht mit der letzten Auslenkung aus der Failsafe-Stellung weiterlaufen.
+		Args:
+			now (float): Taktzeitpunkt (time.monotonic)
+		"""
+		config = self.config
+		t_dispatch = time.time()
+		if self.watchdog is not None:
+			if self.watchdog.tripped:
+				self._stick_reset()
+				return
+			if self.watchdog.trips != self.trips:
+				# Erster Takt nach dem Failsafe: gehaltene Eingaben erzeugen keine Events mehr
+				self.trips = self.watchdog.trips
+				self._resume()
+		dt = 0. if self.t_update is None else min(now - self.t_update, config['stick_dt_max'])
+		self.t_update = now
+		if dt <= 0.:
+			return
+		self.stick_filtered += (self.stick_value - self.stick_filtered) * dt / (config['stick_tau'] + dt)
+		if self.stick_value == 0. and abs(self.stick_filtered) < 1e-3:
+			self.stick_filtered = 0.
+			self.t_stick = None
+			return
+		deg_delta = config['stick_rate'] * self.stick_filtered * dt
+		deg_left = self.trimServoLeft + deg_delta
+		deg_right = self.trimServoRight - deg_delta
+		self.trimServoLeft = min(max(deg_left, 0), 180)
+		self.trimServoRight = min(max(deg_right, 0), 180)
+		# Einmalige Rueckmeldung beim Erreichen des Anschlags, nicht in jedem Takt
+		at_limit = deg_left != self.trimServoLeft or deg_right != self.trimServoRight
+		if at_limit and not self.at_limit:
+			self.ctrl.rumble('trim_limit')
+		self.at_limit = at_limit
+		bus = self.servoLeft.bus
+		if self.t_stick is not None:
+			# Erste Servoausgabe nach einer Stick-Aenderung: Kernel-Zeitstempel und Beginn der Nachfuehrung
+			bus.cause = (self.t_stick, t_dispatch)
+			self.t_stick = None
+		self.servoLeft.servo_write(self.trimServoLeft)
+		self.servoRight.servo_write(self.trimServoRight)
+		bus.cause = None
+		self.is_reset = False
+
+
+def mapping_test(deadline:float=0.3, silence:float=1.):
+	"""Mapping-Testfunktion ohne Hardware: Stick bei 3/4 Auslenkung halten, danach faellt der Controller aus.
+	Nach dem Ausloesen des Watchdogs muessen die Servos in der Failsafe-Stellung bleiben.
+	Args:
+		deadline (float, optional): Frist des Watchdogs in s. Defaults to 0.3.
+		silence (float, optional): Dauer ohne Controller-Events in s. Defaults to 1..
+	"""
+	import asyncio
+	from sim import SimPi, ReplayDevice
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	from dev import Controller
+	from runtime import Runtime
+	from watchdog import Watchdog
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	escs = [Esc(5, bus=bus, arm=False), Esc(6, bus=bus, arm=False)]
+	servos = [Servo(12, 0, 180, 90, 0, False, bus=bus), Servo(13, 0, 180, 90, 0, False, bus=bus)]
+	stick = DEFAULT_CONFIG['stick_center'] + int(0.75 * DEFAULT_CONFIG['stick_scale'])
+	ctrl = Controller(dev=ReplayDevice([(0., ecodes.EV_ABS, 1, stick), (0., ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+		(0.5 + silence, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)], link_lost=0.5))
+	watchdog = Watchdog(bus, escs, servos, deadline=deadline)
+	mapping = Mapping(ctrl, servos, escs, watchdog=watchdog)
+	runtime = Runtime(ctrl, bus, escs, servos, watchdog=watchdog, signals=False)
+	asyncio.run(runtime.run(mapping.handle_frame, mapping.update))
+	assert watchdog.trips == 1, 'watchdog did not trip once'
+	for servo in servos:
+		pw_failsafe = servo.servo_pw(servo.deg_start)
+		# Ausgaben ab der ersten Failsafe-Stellung nach Ablauf der Frist
+		trace = [pw_val for t, pw_val in pi.trace(servo.gpio) if t > watchdog.t_feed + deadline]
+		assert pw_failsafe in trace, 'servo on GPIO {} not at failsafe'.format(servo.gpio)
+		trace = trace[trace.index(pw_failsafe):]
+		print('GPIO {}: {} writes after the trip, {}'.format(servo.gpio, len(trace), sorted(set(trace))))
+		assert set(trace) == {pw_failsafe}, 'servo on GPIO {} moved after the failsafe'.format(servo.gpio)
+
+if __name__ == "__main__":
+	mapping_test()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Klasse und Testfunktion fuer einen Mischer: Controller-Zustand -> alle Servos und RC-Regler in einem Rechenschritt.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from evdev import ecodes
+import numpy as np
+
+# Eingaenge: Controller-Eingang, Wertebereich, bipolar (-1..1) oder unipolar (0..1), Totzone, Reskalierung nach der
+# Totzone und Expo (0: linear, 1: kubisch)
+# Ausgaenge: Trimmung (relative Verstaerkung, Versatz) und Grenzen normiert auf -1..1
+# Matrix: eine Zeile je Ausgang (engineLeft, engineRight, servoLeft, servoRight), eine Spalte je Eingang
+# Versatz: wird je Ausgang addiert, solange ein Eingang ausserhalb der Totzone ist (normiert, 0.01 = 5 us)
+# Die Vorgaben der Motoren entsprechen Mapping mit DEFAULT_CONFIG: Trimmung der Motoren (-0.1/+0.1) in der Matrix,
+# Pulsweitenhub 500 us, Totzone 50 us ohne Reskalierung, Versatz des rechten Motors 5 us, Bumper 1740/1700 und 1300/1260 us
+DEFAULT_MIXER = {
+	'inputs': {
+		'throttle_forward': {'control': 'ABS_RT', 'range': (0, 1023), 'bipolar': False, 'deadband': 0.1, 'rescale': False, 'expo': 0.},
+		'throttle_reverse': {'control': 'ABS_LT', 'range': (0, 1023), 'bipolar': False, 'deadband': 0.1, 'rescale': False, 'expo': 0.},
+		'forward': {'control': 'BTN_RB', 'range': (0, 1), 'bipolar': False, 'deadband': 0., 'rescale': True, 'expo': 0.},
+		'reverse': {'control': 'BTN_LB', 'range': (0, 1), 'bipolar': False, 'deadband': 0., 'rescale': True, 'expo': 0.},
+		'steer': {'control': 'ABS_LSX', 'range': (-32767, 32767), 'bipolar': True, 'deadband': 0.05, 'rescale': True, 'expo': 0.3},
+	},
+	'outputs': {
+		'engineLeft': {'trim_gain': 0., 'trim_offset': 0., 'limits': (-1., 1.)},
+		'engineRight': {'trim_gain': 0., 'trim_offset': 0., 'limits': (-1., 1.)},
+		'servoLeft': {'trim_gain': 0., 'trim_offset': -2. / 90., 'limits': (-1., 1.)},
+		'servoRight': {'trim_gain': 0., 'trim_offset': 0., 'limits': (-1., 1.)},
+	},
+	'matrix': (
+		(-0.9, 1.1, 0.48, -0.4, 0.),
+		(1.1, -0.9, 0.4, -0.48, 0.),
+		(0., 0., 0., 0., 0.5),
+		(0., 0., 0., 0., -0.5),
+	),
+	'offset': (
+		(0., 0., 0., 0., 0.),
+		(0.01, -0.01, 0., 0., 0.),
+		(0., 0., 0., 0., 0.),
+		(0., 0., 0., 0., 0.),
+	),
+	# Trigger und Bumper ueber die Rampe der RC-Regler ausgeben, wie Mapping throttle_safety
+	'throttle_safety': False,
+}
+
+class Mixer():
+	def __init__(self, ctrl, servos:tuple, escs:tuple, config:dict=None):
+		"""Mischer: bildet den vollstaendigen Controller-Zustand mit einer Mischmatrix auf alle Ausgaenge ab.
+		Pro Frame: Zustandsvektor normieren, Totzone und Expo je Eingang, Matrix, Versatz, Trimmung und Grenzen je Ausgang.
+		Alle Schritte sind vektorisiert und funktionieren ebenso fuer viele Zustaende gleichzeitig (mix_batch).
+		RC-Regler werden in us um pw_stop, Servos in Grad um die Mitte von deg_min/deg_max ausgegeben.
+		Trigger und Bumper ergeben mit DEFAULT_MIXER dieselben Pulsweiten wie Mapping. Der Mischer ist zustandslos:
+		Bumper wirken ohne vorherigen Reset, es gibt keinen Reset (BTN_A) und keine Trimmung ueber D-Pad und linken Stick (Y),
+		gleichzeitige Eingaben werden addiert und die Servos folgen dem linken Stick (X) als absolute Lenkung.
+		Args:
+			ctrl (Controller): Xbox Controller
+			servos (tuple): Servos (links, rechts)
+			escs (tuple): RC-Regler (links, rechts)
+			config (dict, optional): Konfiguration, siehe DEFAULT_MIXER. Defaults to None.
+		"""
+		self.ctrl = ctrl
+		self.servos = tuple(servos)
+		self.escs = tuple(escs)
+		self.config = dict(DEFAULT_MIXER)
+		self.config.update(config or {})
+		inputs = self.config['inputs']
+		outputs = self.config['outputs']
+		self.input_names = list(inputs)
+		self.output_names = list(outputs)
+		self.matrix = np.array(self.config['matrix'], dtype=float)
+		self.offset_matrix = np.array(self.config.get('offset', np.zeros(self.matrix.shape)), dtype=float)
+		if self.matrix.shape != (len(outputs), len(inputs)) or self.offset_matrix.shape != self.matrix.shape:
+			raise ValueError('Mixer matrix and offset must have shape {}'.format((len(outputs), len(inputs))))
+		# Eingaenge: Schluessel im Controller-Zustand, Normierung x = (value - offset) * scale
+		self.keys = []
+		offset, scale, self.rest = [], [], []
+		for spec in inputs.values():
+			event_type = ecodes.EV_KEY if spec['control'].startswith('BTN') else ecodes.EV_ABS
+			self.keys.append((event_type, getattr(ctrl, spec['control'])))
+			lo, hi = spec['range']
+			if spec['bipolar']:
+				offset.append((lo + hi) / 2.)
+				scale.append(2. / (hi - lo))
+			else:
+				offset.append(lo)
+				scale.append(1. / (hi - lo))
+			self.rest.append(offset[-1])
+		self.offset = np.array(offset)
+		self.scale = np.array(scale)
+		self.deadband = np.array([spec['deadband'] for spec in inputs.values()])
+		self.rescale = np.array([spec.get('rescale', True) for spec in inputs.values()])
+		self.expo = np.array([spec['expo'] for spec in inputs.values()])
+		self.gain = 1. + np.array([spec['trim_gain'] for spec in outputs.values()])
+		self.trim = np.array([spec['trim_offset'] for spec in outputs.values()])
+		self.limit_min = np.array([spec['limits'][0] for spec in outputs.values()])
+		self.limit_max = np.array([spec['limits'][1] for spec in outputs.values()])
+		# Ausgaenge: normierter Wert -1..1 -> Pulsweite in us bzw. Winkel in Grad
+		center, half = [], []
+		for esc in self.escs:
+			center.append(esc.pw_stop)
+			half.append(min(esc.pw_max - esc.pw_stop, esc.pw_stop - esc.pw_min))
+		for servo in self.servos:
+			center.append((servo.deg_min + servo.deg_max) / 2.)
+			half.append((servo.deg_max - servo.deg_min) / 2.)
+		self.center = np.array(center)
+		self.half = np.array(half)
+		self.n_escs = len(self.escs)
+		self.frames = 0
+
+	def state_vector(self, state:dict):
+		"""Zustandsvektor der Eingaenge aus dem Controller-Zustand. Fehlende Eingaenge gelten als Ruhelage.
+		Args:
+			state (dict): Controller-Zustand {(type, code): value}, z.B. Frame.state
+		Returns:
+			ndarray: Rohwerte der Eingaenge
+		"""
+		return np.array([state.get(key, rest) for key, rest in zip(self.keys, self.rest)], dtype=float)
+
+	def mix_batch(self, values):
+		"""Beliebig viele Zustaende in einem Rechenschritt mischen, z.B. fuer Offline-Abstimmung und Tests.
+		Args:
+			values (array_like): Rohwerte der Eingaenge, Form (n_inputs,) oder (N, n_inputs)
+		Returns:
+			ndarray: Ausgaben in us bzw. Grad, Form (n_outputs,) oder (N, n_outputs)
+		"""
+		x = (np.asarray(values, dtype=float) - self.offset) * self.scale
+		x = np.clip(x, -1., 1.)
+		# Totzone mit Reskalierung, damit der Vollausschlag erhalten bleibt, oder als Schwelle wie in Mapping
+		magnitude = np.where(self.rescale, np.maximum(np.abs(x) - self.deadband, 0.) / (1. - self.deadband),
+			np.where(np.abs(x) > self.deadband, np.abs(x), 0.))
+		x = np.copysign(magnitude, x)
+		x = (1. - self.expo) * x + self.expo * x ** 3
+		y = x @ self.matrix.T + (x != 0.) @ self.offset_matrix.T
+		y = np.clip(y * self.gain + self.trim, self.limit_min, self.limit_max)
+		return self.center + y * self.half
+
+	def mix(self, state:dict):
+		"""Einen Controller-Zustand mischen.
+		Args:
+			state (dict): Controller-Zustand {(type, code): value}
+		Returns:
+			ndarray: Ausgaben (RC-Regler in us, Servos in Grad)
+		"""
+		return self.mix_batch(self.state_vector(state))
+
+	def handle_frame(self, frame):
+		"""Alle Ausgaenge aus dem Zustand eines Frames berechnen und schreiben.
+		Unveraenderte Werte werden von Servo und Bus nicht erneut gesendet.
+		Args:
+			frame (Frame): Controller-Frame
+		"""
+		outputs = self.mix(frame.state)
+		safety = self.config['throttle_safety']
+		for esc, pw_val in zip(self.escs, outputs[:self.n_escs]):
+			esc.esc_write(int(round(pw_val)), safety=safety)
+		for servo, deg in zip(self.servos, outputs[self.n_escs:]):
+			servo.servo_write(float(deg))
+		self.frames += 1
+
+
+def mixer_test(count:int=100000):
+	"""Mischer-Testfunktion ohne Hardware: zufaellige Zustaende im Batch gegen Einzelberechnung und Grenzen pruefen,
+	Trigger und Bumper gegen die Tabellen und Pulsweiten von Mapping.
+	Args:
+		count (int, optional): Anzahl zufaelliger Zustaende. Defaults to 100000.
+	"""
+	import time
+	from types import SimpleNamespace
+	from mapping import Mapping
+	ctrl = SimpleNamespace(ABS_RT=9, ABS_LT=10, BTN_RB=311, BTN_LB=310, ABS_LSX=0, BTN_A=304, ABS_DX=16, ABS_LSY=1,
+		min_value_trigger=0, max_value_trigger=1023, reconnects=0)
+	escs = [SimpleNamespace(pw_min=1000, pw_max=2000, pw_stop=1500) for _ in range(2)]
+	servos = [SimpleNamespace(deg_min=0, deg_max=180) for _ in range(2)]
+	mixer = Mixer(ctrl, servos, escs)
+	rng = np.random.default_rng(0)
+	lo = np.array([spec['range'][0] for spec in mixer.config['inputs'].values()])
+	hi = np.array([spec['range'][1] for spec in mixer.config['inputs'].values()])
+	values = rng.integers(lo, hi + 1, size=(count, len(lo)))
+	t_start = time.perf_counter()
+	outputs = mixer.mix_batch(values)
+	t_batch = time.perf_counter() - t_start
+	print('Batch: {} states in {:.1f} ms ({:.2f} us/state)'.format(count, 1e3 * t_batch, 1e6 * t_batch / count))
+	for idx in rng.integers(0, count, size=100):
+		state = dict(zip(mixer.keys, values[idx]))
+		assert np.allclose(mixer.mix(state), outputs[idx]), 'batch and single state differ'
+	assert (outputs[:, :2] >= 1000).all() and (outputs[:, :2] <= 2000).all(), 'ESC output out of range'
+	assert (outputs[:, 2:] >= 0).all() and (outputs[:, 2:] <= 180).all(), 'servo output out of range'
+	rest = mixer.mix({})
+	assert np.allclose(rest[:2], 1500), 'ESCs not at pw_stop in rest position'
+	print('Rest position: {}'.format(np.round(rest, 2)))
+	# Gleiches Regelgesetz wie Mapping fuer alle Triggerwerte und beide Bumper
+	mapping = Mapping(ctrl, servos, escs)
+	triggers = np.arange(1024)
+	for idx, table in ((0, mapping.forward_table), (1, mapping.reverse_table)):
+		values = np.zeros((len(triggers), len(mixer.keys)))
+		values[:, idx] = triggers
+		pw_vals = [tuple(int(round(pw_val)) for pw_val in row) for row in mixer.mix_batch(values)[:, :2]]
+		assert pw_vals == table, 'trigger {} differs from Mapping'.format(mixer.input_names[idx])
+	for name, pw_key in (('forward', 'forward_pw'), ('reverse', 'reverse_pw')):
+		pw_vals = mixer.mix({mixer.keys[mixer.input_names.index(name)]: 1})[:2]
+		assert tuple(int(round(pw_val)) for pw_val in pw_vals) == tuple(mapping.config[pw_key]), 'bumper {} differs from Mapping'.format(name)
+
+if __name__ == "__main__":
+	mixer_test()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Klassen und Testfunktion fuer die Bereitschafts- und Watchdog-Meldungen an systemd (Type=notify).
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import os
+import signal
+import socket
+import tempfile
+import time
+
+class Notifier():
+	def __init__(self, path:str=None, watchdog_usec:int=None):
+		"""Meldungen an systemd ueber $NOTIFY_SOCKET (sd_notify-Protokoll, ohne libsystemd).
+		Ohne $NOTIFY_SOCKET (z.B. Start von Hand) sind alle Meldungen wirkungslos.
+		WATCHDOG=1 wird hoechstens alle WatchdogSec/2 gesendet, egal wie oft watchdog() aufgerufen wird.
+		Args:
+			path (str, optional): Pfad des Sockets, '@' fuer den abstrakten Namensraum. Defaults to None ($NOTIFY_SOCKET).
+			watchdog_usec (int, optional): Watchdog-Frist in us. Defaults to None ($WATCHDOG_USEC, falls $WATCHDOG_PID passt).
+		"""
+		self.path = os.environ.get('NOTIFY_SOCKET') if path is None else path
+		if watchdog_usec is None:
+			pid = os.environ.get('WATCHDOG_PID')
+			if pid is None or int(pid) == os.getpid():
+				watchdog_usec = int(os.environ.get('WATCHDOG_USEC', 0))
+		self.watchdog_interval = watchdog_usec / 2e6 if watchdog_usec else None
+		self.sock = None
+		if self.path:
+			self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+			self.address = '\0' + self.path[1:] if self.path.startswith('@') else self.path
+		self.t_ready = None
+		self.t_ping = None
+		self.pings = 0
+		self.errors = 0
+
+	@property
+	def enabled(self):
+		"""Returns:
+			bool: True, wenn systemd Meldungen erwartet
+		"""
+		return self.sock is not None
+
+	def notify(self, **fields):
+		"""Meldung senden, blockiert nie.
+		Args:
+			fields: Felder der Meldung, z.B. READY=1, STATUS='...'
+		Returns:
+			bool: True, wenn die Meldung gesendet wurde
+		"""
+		if self.sock is None:
+			return False
+		message = '\n'.join('{}={}'.format(key, value) for key, value in fields.items()).encode()
+		try:
+			self.sock.sendto(message, socket.MSG_DONTWAIT, self.address)
+		except OSError:
+			self.errors += 1
+			return False
+		return True
+
+	def ready(self, status:str=None):
+		"""Betriebsbereitschaft melden (READY=1), nur beim ersten Aufruf.
+		Args:
+			status (str, optional): Statustext fuer systemctl status. Defaults to None.
+		"""
+		if self.t_ready is not None:
+			return
+		self.t_ready = time.monotonic()
+		fields = {'READY': 1}
+		if status is not None:
+			fields['STATUS'] = status
+		self.notify(**fields)
+
+	def watchdog(self, now:float=None):
+		"""Lebenszeichen (WATCHDOG=1), aus dem Regeltakt aufrufen. Bleibt der Regeltakt stehen,
+		bleibt auch das Lebenszeichen aus und systemd startet den Dienst neu.
+		Args:
+			now (float, optional): Taktzeitpunkt (time.monotonic). Defaults to None (jetzt).
+		"""
+		if self.watchdog_interval is None or self.t_ready is None:
+			return
+		now = time.monotonic() if now is None else now
+		if self.t_ping is not None and now - self.t_ping < self.watchdog_interval:
+			return
+		self.t_ping = now
+		if self.notify(WATCHDOG=1):
+			self.pings += 1
+
+	def stopping(self):
+		"""Geordnetes Beenden melden (STOPPING=1).
+		"""
+		self.notify(STOPPING=1)
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+
+	def stats(self):
+		"""Returns:
+			dict: Aktiv, Watchdog-Intervall in s, gesendete Lebenszeichen und Sendefehler
+		"""
+		return {'enabled': self.enabled, 'watchdog_interval': self.watchdog_interval, 'pings': self.pings, 'errors': self.errors}
+
+
+class NotifyListener():
+	def __init__(self, path:str=None, watchdog_sec:float=2.):
+		"""Lokaler Ersatz fuer systemd beim Testen: empfaengt die Meldungen auf einem eigenen Socket,
+		misst die Zeit bis READY=1 und prueft die Watchdog-Frist wie systemd (WatchdogSec).
+		Args:
+			path (str, optional): Pfad des Sockets. Defaults to None (Temp-Verzeichnis).
+			watchdog_sec (float, optional): Watchdog-Frist in s, None ohne Watchdog. Defaults to 2..
+		"""
+		self.path = os.path.join(tempfile.gettempdir(), 'teamprojekt-notify-{}.sock'.format(os.getpid())) if path is None else path
+		self.watchdog_sec = watchdog_sec
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+		self.sock.bind(self.path)
+		self.t_start = time.monotonic()
+		self.t_ready = None
+		self.t_ping = None
+		self.messages = []
+		self.pings = 0
+		self.ping_gap_max = 0.
+		self.expired = 0
+
+	def environ(self, env:dict=None):
+		"""Returns:
+			dict: Umgebung fuer den Dienst mit NOTIFY_SOCKET und WATCHDOG_USEC
+		"""
+		env = dict(os.environ if env is None else env)
+		env['NOTIFY_SOCKET'] = self.path
+		env.pop('WATCHDOG_PID', None)
+		if self.watchdog_sec is not None:
+			env['WATCHDOG_USEC'] = str(int(self.watchdog_sec * 1e6))
+		else:
+			env.pop('WATCHDOG_USEC', None)
+		return env
+
+	def receive(self, timeout:float=None):
+		"""Meldungen empfangen und auswerten, bis timeout abgelaufen ist.
+		Args:
+			timeout (float, optional): Wartezeit in s. Defaults to None (eine Meldung).
+		Returns:
+			list: Empfangene Meldungen als (Zeit ab Start in s, {Feld: Wert})
+		"""
+		received = []
+		t_end = None if timeout is None else time.monotonic() + timeout
+		while True:
+			remaining = None if t_end is None else t_end - time.monotonic()
+			if remaining is not None and remaining <= 0:
+				break
+			self.sock.settimeout(remaining)
+			try:
+				data = self.sock.recv(4096)
+			except socket.timeout:
+				break
+			now = time.monotonic()
+			fields = dict(line.split('=', 1) for line in data.decode().splitlines() if '=' in line)
+			if fields.get('READY') == '1' and self.t_ready is None:
+				self.t_ready = now
+				self.t_ping = now
+			if fields.get('WATCHDOG') == '1':
+				self.pings += 1
+				if self.t_ping is not None:
+					self.ping_gap_max = max(self.ping_gap_max, now - self.t_ping)
+				self.t_ping = now
+			message = (now - self.t_start, fields)
+			self.messages.append(message)
+			received.append(message)
+			if t_end is None:
+				break
+		return received
+
+	def watchdog_expired(self, now:float=None):
+		"""Pruefen, ob die Watchdog-Frist seit dem letzten Lebenszeichen abgelaufen ist (wie systemd).
+		Returns:
+			bool: True, falls systemd den Dienst jetzt abbrechen wuerde
+		"""
+		if self.watchdog_sec is None or self.t_ping is None:
+			return False
+		now = time.monotonic() if now is None else now
+		if now - self.t_ping <= self.watchdog_sec:
+			return False
+		self.ping_gap_max = max(self.ping_gap_max, now - self.t_ping)
+		self.expired += 1
+		self.t_ping = None
+		return True
+
+	@property
+	def boot_to_ready(self):
+		"""Returns:
+			float: Zeit vom Start des Empfaengers bis READY=1 in s, None vor READY=1
+		"""
+		return None if self.t_ready is None else self.t_ready - self.t_start
+
+	def close(self):
+		self.sock.close()
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+
+def notify_run(command:list, watchdog_sec:float=2., restart:bool=False):
+	"""Dienst wie unter systemd mit Type=notify starten: Meldungen ausgeben, Zeit bis READY=1 messen und
+	den Dienst bei abgelaufener Watchdog-Frist mit SIGABRT abbrechen (WatchdogSignal von systemd).
+	Args:
+		command (list): Befehl des Dienstes, z.B. ['python3', 'main.py']
+		watchdog_sec (float, optional): Watchdog-Frist in s (WatchdogSec). Defaults to 2..
+		restart (bool, optional): Dienst nach einem Abbruch neu starten (Restart=on-failure). Defaults to False.
+	Returns:
+		int: Rueckgabewert des (letzten) Dienstprozesses
+	"""
+	import subprocess
+	while True:
+		listener = NotifyListener(watchdog_sec=watchdog_sec)
+		process = subprocess.Popen(command, env=listener.environ())
+		try:
+			while process.poll() is None:
+				for t, fields in listener.receive(0.1):
+					if 'WATCHDOG' not in fields:
+						print('[notify {:8.3f} s] {}'.format(t, ' '.join('{}={}'.format(*item) for item in fields.items())))
+					if 'READY' in fields:
+						print('[notify] boot to ready: {:.1f} ms'.format(1e3 * listener.boot_to_ready))
+				if listener.watchdog_expired():
+					print('[notify] watchdog expired after {:.3f} s without WATCHDOG=1, sending SIGABRT'.format(listener.ping_gap_max))
+					process.send_signal(signal.SIGABRT)
+			returncode = process.wait()
+		except KeyboardInterrupt:
+			process.send_signal(signal.SIGTERM)
+			returncode = process.wait()
+			restart = False
+		finally:
+			print('[notify] exit {}, {} pings, longest gap {:.3f} s'.format(process.returncode, listener.pings, listener.ping_gap_max))
+			listener.close()
+		if not restart or returncode == 0:
+			return returncode
+
+
+def notify_test(duration:float=3., stall:float=2.5, watchdog_sec:float=1., tick_rate:float=50.):
+	"""Notify-Testfunktion ohne Hardware und ohne systemd: Laufzeitumgebung mit SimPi und ReplayDevice
+	gegen den lokalen Ersatz-Socket. Prueft READY=1 nach dem Scharfschalten, regelmaessige Lebenszeichen
+	aus dem Regeltakt und das Ausbleiben der Lebenszeichen bei einem haengenden Regeltakt.
+	Args:
+		duration (float, optional): Laufzeit in s. Defaults to 3..
+		stall (float, optional): Dauer eines kuenstlich haengenden Regeltakts in s. Defaults to 2.5.
+		watchdog_sec (float, optional): Watchdog-Frist in s. Defaults to 1..
+		tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to 50..
+	"""
+	import asyncio
+	import threading
+	from evdev import ecodes
+	from sim import SimPi, ReplayDevice
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	from dev import Controller
+	from startup import BootLog, esc_arm_all
+	from runtime import Runtime
+	listener = NotifyListener(watchdog_sec=watchdog_sec)
+	notifier = Notifier(listener.path, int(watchdog_sec * 1e6))
+	boot = BootLog()
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	with boot.phase('escs'):
+		escs = [Esc(5, bus=bus, arm=False, arm_time=0.5), Esc(6, bus=bus, arm=False, arm_time=0.5)]
+		esc_arm_all(escs)
+	servos = [Servo(12, bus=bus), Servo(13, bus=bus)]
+	t_end = duration + stall
+	ctrl = Controller(dev=ReplayDevice([(t_end, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)]))
+	t_stall = []
+
+	def update(now):
+		# Einmal den Regeltakt anhalten, wie bei einem haengenden pigpio-Aufruf
+		if not t_stall and now - boot.t_start > duration / 2:
+			t_stall.append(now)
+			time.sleep(stall)
+
+	def ready():
+		boot.ready()
+		notifier.ready('boot to ready {:.0f} ms'.format(1e3 * boot.summary()['boot_to_ready']))
+
+	expired = []
+	done = threading.Event()
+	def listen():
+		# Bis nach dem Ende der Laufzeitumgebung empfangen, damit STOPPING=1 nicht verloren geht
+		while not done.is_set():
+			listener.receive(0.05)
+			if listener.watchdog_expired():
+				expired.append(time.monotonic())
+		listener.receive(0.1)
+	thread = threading.Thread(target=listen, daemon=True)
+	thread.start()
+	runtime = Runtime(ctrl, bus, escs, servos, tick_rate=tick_rate, on_ready=ready, notifier=notifier)
+	asyncio.run(runtime.run(lambda frame: None, update))
+	done.set()
+	thread.join()
+	listener.close()
+	notifier.close()
+	print(boot.report())
+	print('Listener: ready after {:.1f} ms, {} pings, longest gap {:.3f} s, expired {}x'.format(
+		1e3 * listener.boot_to_ready, listener.pings, listener.ping_gap_max, listener.expired))
+	assert listener.t_ready is not None, 'READY=1 not received'
+	assert boot.summary()['phases']['escs']['end'] <= listener.boot_to_ready, 'READY=1 sent before the ESCs were armed'
+	assert listener.pings >= 0.8 * duration / (watchdog_sec / 2), 'too few watchdog pings'
+	assert len(expired) == 1 and expired[0] - t_stall[0] < stall, 'stalled control tick not detected'
+	assert any(message.get('STOPPING') == '1' for t, message in listener.messages), 'STOPPING=1 not received'
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Local stand-in for the systemd notify socket: run a service with Type=notify semantics.')
+	parser.add_argument('-w', '--watchdog-sec', type=float, default=2., help='watchdog timeout in s like WatchdogSec, 0 to disable (default: 2)')
+	parser.add_argument('-r', '--restart', action='store_true', help='restart the service after a failure like Restart=on-failure')
+	parser.add_argument('--test', action='store_true', help='run the headless notify test')
+	parser.add_argument('command', nargs='*', help='service command, e.g. -- python3 main.py')
+	args = parser.parse_args()
+	if args.test or not args.command:
+		notify_test()
+	else:
+		raise SystemExit(notify_run(args.command, args.watchdog_sec or None, args.restart))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Klasse fuer einen Sampling-Profiler, der im laufenden Betrieb ein- und ausgeschaltet werden kann.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+class SamplingProfiler():
+	def __init__(self, interval:float=0.005, max_depth:int=64):
+		"""Sampling-Profiler: ein Hintergrund-Thread liest in festen Abstaenden die Aufrufstapel aller anderen Threads.
+		Die profilierten Threads werden dabei nicht angehalten oder instrumentiert.
+		Ergebnis im Folded-Format (eine Zeile je Stapel, Aufrufe mit ';' getrennt, Anzahl Samples),
+		direkt verwendbar mit flamegraph.pl oder speedscope.
+		Args:
+			interval (float, optional): Abtastintervall in s. Defaults to 0.005.
+			max_depth (int, optional): Maximale Stapeltiefe je Sample. Defaults to 64.
+		"""
+		self.interval = interval
+		self.max_depth = max_depth
+		self.stacks = Counter()
+		self.samples = 0
+		self.t_start = None
+		self.t_stop = None
+		self._thread = None
+		self._running = threading.Event()
+		self.lock = threading.Lock()
+
+	@property
+	def active(self):
+		"""Returns:
+			bool: True, solange der Profiler laeuft
+		"""
+		return self._running.is_set()
+
+	def start(self):
+		"""Profiler mit leeren Zaehlern starten.
+		"""
+		if self.active:
+			return
+		with self.lock:
+			self.stacks = Counter()
+			self.samples = 0
+		self.t_start = time.time()
+		self.t_stop = None
+		self._running.set()
+		self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		"""Profiler anhalten, die Zaehler bleiben fuer dump() erhalten.
+		"""
+		if not self.active:
+			return
+		self._running.clear()
+		self._thread.join()
+		self._thread = None
+		self.t_stop = time.time()
+
+	def toggle(self):
+		"""Profiler starten bzw. anhalten.
+		Returns:
+			bool: True, wenn der Profiler jetzt laeuft
+		"""
+		if self.active:
+			self.stop()
+		else:
+			self.start()
+		return self.active
+
+	def _run(self):
+		"""[Private] Abtastschleife des Profiler-Threads.
+		"""
+		own = threading.get_ident()
+		t_next = time.monotonic()
+		while self._running.is_set():
+			names = {thread.ident: thread.name for thread in threading.enumerate()}
+			sample = []
+			for ident, frame in sys._current_frames().items():
+				if ident == own:
+					continue
+				stack = []
+				while frame is not None and len(stack) < self.max_depth:
+					code = frame.f_code
+					stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+					frame = frame.f_back
+				stack.append(names.get(ident, str(ident)))
+				sample.append(';'.join(reversed(stack)))
+			with self.lock:
+				self.stacks.update(sample)
+				self.samples += 1
+			t_next += self.interval
+			delay = t_next - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				t_next = time.monotonic()
+
+	def dump(self, path:str):
+		"""Gezaehlte Stapel im Folded-Format in eine Datei schreiben, haeufigste zuerst.
+		Args:
+			path (str): Ausgabedatei
+		Returns:
+			int: Anzahl Abtastungen
+		"""
+		with self.lock:
+			stacks = self.stacks.most_common()
+			samples = self.samples
+		with open(path, 'w') as f:
+			for stack, count in stacks:
+				f.write('{} {}\n'.format(stack, count))
+		return samples
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Klasse zum nicht-blockierenden Anfahren und Bremsen mehrerer RC-Regler im Hintergrund.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import threading
+import time
+
+class EscRamp():
+	def __init__(self, escs:list=None, period:float=0.01):
+		"""Zeitgesteuerte Rampe fuer beliebig viele RC-Regler.
+		Jeder Regler bekommt eine Zielpulsweite (Esc.esc_target), die Rampe
+		fuehrt alle Regler gleichzeitig mit ihrer Anstiegsrate (Esc.pw_slew) nach.
+		Args:
+			escs (list, optional): Liste der RC-Regler. Defaults to None.
+			period (float, optional): Schrittweite der Rampe in s. Defaults to 0.01.
+		"""
+		self.period = period
+		self.lock = threading.RLock()
+		self.escs = []
+		self._thread = None
+		self._stop = threading.Event()
+		for esc in escs or []:
+			self.add(esc)
+
+	def add(self, esc):
+		"""Regler an der Rampe anmelden.
+		Args:
+			esc (Esc): RC-Regler
+		"""
+		with self.lock:
+			esc.ramp = self
+			self.escs.append(esc)
+
+	def step(self, now:float=None):
+		"""Alle Regler um einen Rampenschritt nachfuehren.
+		Args:
+			now (float, optional): Zeitpunkt (time.monotonic). Defaults to None.
+		"""
+		if now is None:
+			now = time.monotonic()
+		with self.lock:
+			for esc in self.escs:
+				esc.esc_ramp_step(now)
+			buses = {esc.bus for esc in self.escs}
+		for bus in buses:
+			if not bus.auto_flush:
+				bus.flush()
+
+	def active(self):
+		"""Returns:
+			bool: True, solange mindestens ein Regler noch nicht am Ziel ist.
+		"""
+		with self.lock:
+			return any(esc.pw_target is not None for esc in self.escs)
+
+	def start(self):
+		"""Rampe als Hintergrund-Thread starten.
+		"""
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name='EscRamp', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		"""Hintergrund-Thread beenden. Laufende Rampen bleiben stehen.
+		"""
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def _run(self):
+		"""[Private] Taktschleife des Hintergrund-Threads.
+		"""
+		t_next = time.monotonic()
+		while True:
+			t_next += self.period
+			if self._stop.wait(max(0., t_next - time.monotonic())):
+				break
+			self.step()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Klasse und Messfunktionen fuer einen Echtzeitbetrieb der Regelschleife mit geringerem Jitter.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from tick import ControlTick
+from latency import Histogram
+import ctypes
+import ctypes.util
+import gc
+import math
+import os
+import time
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+class Realtime():
+	def __init__(self, priority:int=50, cpus:set=None, lock_memory:bool=True, gc_freeze:bool=True):
+		"""Echtzeitbetrieb des Prozesses: SCHED_FIFO, CPU-Affinitaet, mlockall und eingefrorene Garbage Collection.
+		Jeder Schritt ist einzeln abschaltbar. Fehlende Rechte (CAP_SYS_NICE, RLIMIT_MEMLOCK) fuehren nur
+		zu einer Warnung, der Betrieb laeuft dann ohne diesen Schritt weiter.
+		Threads, die nach enable() gestartet werden, erben Prioritaet und Affinitaet.
+		Args:
+			priority (int, optional): SCHED_FIFO Prioritaet (1-99), None ohne Echtzeitprioritaet. Defaults to 50.
+			cpus (set, optional): Erlaubte CPU-Kerne, z.B. {3}. Defaults to None (unveraendert).
+			lock_memory (bool, optional): Gesamten Speicher mit mlockall sperren (keine Seitenfehler). Defaults to True.
+			gc_freeze (bool, optional): Bestehende Objekte einfrieren und automatische Garbage Collection abschalten. Defaults to True.
+		"""
+		self.priority = priority
+		self.cpus = cpus
+		self.lock_memory = lock_memory
+		self.gc_freeze = gc_freeze
+		self.applied = {}
+		self.enabled = False
+		self._policy = None
+		self._affinity = None
+
+	def enable(self):
+		"""Echtzeitbetrieb einschalten.
+		Returns:
+			dict: Erfolg je Schritt, {'sched_fifo': bool, 'affinity': bool, 'mlockall': bool, 'gc_freeze': bool}
+		"""
+		self.applied = {}
+		if self.priority is not None:
+			try:
+				self._policy = (os.sched_getscheduler(0), os.sched_getparam(0))
+				os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+				self.applied['sched_fifo'] = True
+			except (OSError, AttributeError) as e:
+				print('Realtime: SCHED_FIFO not applied: {}'.format(e))
+				self.applied['sched_fifo'] = False
+		if self.cpus is not None:
+			try:
+				self._affinity = os.sched_getaffinity(0)
+				os.sched_setaffinity(0, self.cpus)
+				self.applied['affinity'] = True
+			except (OSError, AttributeError) as e:
+				print('Realtime: CPU affinity not applied: {}'.format(e))
+				self.applied['affinity'] = False
+		if self.lock_memory:
+			libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+			if libc.mlockall(MCL_CURRENT | MCL_FUTURE) == 0:
+				self.applied['mlockall'] = True
+			else:
+				print('Realtime: mlockall not applied: {}'.format(os.strerror(ctypes.get_errno())))
+				self.applied['mlockall'] = False
+		if self.gc_freeze:
+			# Alle bis hier erzeugten Objekte aus der Garbage Collection nehmen, danach nur noch gezielt sammeln
+			gc.collect()
+			gc.freeze()
+			gc.disable()
+			self.applied['gc_freeze'] = True
+		self.enabled = True
+		return self.applied
+
+	def disable(self):
+		"""Echtzeitbetrieb beenden und den vorherigen Zustand wiederherstellen.
+		"""
+		if not self.enabled:
+			return
+		if self.applied.get('gc_freeze'):
+			gc.enable()
+			gc.unfreeze()
+		if self.applied.get('mlockall'):
+			ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6').munlockall()
+		if self.applied.get('affinity'):
+			os.sched_setaffinity(0, self._affinity)
+		if self.applied.get('sched_fifo'):
+			os.sched_setscheduler(0, *self._policy)
+		self.enabled = False
+
+	def collect(self):
+		"""Junge Generationen gezielt sammeln, wenn die automatische Garbage Collection abgeschaltet ist.
+		Gedacht fuer die Verwaltungsaufgaben ausserhalb des Regeltakts.
+		Returns:
+			int: Anzahl gesammelter Objekte
+		"""
+		if self.enabled and self.applied.get('gc_freeze'):
+			return gc.collect(1)
+		return 0
+
+
+def jitter_measure(duration:float=10., rate:float=50.):
+	"""Jitter eines festen Takts messen: Abweichung der Taktdauer und Weckverzoegerung.
+	Args:
+		duration (float, optional): Messdauer in s. Defaults to 10..
+		rate (float, optional): Taktfrequenz in Hz. Defaults to 50..
+	Returns:
+		dict: Taktdauer (Mittelwert, Standardabweichung, Varianz, min, max in us),
+			Weckverzoegerung (p50, p99, p99.9, max in us) und Ueberlaeufe
+	"""
+	tick = ControlTick(rate)
+	lateness = Histogram()
+	count = int(duration * rate)
+	# Vorab angelegt, damit die Messung selbst keinen Speicher anfordert
+	periods = [0.] * count
+	t_last = None
+	for idx in range(count):
+		t_tick = tick.wait()
+		now = time.monotonic()
+		lateness.record(int((now - t_tick) * 1e6))
+		if t_last is not None:
+			periods[idx] = now - t_last
+		t_last = now
+	periods = [1e6 * period for period in periods[1:]]
+	mean = sum(periods) / len(periods)
+	variance = sum((period - mean) ** 2 for period in periods) / len(periods)
+	return {
+		'period_mean': mean,
+		'period_std': math.sqrt(variance),
+		'period_var': variance,
+		'period_min': min(periods),
+		'period_max': max(periods),
+		'late_p50': lateness.percentile(50),
+		'late_p99': lateness.percentile(99),
+		'late_p99.9': lateness.percentile(99.9),
+		'late_max': lateness.max,
+		'overruns': tick.overruns,
+	}
+
+def jitter_compare(duration:float=10., rate:float=50., load:int=0, **kwargs):
+	"""Jitter ohne und mit Echtzeitbetrieb auf derselben Hardware messen.
+	Args:
+		duration (float, optional): Messdauer je Durchlauf in s. Defaults to 10..
+		rate (float, optional): Taktfrequenz in Hz. Defaults to 50..
+		load (int, optional): Anzahl Prozesse mit CPU-Dauerlast waehrend der Messung. Defaults to 0.
+		kwargs: Parameter fuer Realtime
+	Returns:
+		dict: Messwerte je Betriebsart, {'normal': {...}, 'realtime': {...}, 'applied': {...}}
+	"""
+	import multiprocessing
+	workers = [multiprocessing.Process(target=_load, daemon=True) for _ in range(load)]
+	for worker in workers:
+		worker.start()
+	try:
+		result = {'normal': jitter_measure(duration, rate)}
+		realtime = Realtime(**kwargs)
+		result['applied'] = realtime.enable()
+		try:
+			result['realtime'] = jitter_measure(duration, rate)
+		finally:
+			realtime.disable()
+	finally:
+		for worker in workers:
+			worker.terminate()
+	return result
+
+def _load():
+	"""[Private] CPU-Dauerlast mit Speicheranforderungen fuer jitter_compare.
+	"""
+	while True:
+		[str(idx) for idx in range(1000)]
+
+def jitter_report(result:dict):
+	"""Returns:
+		str: Tabelle der Jitter-Messung in us
+	"""
+	keys = ('period_mean', 'period_std', 'period_var', 'period_min', 'period_max', 'late_p50', 'late_p99', 'late_p99.9', 'late_max', 'overruns')
+	lines = ['{:<12} {:>12} {:>12}'.format('', 'normal', 'realtime')]
+	for key in keys:
+		lines.append('{:<12} {:>12.1f} {:>12.1f}'.format(key, result['normal'][key], result['realtime'][key]))
+	lines.append('applied: {}'.format(', '.join('{}={}'.format(step, ok) for step, ok in result['applied'].items())))
+	return '\n'.join(lines)
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Measure control loop jitter with and without realtime mode.')
+	parser.add_argument('-d', '--duration', type=float, default=10., help='duration per run in s (default: 10)')
+	parser.add_argument('-r', '--rate', type=float, default=50., help='loop rate in Hz (default: 50)')
+	parser.add_argument('--priority', type=int, default=50, help='SCHED_FIFO priority (default: 50)')
+	parser.add_argument('--cpus', type=int, nargs='+', help='CPU cores for the control process')
+	parser.add_argument('--load', type=int, default=0, help='number of CPU load processes during the measurement')
+	args = parser.parse_args()
+	print(jitter_report(jitter_compare(args.duration, args.rate, args.load, priority=args.priority,
+		cpus=set(args.cpus) if args.cpus else None)))
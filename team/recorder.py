@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Klasse und Dekodierfunktion fuer einen binaeren Flugschreiber (Ringpuffer in einer Datei).
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# Dateikopf: Kennung, Version, Anzahl Kanaele, Datensatzgroesse, Kapazitaet, Schreibzaehler, GPIO Pins
+HEADER = struct.Struct('<4sHHIIQ8H')
+HEADER_MAGIC = b'FREC'
+HEADER_VERSION = 1
+# Datensatz: Zeitstempel, Quelle, Code, Wert, Pulsweiten aller Kanaele
+RECORD = struct.Struct('<dHHi4H')
+MAX_CHANNELS = 4
+# Quellen: evdev Eventtypen (EV_KEY, EV_ABS, ...) oder Ausgabe an einen Kanal
+SOURCE_OUTPUT = 0xffff
+
+class Recorder():
+	def __init__(self, path:str, gpios:list, capacity:int=65536):
+		"""Flugschreiber: Datensaetze fester Groesse in einer speichereingeblendeten Ringdatei.
+		Die Daten liegen direkt im Page-Cache und ueberstehen einen Absturz des Programms.
+		Aeltere Datensaetze werden bei vollem Ring ueberschrieben. Eine vorhandene Ringdatei wird
+		vor dem Oeffnen nach <path>.1 verschoben, damit die Aufzeichnung vor einem Neustart erhalten bleibt.
+		Args:
+			path (str): Pfad der Ringdatei
+			gpios (list): GPIO Pins der aufgezeichneten Kanaele (max. 4)
+			capacity (int, optional): Anzahl Datensaetze im Ring. Defaults to 65536.
+		"""
+		if len(gpios) > MAX_CHANNELS:
+			raise ValueError('Recorder supports at most {} channels'.format(MAX_CHANNELS))
+		self.path = path
+		self.gpios = list(gpios)
+		self.channel = {gpio: idx for idx, gpio in enumerate(self.gpios)}
+		self.capacity = capacity
+		self.pw_vals = [0] * MAX_CHANNELS
+		self.lock = threading.Lock()
+		self.count = 0
+		size = HEADER.size + capacity * RECORD.size
+		if os.path.exists(path):
+			os.replace(path, path + '.1')
+		self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+		os.ftruncate(self.fd, size)
+		self.map = mmap.mmap(self.fd, size)
+		self._write_header()
+
+	def _write_header(self):
+		"""[Private] Dateikopf mit aktuellem Schreibzaehler schreiben.
+		"""
+		gpios = self.gpios + [0] * (8 - len(self.gpios))
+		HEADER.pack_into(self.map, 0, HEADER_MAGIC, HEADER_VERSION, len(self.gpios), RECORD.size,
+			self.capacity, self.count, *gpios)
+
+	def record(self, source:int, code:int, value:int, timestamp:float=None):
+		"""Datensatz mit den aktuellen Pulsweiten aller Kanaele schreiben.
+		Args:
+			source (int): Quelle, evdev Eventtyp oder SOURCE_OUTPUT
+			code (int): Eventcode bzw. GPIO Pin bei SOURCE_OUTPUT
+			value (int): Eventwert bzw. Pulsweite bei SOURCE_OUTPUT
+			timestamp (float, optional): Zeitstempel (time.time()). Defaults to None.
+		"""
+		if timestamp is None:
+			timestamp = time.time()
+		with self.lock:
+			if source == SOURCE_OUTPUT and code in self.channel:
+				self.pw_vals[self.channel[code]] = int(value)
+			offset = HEADER.size + (self.count % self.capacity) * RECORD.size
+			RECORD.pack_into(self.map, offset, timestamp, source, code, int(value), *self.pw_vals)
+			self.count += 1
+			# Schreibzaehler im Kopf zuletzt, damit ein Absturz nur den letzten Datensatz betrifft
+			struct.pack_into('<Q', self.map, 16, self.count)
+
+	def close(self):
+		"""Ringdatei auf den Datentraeger schreiben und schliessen.
+		"""
+		with self.lock:
+			if self.map is None:
+				return
+			self.map.flush()
+			self.map.close()
+			os.close(self.fd)
+			self.map = None
+
+
+def recorder_read(path:str):
+	"""Datensaetze einer Ringdatei lesen, aelteste zuerst.
+	Args:
+		path (str): Pfad der Ringdatei
+	Returns:
+		tuple: GPIO Pins der Kanaele und Liste der Datensaetze (timestamp, source, code, value, pw_vals)
+	"""
+	with open(path, 'rb') as f:
+		data = f.read()
+	magic, version, channels, record_size, capacity, count, *gpios = HEADER.unpack_from(data, 0)
+	if magic != HEADER_MAGIC or version != HEADER_VERSION or record_size != RECORD.size:
+		raise ValueError('{} is not a flight recorder file'.format(path))
+	records = []
+	for idx in range(max(0, count - capacity), count):
+		timestamp, source, code, value, *pw_vals = RECORD.unpack_from(data, HEADER.size + (idx % capacity) * RECORD.size)
+		records.append((timestamp, source, code, value, pw_vals[:channels]))
+	return gpios[:channels], records
+
+def recorder_decode(path:str, out=None):
+	"""Ringdatei des Flugschreibers in CSV umwandeln, aelteste Datensaetze zuerst.
+	Args:
+		path (str): Pfad der Ringdatei
+		out (file, optional): Ausgabe. Defaults to None (sys.stdout).
+	Returns:
+		int: Anzahl ausgegebener Datensaetze
+	"""
+	out = sys.stdout if out is None else out
+	gpios, records = recorder_read(path)
+	out.write(','.join(['timestamp', 'source', 'code', 'value'] + ['pw_{}'.format(gpio) for gpio in gpios]) + '\n')
+	for timestamp, source, code, value, pw_vals in records:
+		source = 'OUT' if source == SOURCE_OUTPUT else str(source)
+		out.write('{:.6f},{},{},{},{}\n'.format(timestamp, source, code, value, ','.join(str(pw) for pw in pw_vals)))
+	return len(records)
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Decode a flight recorder ring file to CSV.')
+	parser.add_argument('path', help='flight recorder ring file')
+	parser.add_argument('-o', '--output', help='CSV output file (default: stdout)')
+	args = parser.parse_args()
+	if args.output:
+		with open(args.output, 'w') as f:
+			recorder_decode(args.path, f)
+	else:
+		recorder_decode(args.path)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Klasse fuer zwischengespeicherte, nicht blockierende Vibrationseffekte des Controllers.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from evdev import ecodes, ff
+import queue
+import threading
+import time
+
+# Effekt: Staerke grosser und kleiner Motor (0-0xffff), Dauer und Pause in ms, Wiederholungen
+EFFECTS = {
+	'connect': (0x0000, 0xffff, 200, 100, 2),
+	'reset': (0x0000, 0x8000, 100, 0, 1),
+	'trim_limit': (0x4000, 0x0000, 80, 0, 1),
+	'failsafe': (0xffff, 0xffff, 500, 200, 3),
+	'low_battery': (0x8000, 0x0000, 300, 300, 3),
+}
+
+class Rumble():
+	def __init__(self, dev, effects:dict=None):
+		"""Vibrationseffekte: werden einmal beim Verbinden hochgeladen und danach nur noch ueber ihre ID abgespielt.
+		Das Abspielen laeuft in einem eigenen Thread aus einer Warteschlange, play() blockiert nie.
+		Wiederholte Anfragen werden zusammengefasst: ein Effekt wird nicht erneut eingereiht, solange er wartet
+		oder noch abgespielt wird.
+		Args:
+			dev (InputDevice): Eingabegeraet mit Force Feedback
+			effects (dict, optional): Effekte je Name, siehe EFFECTS. Defaults to None (EFFECTS).
+		"""
+		self.effects = dict(EFFECTS if effects is None else effects)
+		self.dev = None
+		self.ids = {}
+		self.pending = set()
+		self.t_playing = {}
+		self.played = 0
+		self.collapsed = 0
+		self.errors = 0
+		self.lock = threading.Lock()
+		self.queue = queue.Queue()
+		self._thread = threading.Thread(target=self._run, name='rumble', daemon=True)
+		self._thread.start()
+		self.upload(dev)
+
+	def upload(self, dev):
+		"""Alle Effekte auf ein (neu) verbundenes Geraet hochladen und ihre IDs zwischenspeichern.
+		Geraete ohne Force Feedback werden ohne Fehler uebergangen.
+		Args:
+			dev (InputDevice): Eingabegeraet
+		"""
+		ids = {}
+		for name, (strong, weak, length_ms, delay_ms, repeat_count) in self.effects.items():
+			effect = ff.Effect(
+				ecodes.FF_RUMBLE, -1, 0,
+				ff.Trigger(0, 0),
+				ff.Replay(length_ms, delay_ms),
+				ff.EffectType(ff_rumble_effect=ff.Rumble(strong, weak))
+			)
+			try:
+				ids[name] = dev.upload_effect(effect)
+			except (OSError, AttributeError) as e:
+				print('Rumble: effect {} not uploaded: {}'.format(name, e))
+				break
+		with self.lock:
+			self.dev = dev
+			self.ids = ids
+			self.pending.clear()
+			self.t_playing.clear()
+
+	def play(self, name:str):
+		"""Effekt zum Abspielen einreihen, kehrt sofort zurueck.
+		Args:
+			name (str): Name des Effekts
+		Returns:
+			bool: False, wenn die Anfrage zusammengefasst oder der Effekt nicht verfuegbar ist
+		"""
+		with self.lock:
+			if name not in self.ids:
+				return False
+			if name in self.pending or time.monotonic() < self.t_playing.get(name, 0.):
+				self.collapsed += 1
+				return False
+			self.pending.add(name)
+		self.queue.put_nowait(name)
+		return True
+
+	def _run(self):
+		"""[Private] Abspiel-Thread: Effekte aus der Warteschlange ueber ihre ID starten.
+		"""
+		while True:
+			name = self.queue.get()
+			if name is None:
+				return
+			with self.lock:
+				self.pending.discard(name)
+				dev = self.dev
+				effect_id = self.ids.get(name)
+			if effect_id is None:
+				continue
+			strong, weak, length_ms, delay_ms, repeat_count = self.effects[name]
+			try:
+				dev.write(ecodes.EV_FF, effect_id, repeat_count)
+				self.played += 1
+				with self.lock:
+					self.t_playing[name] = time.monotonic() + repeat_count * (length_ms + delay_ms) / 1000.
+			except OSError:
+				# z.B. Verbindungsabbruch, die Effekte werden beim Wiederverbinden neu hochgeladen
+				self.errors += 1
+
+	def close(self):
+		"""Abspiel-Thread beenden und die Effekte vom Geraet entfernen.
+		"""
+		self.queue.put(None)
+		self._thread.join()
+		with self.lock:
+			for effect_id in self.ids.values():
+				try:
+					self.dev.erase_effect(effect_id)
+				except (OSError, AttributeError):
+					pass
+			self.ids = {}
+
+	def stats(self):
+		"""Returns:
+			dict: Abgespielte, zusammengefasste und fehlgeschlagene Effekte sowie Anzahl hochgeladener Effekte
+		"""
+		return {'played': self.played, 'collapsed': self.collapsed, 'errors': self.errors, 'effects': len(self.ids)}
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Klasse fuer die asyncio-Laufzeitumgebung der Hauptfunktion.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from tick import ControlTick
+from latency import Histogram
+from profiler import SamplingProfiler
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import os
+import signal
+import tempfile
+import time
+
+class Runtime():
+	def __init__(self, ctrl, bus, escs:list, servos:list, ramp=None, tick_rate:float=50., housekeeping_period:float=1.,
+	watchdog=None, recorder=None, on_ready=None, realtime=None, dump_dir:str=None, signals:bool=True, setpoints=None,
+	battery_low:int=15, notifier=None, telemetry=None):
+		"""asyncio-Laufzeitumgebung: Eingabe, Regeltakt, Rampe und Verwaltung als getrennte Tasks.
+		Blockierende pigpio-Aufrufe laufen in einem eigenen Ausgabe-Thread.
+		Im Betrieb startet bzw. stoppt SIGUSR1 den Sampling-Profiler, SIGUSR2 schreibt alle Kennzahlen
+		als JSON nach dump_dir. Dateien werden ausserhalb der Eventschleife geschrieben.
+		Args:
+			ctrl (Controller): Xbox Controller
+			bus (Bus): Aktor-Bus aller Servos und RC-Regler (auto_flush=False)
+			escs (list): RC-Regler, werden beim Beenden auf pw_stop gesetzt
+			servos (list): Servos, werden beim Beenden auf deg_start gesetzt
+			ramp (EscRamp, optional): Rampe der RC-Regler, wird als Task getaktet. Defaults to None.
+			tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to 50..
+			housekeeping_period (float, optional): Intervall der Verwaltungsaufgaben in s. Defaults to 1..
+			watchdog (Watchdog, optional): Failsafe-Watchdog, wird von jedem Controller-Frame und der Verbindungspruefung (link_task) zurueckgesetzt. Defaults to None.
+			recorder (Recorder, optional): Flugschreiber, zeichnet jedes Controller-Event auf. Defaults to None.
+			on_ready (callable, optional): Wird einmal aufgerufen, sobald alle Tasks laufen. Defaults to None.
+			realtime (Realtime, optional): Echtzeitbetrieb, wird vor dem Start des Watchdogs ein- und beim Beenden ausgeschaltet. Defaults to None.
+			dump_dir (str, optional): Verzeichnis fuer Profile und Kennzahlen. Defaults to None (tempfile.gettempdir()).
+			signals (bool, optional): Signalhandler anmelden, False wenn mehrere Laufzeitumgebungen in einem Prozess laufen (Fleet). Defaults to True.
+			setpoints (SetpointServer, optional): Sollwert-Schnittstelle fuer autonome Steuerung, der Controller hat Vorrang. Defaults to None.
+			battery_low (int, optional): Ladezustand des Controllers in %, ab dem einmalig vibriert wird. Defaults to 15.
+			notifier (Notifier, optional): systemd-Meldungen, Lebenszeichen kommen nur aus dem Regeltakt. Defaults to None.
+			telemetry (TelemetryPublisher, optional): Telemetrie per UDP, wird in einem eigenen Task getaktet. Defaults to None.
+		"""
+		self.ctrl = ctrl
+		self.bus = bus
+		self.escs = escs
+		self.servos = servos
+		self.ramp = ramp
+		self.watchdog = watchdog
+		self.recorder = recorder
+		self.on_ready = on_ready
+		self.realtime = realtime
+		self.signals = signals
+		self.setpoints = setpoints
+		self.notifier = notifier
+		self.telemetry = telemetry
+		self.tick = ControlTick(tick_rate)
+		self.housekeeping_period = housekeeping_period
+		self.battery_low = battery_low
+		self.battery = None
+		self.battery_warned = False
+		self.trips_notified = 0
+		self.pending = None
+		self.loop_lag_max = 0.
+		self.dump_dir = tempfile.gettempdir() if dump_dir is None else dump_dir
+		self.profiler = SamplingProfiler()
+		# Dauer der Abschnitte eines Regeltakts in us, tick_late: Verspaetung des Takts
+		self.phase_times = {phase: Histogram() for phase in ('tick_late', 'handler', 'update', 'flush')}
+		self.executor = None
+		self.loop = None
+		self._stop = None
+
+	async def output(self, func, *args):
+		"""Blockierende Ausgabe im Ausgabe-Thread ausfuehren.
+		Alle Ausgaben laufen nacheinander im selben Thread und behalten ihre Reihenfolge.
+		Args:
+			func (callable): Auszufuehrende Funktion
+		"""
+		return await self.loop.run_in_executor(self.executor, func, *args)
+
+	def stop(self):
+		"""Laufzeitumgebung geordnet beenden. Ein wartendes reconnect() wird abgebrochen,
+		sonst blockiert dessen Thread das Beenden des Prozesses.
+		"""
+		self.ctrl.cancel()
+		if self._stop is not None:
+			self._stop.set()
+
+	async def run(self, handler, update=None):
+		"""Alle Tasks starten und bis zum Beenden (stop(), SIGINT, SIGTERM oder Fehler) laufen lassen.
+		Beim Beenden werden zuerst die Eingabe, dann Regeltakt und Rampe gestoppt und
+		abschliessend alle RC-Regler auf pw_stop gesetzt.
+		Args:
+			handler (callable): Wird pro Regeltakt mit dem zusammengefassten Frame aufgerufen (Controller.frames())
+			update (callable, optional): Wird in jedem Regeltakt mit dem Taktzeitpunkt aufgerufen, z.B. Mapping.update. Defaults to None.
+		"""
+		self.loop = asyncio.get_running_loop()
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pigpio')
+		self._stop = asyncio.Event()
+		if self.signals:
+			for sig in (signal.SIGINT, signal.SIGTERM):
+				self.loop.add_signal_handler(sig, self.stop)
+			self.loop.add_signal_handler(signal.SIGUSR1, self.profile_toggle)
+			self.loop.add_signal_handler(signal.SIGUSR2, self.stats_dump)
+		tasks = [
+			asyncio.create_task(self.input_task(), name='input'),
+			asyncio.create_task(self.control_task(handler, update), name='control'),
+			asyncio.create_task(self.housekeeping_task(), name='housekeeping'),
+		]
+		if self.ramp is not None:
+			tasks.append(asyncio.create_task(self.ramp_task(), name='ramp'))
+		if self.telemetry is not None:
+			tasks.append(asyncio.create_task(self.telemetry_task(), name='telemetry'))
+		if self.watchdog is not None:
+			tasks.append(asyncio.create_task(self.link_task(), name='link'))
+		stop = asyncio.create_task(self._stop.wait(), name='stop')
+		if self.realtime is not None:
+			# Vor dem Start des Watchdogs und des Ausgabe-Threads, beide erben SCHED_FIFO und die CPU-Zuordnung
+			self.realtime.enable()
+		if self.watchdog is not None:
+			self.watchdog.start()
+		if self.setpoints is not None:
+			# Sollwerte halten den Watchdog ebenso am Leben wie Controller-Eingaben
+			self.setpoints.open(self.loop, self.watchdog.feed if self.watchdog is not None else None)
+		if self.on_ready is not None:
+			self.on_ready()
+		try:
+			done, _ = await asyncio.wait(tasks + [stop], return_when=asyncio.FIRST_COMPLETED)
+			if tasks[0] in done and tasks[0].exception() is None:
+				# Ende des Eventstroms (z.B. Wiedergabe): letzte Eingaben noch verarbeiten
+				await self.control_step(handler, update, time.monotonic())
+		finally:
+			if self.notifier is not None:
+				self.notifier.stopping()
+			self.ctrl.cancel()
+			for task in tasks + [stop]:
+				task.cancel()
+				try:
+					await task
+				except (asyncio.CancelledError, Exception):
+					pass
+			if self.setpoints is not None:
+				self.setpoints.close()
+			await self.shutdown()
+			if self.watchdog is not None:
+				self.watchdog.stop()
+			if self.realtime is not None:
+				self.realtime.disable()
+			self.profiler.stop()
+			if self.signals:
+				for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2):
+					self.loop.remove_signal_handler(sig)
+		for task in done:
+			if task is not stop and task.exception() is not None:
+				raise task.exception()
+
+	async def shutdown(self):
+		"""Alle RC-Regler sofort auf pw_stop und alle Servos auf deg_start setzen und ausgeben,
+		danach den Ausgabe-Thread beenden.
+		"""
+		for esc in self.escs:
+			esc.esc_write(esc.pw_stop)
+		for servo in self.servos:
+			servo.servo_write(servo.deg_start)
+		await self.output(self.bus.flush)
+		self.executor.shutdown(wait=True)
+
+	async def input_task(self):
+		"""Controller-Frames lesen und bis zum naechsten Regeltakt zusammenfassen.
+		Der neueste Frame gibt den Zustand vor, die geaenderten (type, code) aller Frames werden vereinigt.
+		Bei Verbindungsabbruch bleiben die Aktoren im Failsafe, bis der Controller wieder erscheint.
+		"""
+		while True:
+			try:
+				async for frame in self.ctrl.frames():
+					if self.watchdog is not None:
+						self.watchdog.feed()
+					if self.recorder is not None:
+						for event_type, code in frame.changed:
+							self.recorder.record(event_type, code, frame.state[(event_type, code)], frame.timestamp)
+					if self.pending is not None:
+						frame = frame._replace(changed=self.pending.changed | frame.changed)
+					self.pending = frame
+				return
+			except OSError:
+				# Verbindungsabbruch: Failsafe sofort ausloesen und auf den Controller warten
+				print('Controller disconnected, waiting for reconnect')
+				self.pending = None
+				await self.output(self.failsafe)
+				if await asyncio.to_thread(self.ctrl.reconnect) is None:
+					return
+
+	async def link_task(self):
+		"""Verbindung zum Controller regelmaessig pruefen und den Watchdog fuettern, solange sie besteht.
+		Ohne Eingabeaenderung sendet der Kernel keine Events, ein gehaltener Trigger waere sonst ein Verbindungsabbruch.
+		Laeuft in der Eventschleife: haengt diese, bleibt das Lebenszeichen aus und der Watchdog loest aus.
+		"""
+		period = self.watchdog.deadline / 4
+		while True:
+			await asyncio.sleep(period)
+			if self.ctrl.link_alive():
+				self.watchdog.feed()
+
+	def failsafe(self):
+		"""Alle RC-Regler stoppen und alle Servos auf deg_start setzen (ueber den Watchdog, falls vorhanden).
+		"""
+		if self.watchdog is not None:
+			self.watchdog.trip()
+			return
+		for esc in self.escs:
+			esc.esc_write(esc.pw_stop)
+		for servo in self.servos:
+			servo.servo_write(servo.deg_start)
+		self.bus.flush()
+
+	async def control_task(self, handler, update=None):
+		"""Fester Regeltakt: geaenderte Eingaben verarbeiten und gesammelt ausgeben.
+		Args:
+			handler (callable): Wird pro Regeltakt mit dem zusammengefassten Frame aufgerufen
+			update (callable, optional): Wird in jedem Regeltakt mit dem Taktzeitpunkt aufgerufen. Defaults to None.
+		"""
+		while True:
+			now = await self.tick.wait_async()
+			await self.control_step(handler, update, now)
+
+	async def control_step(self, handler, update=None, now:float=None):
+		"""Ein Regeltakt: gesammelte Eingaben verarbeiten, zeitbasierte Nachfuehrung und Ausgabe.
+		Args:
+			handler (callable): Wird mit dem zusammengefassten Frame aufgerufen
+			update (callable, optional): Wird mit dem Taktzeitpunkt aufgerufen. Defaults to None.
+			now (float, optional): Taktzeitpunkt (time.monotonic). Defaults to None.
+		"""
+		frame, self.pending = self.pending, None
+		t_start = time.perf_counter()
+		if now is not None:
+			self.phase_times['tick_late'].record(int((time.monotonic() - now) * 1e6))
+		if frame is not None:
+			# Ausloeser fuer die Latenzmessung: Kernel-Zeitstempel und Verarbeitungsbeginn
+			self.bus.cause = (frame.timestamp, time.time())
+			handler(frame)
+			self.bus.cause = None
+			if self.setpoints is not None:
+				self.setpoints.manual(now)
+		t_handler = time.perf_counter()
+		if update is not None:
+			update(time.monotonic() if now is None else now)
+		if self.setpoints is not None:
+			self.setpoints.apply(now, self.bus)
+		t_update = time.perf_counter()
+		await self.output(self.bus.flush)
+		t_flush = time.perf_counter()
+		if frame is not None:
+			self.phase_times['handler'].record(int((t_handler - t_start) * 1e6))
+		if update is not None:
+			self.phase_times['update'].record(int((t_update - t_handler) * 1e6))
+		self.phase_times['flush'].record(int((t_flush - t_update) * 1e6))
+		if self.notifier is not None:
+			# Lebenszeichen erst nach der Ausgabe: haengt Verarbeitung oder pigpio, bleibt es aus
+			self.notifier.watchdog(now)
+
+	def profile_toggle(self):
+		"""Sampling-Profiler starten bzw. anhalten (SIGUSR1). Beim Anhalten wird das Profil im Folded-Format
+		nach dump_dir geschrieben. Anhalten und Schreiben laufen in einem Hilfsthread.
+		"""
+		if not self.profiler.active:
+			self.profiler.start()
+			print('Profiler started')
+			return
+		path = os.path.join(self.dump_dir, 'teamprojekt-profile-{}.folded'.format(time.strftime('%Y%m%d-%H%M%S')))
+		def finish():
+			self.profiler.stop()
+			samples = self.profiler.dump(path)
+			print('Profiler stopped, {} samples written to {}'.format(samples, path))
+		self.loop.run_in_executor(None, finish)
+
+	def stats(self):
+		"""Returns:
+			dict: Kennzahlen von Regeltakt, Abschnitten, Controller, Bus, Latenzen, Watchdog und Profiler
+		"""
+		stats = {
+			'time': time.time(),
+			'tick': {'rate': self.tick.rate, 'ticks': self.tick.ticks, 'overruns': self.tick.overruns},
+			'loop_lag_max': self.loop_lag_max,
+			'phases': {phase: histogram.summary() for phase, histogram in self.phase_times.items()},
+			'controller': {key: getattr(self.ctrl, key, None)
+				for key in ('events_received', 'frames_received', 'frames_dropped', 'reconnects')},
+			'rumble': self.ctrl.haptics.stats(),
+			'bus': self.bus.stats(),
+			'profiler': {'active': self.profiler.active, 'samples': self.profiler.samples},
+		}
+		if self.bus.latency is not None:
+			stats['latency'] = self.bus.latency.summary()
+		if self.watchdog is not None:
+			stats['watchdog'] = {'trips': self.watchdog.trips, 'tripped': self.watchdog.tripped,
+				'latency_last': self.watchdog.latency_last, 'latency_max': self.watchdog.latency_max}
+		if self.realtime is not None:
+			stats['realtime'] = self.realtime.applied
+		if self.setpoints is not None:
+			stats['setpoints'] = self.setpoints.stats()
+		if self.notifier is not None:
+			stats['notify'] = self.notifier.stats()
+		if self.telemetry is not None:
+			stats['telemetry'] = self.telemetry.stats()
+		return stats
+
+	def stats_dump(self, path:str=None):
+		"""Kennzahlen als JSON schreiben (SIGUSR2). Zusammenstellen und Schreiben laufen in einem Hilfsthread.
+		Args:
+			path (str, optional): Ausgabedatei. Defaults to None (dump_dir/teamprojekt-stats-<Zeit>.json).
+		"""
+		if path is None:
+			path = os.path.join(self.dump_dir, 'teamprojekt-stats-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+		def write():
+			stats = self.stats()
+			with open(path, 'w') as f:
+				json.dump(stats, f, indent=2)
+			print('Stats written to {}'.format(path))
+		self.loop.run_in_executor(None, write)
+
+	async def ramp_task(self):
+		"""Rampe der RC-Regler im eigenen Takt nachfuehren.
+		"""
+		tick = ControlTick(1. / self.ramp.period)
+		while True:
+			await tick.wait_async()
+			await self.output(self.ramp.step)
+
+	async def telemetry_task(self):
+		"""Telemetrie im eigenen Takt senden, verworfene Pakete halten den Regeltakt nicht auf.
+		"""
+		tick = ControlTick(self.telemetry.rate)
+		while True:
+			await tick.wait_async()
+			self.telemetry.publish(self)
+
+	async def housekeeping_task(self):
+		"""Verwaltungsaufgaben: Verzoegerung der Eventschleife messen, im Echtzeitbetrieb gezielt Speicher freigeben
+		und Failsafe sowie niedrigen Ladezustand per Vibration melden.
+		"""
+		while True:
+			t_start = time.monotonic()
+			await asyncio.sleep(self.housekeeping_period)
+			lag = time.monotonic() - t_start - self.housekeeping_period
+			if lag > self.loop_lag_max:
+				self.loop_lag_max = lag
+			if self.realtime is not None:
+				self.realtime.collect()
+			self.haptics_check()
+
+	def haptics_check(self):
+		"""Ausgeloesten Failsafe und niedrigen Ladezustand einmalig am Controller melden (nicht blockierend).
+		"""
+		if self.watchdog is not None and self.watchdog.trips != self.trips_notified:
+			self.trips_notified = self.watchdog.trips
+			self.ctrl.rumble('failsafe')
+		battery = self.battery = self.ctrl.battery()
+		if battery is None:
+			return
+		if battery <= self.battery_low and not self.battery_warned:
+			self.ctrl.rumble('low_battery')
+		self.battery_warned = battery <= self.battery_low
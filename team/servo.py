@@ -6,13 +6,13 @@ __email__ = "teamprojekt@tuhh.de"
 __copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
 __version__ = "2023.1.2"
 
-import pigpio
+from bus import Bus
 import logging
 import traceback
 
 class Servo():
 	def __init__(self, gpio:int=17, deg_min:float=0., deg_max:float=180., deg_start:float=90., deg_trim:float=0., reverse:bool=False,
-	pw_min:int=500, pw_max:int=2400, pw_freq:int=50) -> None:
+	pw_min:int=500, pw_max:int=2400, pw_freq:int=50, deg_resolution:float=0.1, bus=None) -> None:
 		"""Klasse zur Ansteuerung eines RC-Servos mithilfe des Raspberry Pi über Software-PWM.
 		Args:
 			gpio (int, optional):   Hardware PWM Kanal 1: GPIO 12 oder 18.
@@ -26,12 +26,9 @@ class Servo():
 			reverse (bool, optional): Richtungsumkehr. Defaults to False.
 			pw_min (int, optional): Minimale Steuerpulsweite (min:500). Defaults to 500.
 			pw_max (int, optional): Maximale Steuerpulsweite (max:2500). Defaults to 2400.
+			deg_resolution (float, optional): Aufloesung der vorberechneten Winkel-Pulsweiten-Tabelle. Defaults to 0.1.
+			bus (Bus, optional): Aktor-Bus mit gemeinsamer pigpio-Verbindung. Defaults to None (Bus.shared()).
 		"""
-		hpwm_pin=[12,13,18,19]
-		if gpio in hpwm_pin:
-			self.hpwm=True
-		else:
-			self.hpwm=False
 		self.gpio = gpio
 		self.deg_min = deg_min
 		self.deg_max = deg_max
@@ -41,8 +38,15 @@ class Servo():
 		self.pw_min = pw_min
 		self.pw_max = pw_max
 		self.pw_freq = pw_freq
-		self.servo = pigpio.pi()
-		self.servo.set_mode(self.gpio, pigpio.OUTPUT)
+		self.deg_resolution = deg_resolution
+		self.pw_table = [self.deg_2_pw(min(deg_min + idx * deg_resolution, deg_max))
+			for idx in range(int(round((deg_max - deg_min) / deg_resolution)) + 1)]
+		self.pw_val = None
+		self.pw_hits = 0
+		self.pw_skips = 0
+		self.writes = 0
+		self.bus = Bus.shared() if bus is None else bus
+		self.bus.register(self.gpio, self.pw_freq)
 		self.deg_val = None
 		self.servo_write(self.deg_start)
 
@@ -50,7 +54,7 @@ class Servo():
 		"""Destruktor zum Loeschen der Servo-Objektreferenzen, z.B. beim Beenden des Programms.
 		"""
 		self.servo_write(self.deg_start)
-		self.servo.stop()
+		self.bus.release(self.gpio)
 
 	def servo_reset(self, deg_trim:float=0.):
 		"""Zuruecksetzen des Servos: Startpositionswinkel und Trimmungswinkel.
@@ -62,8 +66,36 @@ class Servo():
 
 	def servo_write(self, deg_val:float):
 		"""Einstellen eines vorgegebenen Positionswinkels am Servo.
+		Die Pulsweite kommt aus der vorberechneten Tabelle (Aufloesung deg_resolution),
+		unveraenderte Pulsweiten werden nicht erneut ausgegeben.
+		Args:
+			deg_val (float): Zielpositionswinkel
+		"""
+		deg_val = self.servo_limit(deg_val)
+		pw_val = self.pw_table[int((deg_val - self.deg_min) / self.deg_resolution + 0.5)]
+		self.pw_hits += 1
+		self.deg_val = deg_val
+		if pw_val == self.pw_val:
+			self.pw_skips += 1
+			return
+		self.__write(pw_val)
+		self.pw_val = pw_val
+
+	def servo_pw(self, deg_val:float):
+		"""Steuerpulsweite eines Positionswinkels aus der Tabelle, ohne Ausgabe.
+		Args:
+			deg_val (float): Zielpositionswinkel
+		Returns:
+			int: Steuerpulsweite
+		"""
+		return self.pw_table[int((self.servo_limit(deg_val) - self.deg_min) / self.deg_resolution + 0.5)]
+
+	def servo_limit(self, deg_val:float):
+		"""Richtungsumkehr, Trimmung und Begrenzung eines Positionswinkels.
 		Args:
 			deg_val (float): Zielpositionswinkel
+		Returns:
+			float: Begrenzter Positionswinkel
 		"""
 		if self.reverse:
 			deg_val = self.deg_max - deg_val + self.deg_trim
@@ -73,8 +105,7 @@ class Servo():
 			deg_val = self.deg_min
 		elif deg_val > self.deg_max:
 			deg_val = self.deg_max
-		self.__write(self.deg_2_pw(deg_val))
-		self.deg_val = deg_val
+		return deg_val
 
 	def servo_trim(self):
 		"""Aktuellen Positionswinkel als Trimmungswinkel einstellen.
@@ -90,21 +121,21 @@ class Servo():
 		"""
 		pw_val = int(self.pw_min + (self.pw_max - self.pw_min) * (deg_val - self.deg_min) / (self.deg_max - self.deg_min))
 		return pw_val
+
+	def servo_stats(self):
+		"""Zaehler der Pulsweiten-Tabelle.
+		Returns:
+			dict: Tabellenzugriffe (hits), unterdrueckte (skips) und ausgegebene Schreibzugriffe (writes)
+		"""
+		return {'hits': self.pw_hits, 'skips': self.pw_skips, 'writes': self.writes}
+
 	def __write(self, pw_val:int):
 		"""[Private] Passt Output an verwendeten Pin an. Nicht Standalone verwenden!
 		Args:
 			pw_val (int): Zielpulsweite
 		"""
-		try:
-			if self.hpwm:
-				conv=pw_val*self.pw_freq
-				self.servo.hardware_PWM(self.gpio, self.pw_freq, conv)
-			else:
-				self.servo.set_servo_pulsewidth(self.gpio, pw_val)
-			return True
-		except Exception as e:
-			print(e)
-			return False
+		self.writes += 1
+		return self.bus.write(self.gpio, pw_val)
 
 
 def servo_test():
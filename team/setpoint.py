@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Klassen und Testfunktion fuer eine lokale Sollwert-Schnittstelle (Unix-Datagramm-Socket) fuer autonome Steuerung.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from latency import Histogram
+import math
+import os
+import socket
+import struct
+import tempfile
+import time
+
+# Datagramm: Sendezeitpunkt (time.time()), Folgenummer, Kanalmaske, reserviert, Sollwerte
+# Kanaele: Servos in Grad, dann RC-Regler in us, in der Reihenfolge der Anmeldung
+SETPOINT = struct.Struct('<dIHH8f')
+MAX_CHANNELS = 8
+SETPOINT_PATH = os.path.join(tempfile.gettempdir(), 'teamprojekt-setpoint.sock')
+
+class SetpointServer():
+	def __init__(self, servos:list, escs:list, path:str=SETPOINT_PATH, timeout:float=0.2, manual_hold:float=1.,
+	manual_active=None):
+		"""Sollwert-Server: nimmt Sollwerte fuer alle Servos und RC-Regler ueber einen Unix-Datagramm-Socket an.
+		Pro Regeltakt wird nur der neueste Sollwert je Kanal ausgegeben (latest-value-wins).
+		Der Controller hat immer Vorrang: nach jeder Controller-Eingabe und solange eine Eingabe gehalten wird
+		(manual_active), werden Sollwerte fuer manual_hold ignoriert.
+		Bleiben Sollwerte laenger als timeout aus, werden die RC-Regler gestoppt und die Servos gehalten.
+		Nicht endliche Sollwerte verwerfen das ganze Datagramm, alle anderen werden auf den Bereich des Kanals begrenzt.
+		Args:
+			servos (list): Servos, Kanaele 0..len(servos)-1
+			escs (list): RC-Regler, folgende Kanaele
+			path (str, optional): Pfad des Sockets. Defaults to SETPOINT_PATH.
+			timeout (float, optional): Maximales Alter eines Sollwerts in s. Defaults to 0.2.
+			manual_hold (float, optional): Vorrang des Controllers nach der letzten Eingabe in s. Defaults to 1..
+			manual_active (callable, optional): Liefert True, solange der Pilot eine Eingabe haelt
+									(z.B. Mapping.manual_active). Defaults to None (nur Eingabe-Events).
+		"""
+		if len(servos) + len(escs) > MAX_CHANNELS:
+			raise ValueError('Setpoint interface supports at most {} channels'.format(MAX_CHANNELS))
+		self.servos = list(servos)
+		self.escs = list(escs)
+		self.path = path
+		self.timeout = timeout
+		self.manual_hold = manual_hold
+		self.manual_active = manual_active
+		# Bereich je Kanal: Servos in Grad, RC-Regler in us
+		self.limits = [(servo.deg_min, servo.deg_max) for servo in self.servos] + [(esc.pw_min, esc.pw_max) for esc in self.escs]
+		self.sock = None
+		self.loop = None
+		self.on_receive = None
+		# Vorab angelegter Empfangspuffer und Sollwerte, pro Datagramm wird nichts kopiert ausser den Werten selbst
+		self._buffer = bytearray(SETPOINT.size)
+		self._view = memoryview(self._buffer)
+		self.values = [None] * MAX_CHANNELS
+		self.pending = 0
+		self.t_send = 0.
+		self.t_received = None
+		self.t_manual = None
+		self.active = False
+		self.received = 0
+		self.invalid = 0
+		self.superseded = 0
+		self.applied = 0
+		self.stale = 0
+		self.overrides = 0
+		self.t_start = None
+		self.latency_receive = Histogram()
+		self.latency_apply = Histogram()
+
+	def open(self, loop, on_receive=None):
+		"""Socket anlegen und in der asyncio-Eventschleife lesen.
+		Args:
+			loop (asyncio.AbstractEventLoop): Laufende Eventschleife
+			on_receive (callable, optional): Wird bei jedem gueltigen Sollwert aufgerufen, z.B. Watchdog.feed. Defaults to None.
+		"""
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * SETPOINT.size)
+		self.sock.bind(self.path)
+		os.chmod(self.path, 0o660)
+		self.sock.setblocking(False)
+		self.loop = loop
+		self.on_receive = on_receive
+		self.t_start = time.monotonic()
+		loop.add_reader(self.sock.fileno(), self.receive)
+
+	def close(self):
+		"""Socket schliessen und entfernen.
+		"""
+		if self.sock is None:
+			return
+		self.loop.remove_reader(self.sock.fileno())
+		self.sock.close()
+		self.sock = None
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+	def receive(self):
+		"""Alle anstehenden Datagramme lesen, je Kanal bleibt der neueste Sollwert (Aufruf durch die Eventschleife).
+		"""
+		while True:
+			try:
+				size = self.sock.recv_into(self._buffer)
+			except (BlockingIOError, InterruptedError):
+				break
+			now = time.time()
+			if size != SETPOINT.size:
+				self.invalid += 1
+				continue
+			t_send, seq, mask, _, *values = SETPOINT.unpack_from(self._view)
+			channels = [channel for channel in range(len(self.limits)) if mask & (1 << channel)]
+			if not all(math.isfinite(values[channel]) for channel in channels):
+				# NaN oder inf wuerden erst bei der Ausgabe im Regeltakt scheitern
+				self.invalid += 1
+				continue
+			if self.pending:
+				self.superseded += 1
+			for channel in channels:
+				value_min, value_max = self.limits[channel]
+				self.values[channel] = min(max(values[channel], value_min), value_max)
+			self.pending |= mask
+			self.t_send = t_send
+			self.t_received = time.monotonic()
+			self.received += 1
+			self.latency_receive.record(int((now - t_send) * 1e6))
+			if self.on_receive is not None:
+				self.on_receive()
+
+	def manual(self, now:float=None):
+		"""Controller-Eingabe melden: Sollwerte werden fuer manual_hold ignoriert.
+		Args:
+			now (float, optional): Zeitpunkt (time.monotonic). Defaults to None (jetzt).
+		"""
+		self.t_manual = time.monotonic() if now is None else now
+		if self.active:
+			self.overrides += 1
+			self.active = False
+
+	def apply(self, now:float=None, bus=None):
+		"""Neueste Sollwerte ausgeben, falls der Controller keinen Vorrang hat (einmal pro Regeltakt).
+		Veraltete Sollwerte stoppen die RC-Regler einmalig.
+		Args:
+			now (float, optional): Taktzeitpunkt (time.monotonic). Defaults to None (jetzt).
+			bus (Bus, optional): Bus fuer die Latenzmessung (cause). Defaults to None.
+		Returns:
+			bool: True, wenn die Sollwerte die Ausgaenge steuern
+		"""
+		now = time.monotonic() if now is None else now
+		if self.manual_active is not None and self.manual_active():
+			# Gehaltener Trigger oder Stick sendet keine Events, haelt den Vorrang aber trotzdem
+			self.manual(now)
+		if self.t_manual is not None and now - self.t_manual < self.manual_hold:
+			self.pending = 0
+			return False
+		if self.t_received is None:
+			return False
+		if now - self.t_received > self.timeout:
+			if self.active:
+				self.stale += 1
+				self.active = False
+				for esc in self.escs:
+					esc.esc_write(esc.pw_stop)
+			self.pending = 0
+			return False
+		self.active = True
+		if not self.pending:
+			return True
+		if bus is not None:
+			bus.cause = (self.t_send, time.time())
+		n_servos = len(self.servos)
+		for channel, servo in enumerate(self.servos):
+			if self.pending & (1 << channel):
+				servo.servo_write(self.values[channel])
+		for channel, esc in enumerate(self.escs, n_servos):
+			if self.pending & (1 << channel):
+				esc.esc_write(int(self.values[channel]), safety=True)
+		if bus is not None:
+			bus.cause = None
+		self.pending = 0
+		self.applied += 1
+		self.latency_apply.record(int((time.time() - self.t_send) * 1e6))
+		return True
+
+	def stats(self):
+		"""Returns:
+			dict: Zaehler, Empfangsrate und Latenzen (Senden->Empfang, Senden->Ausgabe) in us
+		"""
+		elapsed = time.monotonic() - self.t_start if self.t_start is not None else 0.
+		return {
+			'active': self.active,
+			'received': self.received,
+			'received_per_sec': self.received / elapsed if elapsed else 0.,
+			'applied': self.applied,
+			'superseded': self.superseded,
+			'invalid': self.invalid,
+			'stale': self.stale,
+			'overrides': self.overrides,
+			'latency_receive': self.latency_receive.summary(),
+			'latency_apply': self.latency_apply.summary(),
+		}
+
+
+class SetpointClient():
+	def __init__(self, path:str=SETPOINT_PATH):
+		"""Sollwert-Client fuer Autonomie-Skripte.
+		Args:
+			path (str, optional): Pfad des Sockets. Defaults to SETPOINT_PATH.
+		"""
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+		self.sock.connect(path)
+		self._buffer = bytearray(SETPOINT.size)
+		self.seq = 0
+		self.sent = 0
+		self.dropped = 0
+
+	def send(self, values:dict):
+		"""Sollwerte senden, nicht angegebene Kanaele bleiben unveraendert.
+		Ist der Empfangspuffer des Servers voll, wird der Sollwert verworfen statt zu blockieren.
+		Args:
+			values (dict): Sollwert je Kanal, {channel: value}, Servos in Grad, RC-Regler in us
+		Returns:
+			bool: False, falls der Sollwert verworfen wurde
+		"""
+		mask = 0
+		setpoints = [0.] * MAX_CHANNELS
+		for channel, value in values.items():
+			mask |= 1 << channel
+			setpoints[channel] = value
+		self.seq += 1
+		SETPOINT.pack_into(self._buffer, 0, time.time(), self.seq, mask, 0, *setpoints)
+		try:
+			self.sock.send(self._buffer, socket.MSG_DONTWAIT)
+		except BlockingIOError:
+			self.dropped += 1
+			return False
+		self.sent += 1
+		return True
+
+	def close(self):
+		self.sock.close()
+
+
+def setpoint_test(rate:float=1000., duration:float=3., tick_rate:float=50.):
+	"""Sollwert-Testfunktion ohne Hardware: ein Client-Thread sendet mit rate, der Server gibt im Regeltakt an SimPi aus.
+	Prueft zusaetzlich den Stopp der RC-Regler bei veralteten Sollwerten, das Verwerfen nicht endlicher und das
+	Begrenzen zu grosser Sollwerte sowie den Vorrang eines gehaltenen Controller-Eingangs ohne neue Events.
+	Args:
+		rate (float, optional): Senderate in Hz. Defaults to 1000..
+		duration (float, optional): Sendedauer in s. Defaults to 3..
+		tick_rate (float, optional): Frequenz des Regeltakts in Hz. Defaults to 50..
+	"""
+	import asyncio
+	import threading
+	from sim import SimPi
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	from ramp import EscRamp
+	from tick import ControlTick
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	servos = [Servo(12, bus=bus), Servo(13, bus=bus)]
+	escs = [Esc(5, bus=bus, arm=False, pw_slew=1e6), Esc(6, bus=bus, arm=False, pw_slew=1e6)]
+	ramp = EscRamp(escs)
+	path = os.path.join(tempfile.gettempdir(), 'teamprojekt-setpoint-test.sock')
+	held = [False]
+	server = SetpointServer(servos, escs, path, manual_active=lambda: held[0])
+
+	def client():
+		setpoints = SetpointClient(path)
+		setpoints.send({0: 90., 2: float('nan')})
+		setpoints.send({0: 1000., 2: 5000.})
+		period = 1. / rate
+		t_next = time.monotonic()
+		t_end = t_next + duration
+		idx = 0
+		while t_next < t_end:
+			idx += 1
+			setpoints.send({0: 45. + idx % 90, 1: 135. - idx % 90, 2: 1600 + idx % 300, 3: 1400 - idx % 300})
+			t_next += period
+			delay = t_next - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+		setpoints.close()
+		print('Client: {} sent, {} dropped'.format(setpoints.sent, setpoints.dropped))
+
+	async def control():
+		server.open(asyncio.get_running_loop())
+		thread = threading.Thread(target=client, daemon=True)
+		thread.start()
+		tick = ControlTick(tick_rate)
+		t_start = time.monotonic()
+		t_end = t_start + duration + 2 * server.timeout + 0.1
+		while time.monotonic() < t_end:
+			now = await tick.wait_async()
+			# Gehaltener Trigger in der Mitte des Laufs, der Controller sendet dabei keine Events
+			held[0] = 0.3 * duration < now - t_start < 0.5 * duration
+			applied = server.applied
+			server.apply(now, bus)
+			if held[0]:
+				applied_held.append(server.applied - applied)
+			ramp.step(now)
+			bus.flush()
+		server.close()
+
+	applied_held = []
+	asyncio.run(control())
+	stats = server.stats()
+	print('Server: {received} received ({received_per_sec:.0f}/s), {applied} applied, {superseded} superseded, {stale} stale'.format(**stats))
+	for name in ('latency_receive', 'latency_apply'):
+		print('{:<16} p50 {:>6} us  p99 {:>6} us  max {:>6} us'.format(name, stats[name]['p50'], stats[name]['p99'], stats[name]['max']))
+	assert stats['received'] > 0.9 * rate * duration, 'setpoints lost'
+	assert stats['stale'] == 1, 'stale setpoints did not stop the ESCs'
+	assert stats['invalid'] == 1, 'non-finite setpoint not rejected'
+	assert max(pw_val for t, pw_val in pi.trace(5)) <= escs[0].pw_max, 'setpoint not limited to the ESC range'
+	assert applied_held and not any(applied_held), 'setpoints applied while a manual input was held'
+	for esc in escs:
+		assert pi.trace(esc.gpio)[-1][1] == esc.pw_stop, 'ESC on GPIO {} not stopped after timeout'.format(esc.gpio)
+
+if __name__ == "__main__":
+	setpoint_test()
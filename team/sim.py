@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Klassen und Testfunktion zur Simulation von pigpio und Controller ohne Raspberry Pi.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from evdev import InputEvent, AbsInfo, ecodes
+import asyncio
+import errno
+import math
+import random
+import time
+
+class SimPi():
+	def __init__(self):
+		"""Ersatz fuer pigpio.pi(): zeichnet alle Ausgaben mit Zeitstempel auf.
+		Aufzeichnung je Aufruf: (time.monotonic(), Funktion, GPIO Pin, Pulsweite).
+		"""
+		self.connected = True
+		self.calls = []
+		self.modes = {}
+		self.pw_vals = {}
+
+	def set_mode(self, gpio:int, mode:int):
+		self.modes[gpio] = mode
+
+	def set_servo_pulsewidth(self, gpio:int, pw_val:int):
+		self.calls.append((time.monotonic(), 'set_servo_pulsewidth', gpio, pw_val))
+		self.pw_vals[gpio] = pw_val
+
+	def hardware_PWM(self, gpio:int, pw_freq:int, duty:int):
+		self.calls.append((time.monotonic(), 'hardware_PWM', gpio, duty // pw_freq))
+		self.pw_vals[gpio] = duty // pw_freq
+
+	def write(self, gpio:int, level:int):
+		self.calls.append((time.monotonic(), 'write', gpio, level))
+
+	def get_servo_pulsewidth(self, gpio:int):
+		return self.pw_vals.get(gpio, 0)
+
+	def stop(self):
+		self.connected = False
+
+	def trace(self, gpio:int):
+		"""Pulsweitenverlauf eines Kanals.
+		Args:
+			gpio (int): GPIO Pin
+		Returns:
+			list: (Zeitpunkt, Pulsweite) je Ausgabe
+		"""
+		return [(t, pw_val) for t, call, call_gpio, pw_val in self.calls if call_gpio == gpio]
+
+
+class ReplayDevice():
+	def __init__(self, events, realtime:bool=True, speed:float=1., name:str='Xbox Wireless Controller', uniq:str='',
+	link_lost:float=None):
+		"""Ersatz fuer evdev.InputDevice: spielt aufgezeichnete oder synthetische Events ab.
+		Args:
+			events (iterable): Events als (Zeit in s ab Start, type, code, value)
+			realtime (bool, optional): Events zeitgerecht abspielen, sonst so schnell wie moeglich. Defaults to True.
+			speed (float, optional): Abspielgeschwindigkeit im Echtzeitbetrieb. Defaults to 1..
+			name (str, optional): Geraetename. Defaults to 'Xbox Wireless Controller'.
+			uniq (str, optional): Eindeutige Kennung (Bluetooth MAC). Defaults to ''.
+			link_lost (float, optional): Verbindungsabbruch in s ab Start, danach schlagen Abfragen am Geraet
+								(capabilities, active_keys) mit ENODEV fehl. Defaults to None (kein Abbruch).
+		"""
+		self.events = list(events)
+		self.realtime = realtime
+		self.speed = speed
+		self.name = name
+		self.path = '/dev/input/replay'
+		self.phys = 'replay'
+		self.uniq = uniq
+		self.link_lost = link_lost
+		self.index = 0
+		self.t_start = None
+		self.state = {}
+		self.effects = {}
+		self.ff_played = []
+
+	@classmethod
+	def from_recording(cls, path:str, **kwargs):
+		"""Eingaben aus einer Ringdatei des Flugschreibers abspielen.
+		Args:
+			path (str): Pfad der Ringdatei
+		Returns:
+			ReplayDevice: Abspielgeraet
+		"""
+		from recorder import recorder_read, SOURCE_OUTPUT
+		gpios, records = recorder_read(path)
+		records = [record for record in records if record[1] != SOURCE_OUTPUT]
+		t0 = records[0][0] if records else 0.
+		events = []
+		for timestamp, source, code, value, pw_vals in records:
+			events.append((timestamp - t0, source, code, value))
+			events.append((timestamp - t0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+		return cls(events, **kwargs)
+
+	@property
+	def finished(self):
+		"""Returns:
+			bool: True, wenn alle Events abgespielt sind
+		"""
+		return self.index >= len(self.events)
+
+	def _due(self, t_rel:float):
+		"""[Private] Wartezeit bis zum Abspielzeitpunkt eines Events in s.
+		"""
+		if self.t_start is None:
+			self.t_start = time.monotonic()
+			self.t_wall = time.time()
+		if not self.realtime:
+			return 0.
+		return self.t_start + t_rel / self.speed - time.monotonic()
+
+	def _next(self):
+		"""[Private] Naechstes Event mit aktuellem Zeitstempel erzeugen.
+		"""
+		t_rel, event_type, code, value = self.events[self.index]
+		self.index += 1
+		if event_type == ecodes.EV_KEY or event_type == ecodes.EV_ABS:
+			self.state[(event_type, code)] = value
+		timestamp = self.t_wall + t_rel / self.speed if self.realtime else time.time()
+		sec = int(timestamp)
+		return InputEvent(sec, int((timestamp - sec) * 1e6), event_type, code, value)
+
+	def read(self):
+		"""Alle faelligen Events ohne Blockieren lesen (wie InputDevice.read()).
+		Raises:
+			BlockingIOError: Kein Event faellig
+		"""
+		if self.finished or self._due(self.events[self.index][0]) > 0:
+			raise BlockingIOError()
+		events = []
+		while not self.finished and self._due(self.events[self.index][0]) <= 0:
+			events.append(self._next())
+		return iter(events)
+
+	def read_loop(self):
+		"""Blockierend alle Events abspielen (wie InputDevice.read_loop()).
+		"""
+		while not self.finished:
+			delay = self._due(self.events[self.index][0])
+			if delay > 0:
+				time.sleep(delay)
+			yield self._next()
+
+	async def async_read_loop(self):
+		"""Alle Events in der asyncio-Eventschleife abspielen (wie InputDevice.async_read_loop()).
+		"""
+		while not self.finished:
+			delay = self._due(self.events[self.index][0])
+			await asyncio.sleep(max(0., delay))
+			yield self._next()
+
+	def _link_check(self):
+		"""[Private] Nach dem simulierten Verbindungsabbruch wie ein entferntes Geraet mit ENODEV fehlschlagen.
+		"""
+		if self.link_lost is not None and self.t_start is not None and \
+			time.monotonic() - self.t_start >= self.link_lost / self.speed:
+			raise OSError(errno.ENODEV, 'No such device')
+
+	def capabilities(self, verbose:bool=False, absinfo:bool=True):
+		"""Bisher abgespielte Tasten und Achsen, Achsen mit aktuellem Wert (wie InputDevice.capabilities()).
+		"""
+		self._link_check()
+		keys = sorted(code for event_type, code in self.state if event_type == ecodes.EV_KEY)
+		axes = sorted((code, value) for (event_type, code), value in self.state.items() if event_type == ecodes.EV_ABS)
+		capabilities = {}
+		if keys:
+			capabilities[ecodes.EV_KEY] = keys
+		if axes:
+			capabilities[ecodes.EV_ABS] = [(code, AbsInfo(value, 0, 0, 0, 0, 0)) if absinfo else code for code, value in axes]
+		return capabilities
+
+	def active_keys(self, verbose:bool=False):
+		"""Returns:
+			list: Aktuell gedrueckte Tasten (wie InputDevice.active_keys())
+		"""
+		self._link_check()
+		return [code for (event_type, code), value in self.state.items() if event_type == ecodes.EV_KEY and value]
+
+	def leds(self, verbose:bool=False):
+		return []
+
+	def upload_effect(self, effect):
+		"""Force-Feedback-Effekt speichern (wie InputDevice.upload_effect()).
+		Returns:
+			int: ID des Effekts
+		"""
+		effect_id = len(self.effects)
+		self.effects[effect_id] = effect
+		return effect_id
+
+	def erase_effect(self, effect_id:int):
+		self.effects.pop(effect_id, None)
+
+	def write(self, etype:int, code:int, value:int):
+		"""Event an das Geraet schreiben (wie InputDevice.write()), abgespielte Effekte werden in ff_played gesammelt.
+		"""
+		if etype == ecodes.EV_FF:
+			if code not in self.effects:
+				raise OSError(22, 'Invalid argument')
+			self.ff_played.append((time.monotonic(), code, value))
+
+	def close(self):
+		self.index = len(self.events)
+
+
+def trigger_sweep(code:int=9, duration:float=2., rate:float=200., t_start:float=0., trigger_max:int=1023):
+	"""Synthetische Trigger-Events: einmal von 0 bis Vollausschlag und zurueck.
+	Args:
+		code (int, optional): Achse (ABS_RT: 9, ABS_LT: 10). Defaults to 9.
+		duration (float, optional): Dauer in s. Defaults to 2..
+		rate (float, optional): Eventrate in Hz. Defaults to 200..
+		t_start (float, optional): Startzeit in s. Defaults to 0..
+		trigger_max (int, optional): Vollausschlag. Defaults to 1023.
+	Returns:
+		list: Events als (Zeit, type, code, value)
+	"""
+	events = []
+	count = max(2, int(duration * rate))
+	for idx in range(count):
+		t = t_start + idx / rate
+		value = int(round(trigger_max * math.sin(math.pi * idx / (count - 1))))
+		events.append((t, ecodes.EV_ABS, code, value))
+		events.append((t, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+	return events
+
+def stick_jitter(code:int=1, duration:float=2., rate:float=500., t_start:float=0., center:int=32737, amplitude:int=2000, seed:int=0):
+	"""Synthetische Stick-Events: Rauschen um die Mittelstellung.
+	Args:
+		code (int, optional): Achse (ABS_LSY: 1). Defaults to 1.
+		duration (float, optional): Dauer in s. Defaults to 2..
+		rate (float, optional): Eventrate in Hz. Defaults to 500..
+		t_start (float, optional): Startzeit in s. Defaults to 0..
+		center (int, optional): Mittelstellung. Defaults to 32737.
+		amplitude (int, optional): Maximale Abweichung. Defaults to 2000.
+		seed (int, optional): Startwert des Zufallsgenerators. Defaults to 0.
+	Returns:
+		list: Events als (Zeit, type, code, value)
+	"""
+	rng = random.Random(seed)
+	events = []
+	for idx in range(int(duration * rate)):
+		t = t_start + idx / rate
+		events.append((t, ecodes.EV_ABS, code, center + rng.randint(-amplitude, amplitude)))
+		events.append((t, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+	return events
+
+def button_storm(codes:tuple=(304, 310, 311), duration:float=2., rate:float=100., t_start:float=0., seed:int=0):
+	"""Synthetische Tasten-Events: zufaelliges Druecken und Loslassen.
+	Args:
+		codes (tuple, optional): Tasten. Defaults to (304, 310, 311) (A, LB, RB).
+		duration (float, optional): Dauer in s. Defaults to 2..
+		rate (float, optional): Eventrate in Hz. Defaults to 100..
+		t_start (float, optional): Startzeit in s. Defaults to 0..
+		seed (int, optional): Startwert des Zufallsgenerators. Defaults to 0.
+	Returns:
+		list: Events als (Zeit, type, code, value)
+	"""
+	rng = random.Random(seed)
+	state = {code: 0 for code in codes}
+	events = []
+	for idx in range(int(duration * rate)):
+		t = t_start + idx / rate
+		code = rng.choice(codes)
+		state[code] ^= 1
+		events.append((t, ecodes.EV_KEY, code, state[code]))
+		events.append((t, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+	for code in codes:
+		if state[code]:
+			events.append((t_start + duration, ecodes.EV_KEY, code, 0))
+			events.append((t_start + duration, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+	return events
+
+
+def sim_test(path:str=None, realtime:bool=True):
+	"""Simulations-Testfunktion: main.main() ohne Hardware mit abgespielten Events ausfuehren.
+	Ohne Aufzeichnung werden ein Trigger-Sweep und eine Stick-Auslenkung abgespielt, geprueft werden der PWM-Verlauf
+	und die Latenzmessung aller Kanaele.
+	Args:
+		path (str, optional): Ringdatei des Flugschreibers zum Abspielen. Defaults to None.
+		realtime (bool, optional): Events zeitgerecht abspielen. Defaults to True.
+	"""
+	import main
+	import os
+	import tempfile
+	pi = SimPi()
+	if path is None:
+		# Linker Stick (Y) von 0.5 bis 1 s ausgelenkt: Servos werden im Regeltakt nachgefuehrt
+		stick = [(0.5 + idx / 50., ecodes.EV_ABS, 1, 32737 + 10000 + 100 * idx) for idx in range(25)] + [(1., ecodes.EV_ABS, 1, 32737)]
+		events = trigger_sweep(duration=2.) + [(t, ecodes.EV_SYN, ecodes.SYN_REPORT, 0) for t, _, _, _ in stick] + stick
+		dev = ReplayDevice(sorted(events, key=lambda event: (event[0], event[1] == ecodes.EV_SYN)) +
+			[(2.5, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)], realtime=realtime)
+	else:
+		dev = ReplayDevice.from_recording(path, realtime=realtime)
+	record_path = os.path.join(tempfile.gettempdir(), 'sim_flight.rec')
+	stats = main.main(pi=pi, dev=dev, record_path=record_path)
+	for gpio in (12, 13, 5, 6):
+		trace = pi.trace(gpio)
+		print('GPIO {}: {} writes, last {}'.format(gpio, len(trace), trace[-1][1] if trace else None))
+	for gpio in (5, 6):
+		assert pi.trace(gpio)[-1][1] == 1500, 'ESC on GPIO {} did not end at pw_stop'.format(gpio)
+	if path is None and realtime:
+		assert max(pw for t, pw in pi.trace(6)) > 1900, 'ESC on GPIO 6 did not follow the trigger'
+		for name, stages in stats['latency'].items():
+			assert stages['event_write']['count'] > 0, 'no latency samples for {}'.format(name)
+
+if __name__ == "__main__":
+	import sys
+	sim_test(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Klasse und Funktionen fuer einen parallelen Systemstart mit Bootprotokoll.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+class BootLog():
+	def __init__(self, t_start:float=None):
+		"""Bootprotokoll: Beginn und Ende jeder Startphase relativ zum Programmstart.
+		Phasen duerfen parallel in verschiedenen Threads laufen.
+		Args:
+			t_start (float, optional): Programmstart (time.monotonic()). Defaults to None (jetzt).
+		"""
+		self.t_start = time.monotonic() if t_start is None else t_start
+		self.t_ready = None
+		self.t_boot_ready = None
+		self.phases = []
+		self.lock = threading.Lock()
+
+	def add(self, name:str, t_begin:float, t_end:float=None):
+		"""Abgeschlossene Phase eintragen (Zeitpunkte time.monotonic()).
+		Args:
+			name (str): Name der Phase
+			t_begin (float): Beginn
+			t_end (float, optional): Ende. Defaults to None (jetzt).
+		"""
+		t_end = time.monotonic() if t_end is None else t_end
+		with self.lock:
+			self.phases.append((name, t_begin - self.t_start, t_end - self.t_start))
+
+	@contextmanager
+	def phase(self, name:str):
+		"""Dauer eines Codeblocks als Phase eintragen.
+		Args:
+			name (str): Name der Phase
+		"""
+		t_begin = time.monotonic()
+		try:
+			yield
+		finally:
+			self.add(name, t_begin)
+
+	def ready(self):
+		"""Zeitpunkt der Betriebsbereitschaft festhalten (nur beim ersten Aufruf).
+		Returns:
+			float: Zeit vom Programmstart bis zur Betriebsbereitschaft in s
+		"""
+		if self.t_ready is None:
+			self.t_ready = time.monotonic()
+			self.t_boot_ready = time.clock_gettime(time.CLOCK_BOOTTIME)
+		return self.t_ready - self.t_start
+
+	def summary(self):
+		"""Returns:
+			dict: Beginn, Ende und Dauer je Phase in s, boot_to_ready ab Programmstart, process_to_ready ab
+				Prozessstart (inkl. Interpreter) und kernel_to_ready ab Systemstart in s (oder None)
+		"""
+		with self.lock:
+			phases = {name: {'begin': t_begin, 'end': t_end, 'duration': t_end - t_begin}
+				for name, t_begin, t_end in self.phases}
+		summary = {'phases': phases, 'boot_to_ready': None, 'process_to_ready': None, 'kernel_to_ready': None}
+		if self.t_ready is not None:
+			summary['boot_to_ready'] = self.t_ready - self.t_start
+			summary['kernel_to_ready'] = self.t_boot_ready
+			t_process = process_start()
+			if t_process is not None:
+				summary['process_to_ready'] = self.t_boot_ready - t_process
+		return summary
+
+	def report(self):
+		"""Returns:
+			str: Tabelle der Startphasen in ms
+		"""
+		summary = self.summary()
+		lines = ['{:<12} {:>9} {:>9} {:>9}'.format('phase', 'begin', 'end', 'duration')]
+		for name, phase in sorted(summary['phases'].items(), key=lambda item: item[1]['begin']):
+			lines.append('{:<12} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+				name, 1e3 * phase['begin'], 1e3 * phase['end'], 1e3 * phase['duration']))
+		if summary['boot_to_ready'] is not None:
+			lines.append('{:<12} {:>29.1f}'.format('ready', 1e3 * summary['boot_to_ready']))
+		if summary['process_to_ready'] is not None:
+			lines.append('{:<12} {:>29.1f}'.format('process', 1e3 * summary['process_to_ready']))
+		if summary['kernel_to_ready'] is not None:
+			lines.append('{:<12} {:>29.1f}'.format('kernel', 1e3 * summary['kernel_to_ready']))
+		return '\n'.join(lines)
+
+
+def process_start():
+	"""Startzeitpunkt des eigenen Prozesses aus /proc/self/stat, vor Interpreterstart und Importen.
+	Returns:
+		float: Startzeitpunkt in s seit Systemstart (CLOCK_BOOTTIME), None falls nicht verfuegbar
+	"""
+	try:
+		with open('/proc/self/stat') as f:
+			stat = f.read()
+		# Feld 22 (starttime) in Takten, gezaehlt nach dem in Klammern stehenden Programmnamen
+		return int(stat.rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+	except (OSError, ValueError, IndexError):
+		return None
+
+
+def esc_arm_all(escs:list):
+	"""Warten bis alle RC-Regler scharfgeschaltet sind.
+	Die Regler muessen mit arm=False erstellt worden sein, dann laufen ihre Wartezeiten gleichzeitig.
+	Args:
+		escs (list): RC-Regler
+	"""
+	for esc in sorted(escs, key=lambda esc: esc.t_armed):
+		esc.esc_arm_wait()
+
+def startup_parallel(boot:BootLog, tasks:dict):
+	"""Startphasen gleichzeitig in eigenen Threads ausfuehren und auf alle warten.
+	Args:
+		boot (BootLog): Bootprotokoll
+		tasks (dict): Funktion je Phasenname, {name: callable}
+	Returns:
+		dict: Rueckgabewert je Phasenname
+	Raises:
+		Exception: Erster Fehler einer Phase, nachdem alle Phasen beendet sind
+	"""
+	def run(name, func):
+		with boot.phase(name):
+			return func()
+	with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix='startup') as pool:
+		futures = {name: pool.submit(run, name, func) for name, func in tasks.items()}
+	return {name: future.result() for name, future in futures.items()}
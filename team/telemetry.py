@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""Klassen und Testfunktion fuer einen Telemetrie-Datenstrom per UDP zu einer Bodenstation.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+from evdev import ecodes
+from latency import Histogram
+from collections import namedtuple
+import math
+import socket
+import struct
+import time
+
+TELEMETRY_PORT = 5005
+TELEMETRY_MAGIC = b'AS'
+TELEMETRY_VERSION = 1
+# Paket (102 Bytes): Kopf, Controller, Pulsweiten in us, Trimmung, Regeltakt in us, Failsafe
+PACKET = struct.Struct('<2sBBId' 'IHbb4iHH' '4H' '4f' '7I' 'HHBx')
+Telemetry = namedtuple('Telemetry', (
+	'magic', 'version', 'flags', 'seq', 't_send',
+	'frames', 'buttons', 'dpad_x', 'dpad_y', 'stick_lx', 'stick_ly', 'stick_rx', 'stick_ry', 'trigger_l', 'trigger_r',
+	'pw_servo_left', 'pw_servo_right', 'pw_esc_left', 'pw_esc_right',
+	'trim_servo_left', 'trim_servo_right', 'trim_speed_left', 'trim_speed_right',
+	'ticks', 'overruns', 'tick_late_mean', 'tick_late_max', 'flush_mean', 'flush_max', 'loop_lag_max',
+	'trips', 'reconnects', 'battery',
+))
+# Bits in flags
+FLAG_TRIPPED = 1
+FLAG_SETPOINTS = 2
+FLAG_RESET = 4
+# Reihenfolge der Tasten in buttons (Bit 0 zuerst)
+BUTTONS = ('BTN_A', 'BTN_B', 'BTN_X', 'BTN_Y', 'BTN_LB', 'BTN_RB', 'BTN_BACK', 'BTN_START', 'BTN_LS', 'BTN_RS')
+AXES = ('ABS_DX', 'ABS_DY', 'ABS_LSX', 'ABS_LSY', 'ABS_RSX', 'ABS_RSY', 'ABS_LT', 'ABS_RT')
+
+class TelemetryPublisher():
+	def __init__(self, host:str='127.0.0.1', port:int=TELEMETRY_PORT, rate:float=10., mapping=None):
+		"""Telemetrie-Sender: ein Paket fester Laenge je Intervall mit Controller-Zustand, Pulsweiten, Trimmung,
+		Regeltakt und Failsafe. Gesendet wird ohne Blockieren, ist der Sendepuffer voll oder das Netz weg,
+		wird das Paket verworfen. Wird von der Laufzeitumgebung in einem eigenen Task getaktet.
+		Args:
+			host (str, optional): Adresse der Bodenstation, auch Broadcast. Defaults to '127.0.0.1'.
+			port (int, optional): UDP Port. Defaults to TELEMETRY_PORT.
+			rate (float, optional): Paketrate in Hz. Defaults to 10..
+			mapping (Mapping, optional): Zuordnung mit Trimmung. Defaults to None (Trimmung NaN).
+		Raises:
+			socket.gaierror: Adresse der Bodenstation nicht aufloesbar
+		"""
+		# Einmalig aufloesen, sendto() mit einem Hostnamen wuerde bei jedem Paket im Regeltakt DNS abfragen
+		self.address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+		self.rate = rate
+		self.mapping = mapping
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+		self.sock.setblocking(False)
+		self._buffer = bytearray(PACKET.size)
+		self._codes = None
+		self.seq = 0
+		self.sent = 0
+		self.dropped = 0
+		self.publish_time = Histogram()
+
+	def pack(self, runtime):
+		"""Aktuellen Zustand in den Sendepuffer schreiben.
+		Args:
+			runtime (Runtime): Laufzeitumgebung
+		Returns:
+			bytearray: Paket
+		"""
+		ctrl = runtime.ctrl
+		if self._codes is None:
+			self._codes = ([getattr(ctrl, name) for name in BUTTONS], [getattr(ctrl, name) for name in AXES])
+		buttons, axes = self._codes
+		state = ctrl.state
+		pressed = 0
+		for bit, code in enumerate(buttons):
+			if state.get((ecodes.EV_KEY, code)):
+				pressed |= 1 << bit
+		dx, dy, lsx, lsy, rsx, rsy, lt, rt = (state.get((ecodes.EV_ABS, code), 0) for code in axes)
+		servos = (list(runtime.servos) + [None, None])[:2]
+		escs = (list(runtime.escs) + [None, None])[:2]
+		pw_vals = [(actuator.pw_val or 0) if actuator is not None else 0 for actuator in servos + escs]
+		mapping = self.mapping
+		trims = [getattr(mapping, name, math.nan) for name in ('trimServoLeft', 'trimServoRight', 'trimSpeedLeft', 'trimSpeedRight')]
+		flags = 0
+		trips = 0
+		watchdog = runtime.watchdog
+		if watchdog is not None:
+			trips = watchdog.trips
+			if watchdog.tripped:
+				flags |= FLAG_TRIPPED
+		if runtime.setpoints is not None and runtime.setpoints.active:
+			flags |= FLAG_SETPOINTS
+		if getattr(mapping, 'is_reset', False):
+			flags |= FLAG_RESET
+		tick_late = runtime.phase_times['tick_late']
+		flush = runtime.phase_times['flush']
+		battery = runtime.battery
+		self.seq += 1
+		PACKET.pack_into(self._buffer, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, flags, self.seq & 0xffffffff, time.time(),
+			ctrl.frames_received & 0xffffffff, pressed, dx, dy, lsx, lsy, rsx, rsy, lt, rt,
+			*pw_vals, *trims,
+			runtime.tick.ticks & 0xffffffff, runtime.tick.overruns & 0xffffffff,
+			tick_late.total // tick_late.count if tick_late.count else 0, min(tick_late.max, 0xffffffff),
+			flush.total // flush.count if flush.count else 0, min(flush.max, 0xffffffff),
+			min(int(runtime.loop_lag_max * 1e6), 0xffffffff),
+			min(trips, 0xffff), min(ctrl.reconnects, 0xffff), 255 if battery is None else battery)
+		return self._buffer
+
+	def publish(self, runtime):
+		"""Ein Paket senden, blockiert nie.
+		Args:
+			runtime (Runtime): Laufzeitumgebung
+		Returns:
+			bool: False, falls das Paket verworfen wurde
+		"""
+		t_start = time.perf_counter()
+		self.pack(runtime)
+		try:
+			self.sock.sendto(self._buffer, socket.MSG_DONTWAIT, self.address)
+			self.sent += 1
+			return True
+		except OSError:
+			# Sendepuffer voll (BlockingIOError) oder Netz nicht erreichbar
+			self.dropped += 1
+			return False
+		finally:
+			self.publish_time.record(int((time.perf_counter() - t_start) * 1e6))
+
+	def close(self):
+		self.sock.close()
+
+	def stats(self):
+		"""Returns:
+			dict: Ziel, Rate, gesendete und verworfene Pakete, Dauer je Paket in us
+		"""
+		return {'address': '{}:{}'.format(*self.address), 'rate': self.rate, 'sent': self.sent, 'dropped': self.dropped,
+			'publish_time': self.publish_time.summary()}
+
+
+class TelemetryReceiver():
+	def __init__(self, host:str='', port:int=TELEMETRY_PORT):
+		"""Telemetrie-Empfaenger fuer die Bodenstation: dekodiert die Pakete und zaehlt verlorene Pakete ueber die Folgenummer.
+		Args:
+			host (str, optional): Lokale Adresse. Defaults to '' (alle).
+			port (int, optional): UDP Port. Defaults to TELEMETRY_PORT.
+		"""
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind((host, port))
+		self.port = self.sock.getsockname()[1]
+		self._buffer = bytearray(PACKET.size + 1)
+		self.seq = None
+		self.received = 0
+		self.lost = 0
+		self.reordered = 0
+		self.invalid = 0
+		self.latency = Histogram()
+		self.last = None
+
+	def receive(self, timeout:float=None):
+		"""Pakete empfangen, bis timeout abgelaufen ist.
+		Args:
+			timeout (float, optional): Wartezeit in s. Defaults to None (ein Paket).
+		Returns:
+			list: Empfangene Pakete als Telemetry
+		"""
+		packets = []
+		t_end = None if timeout is None else time.monotonic() + timeout
+		while True:
+			remaining = None if t_end is None else t_end - time.monotonic()
+			if remaining is not None and remaining <= 0:
+				break
+			self.sock.settimeout(remaining)
+			try:
+				size = self.sock.recv_into(self._buffer)
+			except socket.timeout:
+				break
+			t_recv = time.time()
+			packet = self.decode(self._buffer, size)
+			if packet is None:
+				continue
+			packets.append(packet)
+			self.latency.record(int((t_recv - packet.t_send) * 1e6))
+			if t_end is None:
+				break
+		return packets
+
+	def decode(self, data, size:int=None):
+		"""Paket pruefen, dekodieren und Verluste zaehlen.
+		Args:
+			data (bytes): Paket
+			size (int, optional): Laenge. Defaults to None (len(data)).
+		Returns:
+			Telemetry: Paket oder None, falls ungueltig
+		"""
+		size = len(data) if size is None else size
+		if size != PACKET.size or data[:2] != TELEMETRY_MAGIC or data[2] != TELEMETRY_VERSION:
+			self.invalid += 1
+			return None
+		packet = Telemetry(*PACKET.unpack_from(data))
+		if self.seq is not None:
+			if packet.seq > self.seq:
+				self.lost += packet.seq - self.seq - 1
+			else:
+				self.reordered += 1
+		if self.seq is None or packet.seq > self.seq:
+			self.seq = packet.seq
+		self.received += 1
+		self.last = packet
+		return packet
+
+	def close(self):
+		self.sock.close()
+
+	def stats(self):
+		"""Returns:
+			dict: Empfangene, verlorene, vertauschte und ungueltige Pakete, Latenz in us (Uhren muessen synchron sein)
+		"""
+		return {'received': self.received, 'lost': self.lost, 'reordered': self.reordered, 'invalid': self.invalid,
+			'latency': self.latency.summary()}
+
+
+def telemetry_format(packet:Telemetry):
+	"""Returns:
+		str: Einzeilige Anzeige eines Pakets
+	"""
+	flag_text = ''.join(flag if packet.flags & bit else '-' for flag, bit in (('F', FLAG_TRIPPED), ('S', FLAG_SETPOINTS), ('R', FLAG_RESET)))
+	button_text = ''.join(name[4:] + ' ' for bit, name in enumerate(BUTTONS) if packet.buttons & (1 << bit)).strip() or '-'
+	return ('#{seq:<7} {flag_text} servo {pw_servo_left:4}/{pw_servo_right:4} esc {pw_esc_left:4}/{pw_esc_right:4} '
+		'trim {trim_servo_left:6.1f}/{trim_servo_right:6.1f} {trim_speed_left:+.2f}/{trim_speed_right:+.2f} '
+		'LT {trigger_l:4} RT {trigger_r:4} late {tick_late_mean}/{tick_late_max} us flush {flush_mean}/{flush_max} us '
+		'trips {trips} batt {battery_text} [{button_text}]').format(flag_text=flag_text, button_text=button_text,
+		battery_text='?' if packet.battery == 255 else '{}%'.format(packet.battery), **packet._asdict())
+
+
+def telemetry_test(duration:float=3., rate:float=50., port:int=0):
+	"""Telemetrie-Testfunktion ohne Hardware ueber Loopback: Laufzeitumgebung mit SimPi und ReplayDevice
+	(Trigger-Sweep) sendet, ein Empfaenger-Thread dekodiert. Prueft Verluste und die letzten Pulsweiten.
+	Args:
+		duration (float, optional): Dauer des Trigger-Sweeps in s. Defaults to 3..
+		rate (float, optional): Paketrate in Hz. Defaults to 50..
+		port (int, optional): UDP Port, 0 fuer einen freien Port. Defaults to 0.
+	"""
+	import asyncio
+	import threading
+	from evdev import ecodes
+	from sim import SimPi, ReplayDevice, trigger_sweep
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	from dev import Controller
+	from ramp import EscRamp
+	from mapping import Mapping
+	from runtime import Runtime
+	receiver = TelemetryReceiver('127.0.0.1', port)
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	escs = [Esc(5, bus=bus, arm=False), Esc(6, bus=bus, arm=False)]
+	servos = [Servo(12, 0, 180, 90, 0, False, bus=bus), Servo(13, 0, 180, 90, 0, False, bus=bus)]
+	ctrl = Controller(dev=ReplayDevice(trigger_sweep(duration=duration) + [(duration + 0.5, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)]))
+	mapping = Mapping(ctrl, servos, escs)
+	publisher = TelemetryPublisher('127.0.0.1', receiver.port, rate, mapping)
+	runtime = Runtime(ctrl, bus, escs, servos, EscRamp(escs), telemetry=publisher)
+	packets = []
+	done = threading.Event()
+	def receive():
+		while not done.is_set():
+			packets.extend(receiver.receive(0.1))
+	thread = threading.Thread(target=receive, daemon=True)
+	thread.start()
+	asyncio.run(runtime.run(mapping.handle_frame, mapping.update))
+	publisher.publish(runtime)
+	time.sleep(0.1)
+	done.set()
+	thread.join()
+	receiver.close()
+	publisher.close()
+	print(telemetry_format(packets[-1]))
+	stats = publisher.stats()
+	print('Publisher: {sent} sent, {dropped} dropped, publish p50 {p50} us p99 {p99} us max {max} us'.format(
+		**stats, **{key: stats['publish_time'][key] for key in ('p50', 'p99', 'max')}))
+	print('Receiver: {received} received, {lost} lost, {invalid} invalid, latency p99 {p99} us'.format(
+		**receiver.stats(), p99=receiver.latency.percentile(99)))
+	assert len(packets) >= 0.9 * rate * duration, 'too few packets'
+	assert receiver.lost == 0 and receiver.invalid == 0, 'packets lost on loopback'
+	assert max(packet.pw_esc_right for packet in packets) > 1900, 'ESC pulsewidth not in telemetry'
+	assert (packets[-1].pw_esc_left, packets[-1].pw_esc_right) == (escs[0].pw_val, escs[1].pw_val), 'last pulsewidths differ'
+	assert packets[-1].frames == ctrl.frames_received, 'controller frames differ'
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Ground station: receive and decode the telemetry stream live.')
+	parser.add_argument('-p', '--port', type=int, default=TELEMETRY_PORT, help='UDP port (default: {})'.format(TELEMETRY_PORT))
+	parser.add_argument('--host', default='', help='local address to listen on (default: all)')
+	parser.add_argument('--test', action='store_true', help='run the loopback test')
+	args = parser.parse_args()
+	if args.test:
+		telemetry_test()
+	else:
+		receiver = TelemetryReceiver(args.host, args.port)
+		print('Listening on UDP port {}'.format(receiver.port))
+		try:
+			while True:
+				for packet in receiver.receive(1.):
+					print(telemetry_format(packet), flush=True)
+		except KeyboardInterrupt:
+			print('{received} received, {lost} lost, {reordered} reordered, {invalid} invalid'.format(**receiver.stats()))
+		finally:
+			receiver.close()
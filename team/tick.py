@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Klasse fuer einen festen Regeltakt der Hauptschleife.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import asyncio
+import time
+
+class ControlTick():
+	def __init__(self, rate:float=50.):
+		"""Fester Regeltakt. Jeder Aufruf von wait() blockiert bis zum naechsten Taktzeitpunkt.
+		Args:
+			rate (float, optional): Taktfrequenz in Hz, sinnvollerweise die PWM-Frequenz. Defaults to 50..
+		"""
+		self.rate = rate
+		self.period = 1. / rate
+		self.ticks = 0
+		self.overruns = 0
+		self.t_next = None
+
+	def wait(self):
+		"""Warten bis zum naechsten Taktzeitpunkt.
+		Returns:
+			float: Taktzeitpunkt (time.monotonic)
+		"""
+		delay = self.advance()
+		if delay > 0:
+			time.sleep(delay)
+		return self.t_next
+
+	async def wait_async(self):
+		"""Wie wait(), aber ohne die asyncio-Eventschleife zu blockieren.
+		Returns:
+			float: Taktzeitpunkt (time.monotonic)
+		"""
+		delay = self.advance()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		return self.t_next
+
+	def advance(self):
+		"""Naechsten Taktzeitpunkt bestimmen.
+		Liegt der Zeitpunkt bereits in der Vergangenheit (Ueberlauf), wird ohne Warten
+		weitergemacht und der Takt neu ausgerichtet, statt verpasste Takte nachzuholen.
+		Returns:
+			float: Wartezeit bis zum Taktzeitpunkt in s
+		"""
+		now = time.monotonic()
+		if self.t_next is None:
+			self.t_next = now
+		self.t_next += self.period
+		self.ticks += 1
+		if self.t_next > now:
+			return self.t_next - now
+		self.overruns += 1
+		self.t_next = now
+		return 0.
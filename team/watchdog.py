@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Klasse und Testfunktion fuer einen Failsafe-Watchdog bei Verbindungsverlust zum Controller.
+"""
+
+__email__ = "teamprojekt@tuhh.de"
+__copyright__ = "Technische Universitaet Hamburg, Institut fuer Kunststoffe und Verbundwerkstoffe"
+__version__ = "2023.1.0"
+
+import threading
+import time
+
+class Watchdog():
+	def __init__(self, bus, escs:list, servos:list, deadline:float=1., period:float=0.01):
+		"""Failsafe-Watchdog als eigener Thread, unabhaengig von der Hauptschleife.
+		Kommt laenger als deadline kein Lebenszeichen, werden alle RC-Regler auf pw_stop
+		und alle Servos auf deg_start gesetzt. Die Reaktionszeit ist durch period begrenzt.
+		Lebenszeichen sind Controller-Frames, Sollwerte und die regelmaessige Verbindungspruefung der
+		Laufzeitumgebung (Runtime.link_task), ein gehaltener Eingang ohne Events loest daher nicht aus.
+		Args:
+			bus (Bus): Aktor-Bus aller Servos und RC-Regler
+			escs (list): RC-Regler
+			servos (list): Servos
+			deadline (float, optional): Maximale Zeit ohne Controller-Event in s. Defaults to 1..
+			period (float, optional): Pruefintervall in s. Defaults to 0.01.
+		"""
+		self.bus = bus
+		self.escs = escs
+		self.servos = servos
+		self.deadline = deadline
+		self.period = period
+		self.t_feed = None
+		self.tripped = False
+		self.trips = 0
+		self.latency_last = 0.
+		self.latency_max = 0.
+		self._thread = None
+		self._stop = threading.Event()
+
+	def feed(self, now:float=None):
+		"""Watchdog zuruecksetzen, bei jedem Lebenszeichen des Controllers aufrufen.
+		Das erste Event schaltet den Watchdog scharf.
+		Args:
+			now (float, optional): Zeitpunkt (time.monotonic). Defaults to None.
+		"""
+		self.t_feed = time.monotonic() if now is None else now
+		self.tripped = False
+
+	def check(self, now:float=None):
+		"""Pruefen, ob die Frist abgelaufen ist und ggf. Failsafe ausloesen.
+		Args:
+			now (float, optional): Zeitpunkt (time.monotonic). Defaults to None.
+		Returns:
+			bool: True, falls der Failsafe ausgeloest wurde
+		"""
+		if now is None:
+			now = time.monotonic()
+		t_feed = self.t_feed
+		if t_feed is None or self.tripped or now - t_feed <= self.deadline:
+			return False
+		self.trip(t_feed + self.deadline)
+		return True
+
+	def trip(self, t_deadline:float=None):
+		"""Failsafe ausloesen: Ausgabe direkt an pigpiod, danach Zustand der Aktoren nachziehen.
+		Args:
+			t_deadline (float, optional): Ablaufzeitpunkt der Frist fuer die Latenzmessung. Defaults to None.
+		"""
+		pw_vals = {esc.gpio: esc.pw_stop for esc in self.escs}
+		for servo in self.servos:
+			pw_vals[servo.gpio] = servo.servo_pw(servo.deg_start)
+		self.bus.failsafe(pw_vals)
+		if t_deadline is not None:
+			self.latency_last = time.monotonic() - t_deadline
+			if self.latency_last > self.latency_max:
+				self.latency_max = self.latency_last
+		self.tripped = True
+		self.trips += 1
+		print('Failsafe: no controller input for {} s, motors stopped'.format(self.deadline))
+		# Kann blockieren, falls die Hauptschleife haengt. Die Ausgabe ist dann bereits sicher.
+		for esc in self.escs:
+			esc.esc_write(esc.pw_stop)
+		for servo in self.servos:
+			servo.servo_write(servo.deg_start)
+		self.bus.flush()
+
+	def start(self):
+		"""Watchdog als Hintergrund-Thread starten.
+		"""
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name='Watchdog', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		"""Hintergrund-Thread beenden.
+		"""
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout=1.)
+			self._thread = None
+
+	def _run(self):
+		"""[Private] Pruefschleife des Hintergrund-Threads.
+		"""
+		while not self._stop.wait(self.period):
+			self.check()
+
+
+def watchdog_test(deadline:float=0.2, period:float=0.01, margin:float=0.01):
+	"""Watchdog-Testfunktion ohne Hardware.
+	Ein simulierter Controller sendet Events und faellt dann aus, waehrend die Hauptschleife
+	im Bus haengt. Gemessen wird die Zeit vom Ablauf der Frist bis zur Stopp-Ausgabe.
+	Danach haelt ein verbundener Controller den Trigger laenger als die Frist ohne neue Events,
+	der Watchdog darf dabei nicht ausloesen (watchdog_hold_test).
+	Args:
+		deadline (float, optional): Frist des Watchdogs in s. Defaults to 0.2.
+		period (float, optional): Pruefintervall des Watchdogs in s. Defaults to 0.01.
+		margin (float, optional): Zulaessige Zusatzlatenz ueber period hinaus in s. Defaults to 0.01.
+	"""
+	from evdev import ecodes
+	from sim import SimPi, ReplayDevice, trigger_sweep
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	escs = [Esc(5, bus=bus, arm=False), Esc(6, bus=bus, arm=False)]
+	servos = [Servo(12, bus=bus), Servo(13, bus=bus)]
+	watchdog = Watchdog(bus, escs, servos, deadline=deadline, period=period)
+	watchdog.start()
+	# Simulierter Controller: Trigger-Events mit 100 Hz, danach Verbindungsverlust
+	dev = ReplayDevice(trigger_sweep(duration=0.5, rate=100.))
+	for event in dev.read_loop():
+		if event.type != ecodes.EV_ABS:
+			continue
+		watchdog.feed()
+		for esc in escs:
+			esc.esc_write(1600 + event.value // 4)
+		bus.flush()
+	t_lost = watchdog.t_feed
+	# Haengende Hauptschleife: der Bus bleibt gesperrt
+	bus.lock.acquire()
+	time.sleep(deadline + 5 * period)
+	# Erste Stopp-Ausgabe je RC-Regler nach dem letzten Event
+	stops = [min((t for t, pw_val in pi.trace(gpio) if t > t_lost and pw_val == 1500), default=None) for gpio in (5, 6)]
+	bus.lock.release()
+	watchdog.stop()
+	assert watchdog.tripped, 'watchdog did not trip'
+	assert None not in stops, 'not all ESCs stopped'
+	reaction = max(stops) - t_lost
+	print('Reaction time: {:.1f} ms (deadline {:.0f} ms, latency {:.1f} ms)'.format(
+		1e3 * reaction, 1e3 * deadline, 1e3 * watchdog.latency_max))
+	assert reaction <= deadline + period + margin, 'reaction time out of bound'
+	watchdog_hold_test(deadline, period)
+
+def watchdog_hold_test(deadline:float=0.2, period:float=0.01, hold:float=3.):
+	"""Trigger bei Vollausschlag hold * deadline lang halten: die Verbindung besteht, es kommen aber keine Events.
+	Args:
+		deadline (float, optional): Frist des Watchdogs in s. Defaults to 0.2.
+		period (float, optional): Pruefintervall des Watchdogs in s. Defaults to 0.01.
+		hold (float, optional): Haltedauer als Vielfaches der Frist. Defaults to 3..
+	"""
+	import asyncio
+	from evdev import ecodes
+	from sim import SimPi, ReplayDevice
+	from bus import Bus
+	from esc import Esc
+	from servo import Servo
+	from dev import Controller
+	from mapping import Mapping
+	from runtime import Runtime
+	pi = SimPi()
+	bus = Bus(pi=pi, auto_flush=False)
+	escs = [Esc(5, bus=bus, arm=False), Esc(6, bus=bus, arm=False)]
+	servos = [Servo(12, bus=bus), Servo(13, bus=bus)]
+	ctrl = Controller(dev=ReplayDevice([(0., ecodes.EV_ABS, 9, 1023), (0., ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+		(hold * deadline, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)]))
+	watchdog = Watchdog(bus, escs, servos, deadline=deadline, period=period)
+	mapping = Mapping(ctrl, servos, escs, watchdog=watchdog)
+	runtime = Runtime(ctrl, bus, escs, servos, watchdog=watchdog, signals=False)
+	asyncio.run(runtime.run(mapping.handle_frame, mapping.update))
+	pw_vals = [pw_val for t, pw_val in pi.trace(6)]
+	print('Held trigger: {} trips, GPIO 6 {}'.format(watchdog.trips, pw_vals))
+	assert watchdog.trips == 0, 'watchdog tripped while the trigger was held'
+	# Einziger Stopp nach dem Vollausschlag: Beenden der Laufzeitumgebung
+	assert pw_vals[-2:] == [escs[1].pw_max, escs[1].pw_stop], 'held trigger not kept until shutdown'
+
+if __name__ == "__main__":
+	watchdog_test()